@@ -4,15 +4,24 @@
 Cấu trúc tổng quát:
 - Cấu hình ứng dụng & thư mục tải lên/cache
 - Định nghĩa cột chuẩn cho từng sheet
+- Engine lưu trữ tuỳ chọn dạng cột (`ColumnarSheet`, module `columnar`) thay cho list dict
 - Bộ hàm tiện ích xử lý hàng/cột, ngày tháng, tiến độ
-- Cơ chế cache JSON: load/save trạng thái `data_store`
+- Cơ chế cache JSON: load/save trạng thái `data_store` (snapshot + nhật ký chỉnh sửa)
 - Endpoint giao diện chính và các hành động (import, add/delete row, update cell,
   đổi tên cột, chèn/xóa cột, export)
 - Bộ filter Jinja hỗ trợ hiển thị
+
+Các phần độc lập nằm ở module cạnh app.py, nhận cấu hình qua tham số (không đọc biến môi trường):
+`columnar` (engine dạng cột), `store_sqlite` (kho SQLite), `whatsapp` (gửi tin qua Twilio),
+`profiling` (lấy mẫu stack, lưu profile).
 """
 
-from flask import Flask, render_template, request, jsonify, abort, send_file
+from flask import Flask, render_template, request, jsonify, abort, send_file, make_response, g
+from markupsafe import Markup, escape
+import click
 from typing import Optional, List
+from collections import OrderedDict, deque
+import numpy as np
 import pandas as pd
 from werkzeug.utils import secure_filename
 import os
@@ -26,9 +35,36 @@ except Exception:
     # Không bắt buộc phải có python-dotenv; nếu thiếu sẽ dùng biến môi trường hệ thống
     pass
 import json
-from datetime import datetime, timedelta
+import re
+import sqlite3
+from datetime import date, datetime, timedelta
+import bisect
+import cProfile
+import gzip
+import heapq
+import hmac
+import ipaddress
+import itertools
+import threading
+import time
 import uuid
-import requests  
+import zlib
+from contextlib import contextmanager
+try:
+    # Tuỳ chọn: nén brotli cho response HTML/JSON; thiếu thư viện thì chỉ dùng gzip
+    import brotli
+except ImportError:
+    brotli = None
+try:
+    import fcntl
+except ImportError:
+    # Windows: không có khoá file kiểu POSIX -> chỉ hỗ trợ chạy một tiến trình
+    fcntl = None
+
+from columnar import ColumnarSheet
+from profiling import PROFILE_FILES, StackSampler, list_profile_ids, save_profile
+from store_sqlite import SqliteStore
+from whatsapp import WhatsAppDispatcher
 
 # --- Cảnh báo WhatsApp ---
 TWILIO_ACCOUNT_SID = os.environ.get('TWILIO_ACCOUNT_SID', '')
@@ -77,55 +113,91 @@ def _prepare_message_for_recipient(sheet_name: str, row: dict, to_number: str, b
         pass
     return body, variables
 
+"""Mapping row_id -> số WhatsApp bổ sung (`cache/phone_recipients.json`), chỉ đọc lại khi file thay đổi."""
 def _load_phone_recipients():
-    if os.path.exists(PHONE_RECIPIENTS_FILE):
-        try:
-            with open(PHONE_RECIPIENTS_FILE, 'r', encoding='utf-8') as f:
-                return json.load(f)
-        except Exception:
-            return {}
-    return {}
+    return _phone_recipients_cache.get()
+
+"""Tham số engine gửi WhatsApp (`whatsapp.WhatsAppDispatcher`): số luồng/kết nối, giới hạn tốc độ token bucket,
+số lần thử lại và backoff. `TWILIO_API_BASE` cho phép trỏ sang server giả lập (stub) khi kiểm thử.
+"""
+TWILIO_API_BASE = os.environ.get('TWILIO_API_BASE', 'https://api.twilio.com').rstrip('/')
+WHATSAPP_WORKERS = max(1, int(os.environ.get('WHATSAPP_WORKERS', '4') or 4))
+WHATSAPP_RATE_PER_SEC = float(os.environ.get('WHATSAPP_RATE_PER_SEC', '5') or 5)
+WHATSAPP_RATE_BURST = max(1, int(os.environ.get('WHATSAPP_RATE_BURST', '5') or 5))
+WHATSAPP_MAX_RETRIES = max(0, int(os.environ.get('WHATSAPP_MAX_RETRIES', '3') or 0))
+WHATSAPP_BACKOFF_BASE = float(os.environ.get('WHATSAPP_BACKOFF_BASE', '1') or 1)
+WHATSAPP_BACKOFF_MAX = 30.0
+WHATSAPP_TIMEOUT = (5, 15)  # (connect, read) giây
+
+_dispatcher_state = {'dispatcher': None}
+_dispatcher_lock = threading.Lock()
+
+"""Dispatcher dùng chung của tiến trình, dựng lần đầu từ cấu hình Twilio/WhatsApp ở trên."""
+def _get_dispatcher() -> WhatsAppDispatcher:
+    with _dispatcher_lock:
+        if _dispatcher_state['dispatcher'] is None:
+            _dispatcher_state['dispatcher'] = WhatsAppDispatcher(
+                TWILIO_ACCOUNT_SID, TWILIO_AUTH_TOKEN, TWILIO_WHATSAPP_FROM, content_sid=TWILIO_CONTENT_SID,
+                workers=WHATSAPP_WORKERS, rate=WHATSAPP_RATE_PER_SEC, burst=WHATSAPP_RATE_BURST,
+                max_retries=WHATSAPP_MAX_RETRIES, backoff_base=WHATSAPP_BACKOFF_BASE,
+                backoff_max=WHATSAPP_BACKOFF_MAX, timeout=WHATSAPP_TIMEOUT, api_base=TWILIO_API_BASE)
+        return _dispatcher_state['dispatcher']
 
 def _send_whatsapp(to_number: str, body: str, variables: Optional[dict] = None) -> bool:
     """Gửi tin nhắn WhatsApp qua Twilio. Trả về True nếu thành công.
 
     Nếu có `TWILIO_CONTENT_SID`, sẽ gửi qua Content API (template) để tránh lỗi 63016 (ngoài 24h window).
     `variables` là dict cho ContentVariables (JSON string) nếu dùng template có placeholders.
+    Dùng chung session/giới hạn tốc độ/thử lại với `WhatsAppDispatcher`.
     """
-    if not (TWILIO_ACCOUNT_SID and TWILIO_AUTH_TOKEN and TWILIO_WHATSAPP_FROM and to_number):
-        return False
-    url = f"https://api.twilio.com/2010-04-01/Accounts/{TWILIO_ACCOUNT_SID}/Messages.json"
-    data = {
-        'From': TWILIO_WHATSAPP_FROM,
-        'To': to_number
-    }
-    if TWILIO_CONTENT_SID:
-        # Gửi bằng Content Template SID
-        data['ContentSid'] = TWILIO_CONTENT_SID
-        if variables:
-            try:
-                data['ContentVariables'] = json.dumps(variables, ensure_ascii=False)
-            except Exception:
-                pass
-    else:
-        # Gửi freeform body (chỉ hoạt động trong 24h session)
-        data['Body'] = body
-    try:
-        resp = requests.post(url, data=data, auth=(TWILIO_ACCOUNT_SID, TWILIO_AUTH_TOKEN), timeout=10)
-        return resp.status_code in (200, 201)
-    except Exception:
-        return False
+    return _get_dispatcher().send({'to': to_number, 'body': body, 'variables': variables})['ok']
+
+"""Số WhatsApp hợp lệ, không trùng, giữ thứ tự."""
+def _valid_unique_numbers(numbers):
+    uniq = []
+    seen = set()
+    for n in numbers:
+        n = str(n).strip()
+        if not n:
+            continue
+        if not n.startswith('whatsapp:+'):
+            continue
+        if n not in seen:
+            uniq.append(n)
+            seen.add(n)
+    return uniq
 
-def _get_recipients_for_row(sheet_name: str, row: dict) -> List[str]:
+_owner_recipients_cache = {}
+
+"""Danh sách người nhận cố định của một đầu mối (số của đầu mối + các đầu mối luôn nhận), tính một lần cho mỗi đầu mối."""
+def _owner_recipients(key):
+    cached = _owner_recipients_cache.get(key)
+    if cached is None:
+        res = []
+        # Số chính theo đầu mối
+        if key:
+            num = OWNER_PHONE_MAP.get(key)
+            if num:
+                res.append(num)
+        # Luôn gửi tới các đầu mối luôn nhận
+        for always in ALWAYS_NOTIFY:
+            num = OWNER_PHONE_MAP.get(always)
+            if num:
+                res.append(num)
+        cached = _owner_recipients_cache[key] = tuple(_valid_unique_numbers(res))
+    return cached
+
+def _get_recipients_for_row(sheet_name: str, row: dict, recipients_cfg: Optional[dict] = None) -> List[str]:
     """Xác định danh sách số WhatsApp cần gửi dựa vào sheet và cột đầu mối.
 
     - Sizing: dùng "Đầu mối xử lý" để chọn số chính, đồng thời luôn thêm số của haipn và thongnv31.
     - CapPhat: dùng "Đầu mối P.HT" để chọn số chính, đồng thời luôn thêm số của haipn và thongnv31.
-    - Nếu có cấu hình trong `cache/phone_recipients.json` theo row_id, sẽ ưu tiên thêm vào danh sách.
+    - Nếu có cấu hình trong `cache/phone_recipients.json` theo row_id, sẽ ưu tiên thêm vào danh sách
+      (`recipients_cfg` cho phép truyền sẵn mapping khi xử lý nhiều hàng).
     - Rà trùng, chỉ giữ số hợp lệ bắt đầu bằng "whatsapp:+".
     """
-    recipients_cfg = _load_phone_recipients()
-    res = []
+    if recipients_cfg is None:
+        recipients_cfg = _load_phone_recipients()
     rid = row.get('row_id')
     if sheet_name == 'Sizing':
         key = str(row.get('Đầu mối xử lý', '')).strip()
@@ -133,41 +205,15 @@ def _get_recipients_for_row(sheet_name: str, row: dict) -> List[str]:
         key = str(row.get('Đầu mối P.HT', '')).strip()
     else:
         key = ''
-        # Normalize: ductn -> ductn8
-        if key.lower() == 'ductn':
-            key = 'ductn8'
-    # Số chính theo đầu mối
-    if key:
-        num = OWNER_PHONE_MAP.get(key)
-        if num:
-            res.append(num)
-    # Luôn gửi tới các đầu mối luôn nhận
-    for always in ALWAYS_NOTIFY:
-        num = OWNER_PHONE_MAP.get(always)
-        if num:
-            res.append(num)
+    res = list(_owner_recipients(key))
     # Nếu có mapping theo row_id, thêm vào
-    if rid:
-        user_num = recipients_cfg.get(rid)
-        if user_num:
-            res.append(user_num)
+    user_num = recipients_cfg.get(rid) if rid else None
+    if user_num:
+        res = _valid_unique_numbers(res + [user_num])
     # Nếu không có ai, dùng mặc định môi trường
-    default_to = os.environ.get('WHATSAPP_DEFAULT_TO', '')
-    if not res and default_to:
-        res.append(default_to)
-    # Lọc hợp lệ và unique
-    uniq = []
-    seen = set()
-    for n in res:
-        n = str(n).strip()
-        if not n:
-            continue
-        if not n.startswith('whatsapp:+'):
-            continue
-        if n not in seen:
-            uniq.append(n)
-            seen.add(n)
-    return uniq
+    if not res and not user_num:
+        res = _valid_unique_numbers([os.environ.get('WHATSAPP_DEFAULT_TO', '')])
+    return res
 
 def _build_whatsapp_body(row: dict) -> str:
     proj = str(row.get('Tên dự án - Mục đích sizing', '')).strip()
@@ -220,137 +266,506 @@ def _build_sr_deadline_body(row: dict, due_label: str, created_str: str) -> str:
         f"YÊU CẦU: THEO DÕI TIẾN ĐỘ DỰ ÁN."
     )
 
-def check_and_send_whatsapp_alerts():
-    """Quét sheet Sizing, gửi WhatsApp cho các dòng 'Đến hạn' hoặc 'Còn 1 ngày'."""
-    _refresh_sizing_progress()
-    recipients = _load_phone_recipients()  
-    sent = 0
-    for row in data_store.get('Sizing', []):
-        status = str(row.get('Tiến độ', '')).strip()
-        to_numbers = _get_recipients_for_row('Sizing', row)
-        if not to_numbers:
+"""Chỉ mục mốc cảnh báo (deadline index): hàng đợi ưu tiên theo thời gian các mốc ngưỡng sắp tới.
+
+Mỗi hàng Sizing/CapPhat sinh ra vài sự kiện (kind, due, từ ngày, đến ngày) là khoảng ngày mà cảnh báo đó
+được gửi: đến hạn / còn 1 ngày (theo ngày làm việc), muộn 1-2 ngày theo KPI, nhắc tạo SR (ngày tiếp nhận +0..+3)
+và tiến độ SR (ngày tạo mã SR +1, +2). Sự kiện nằm trong heap theo ngày bắt đầu; mỗi lượt cảnh báo chỉ lấy ra
+các sự kiện đã tới ngày nên chi phí tỉ lệ với số mốc đến hạn, không phụ thuộc kích thước bảng.
+
+Sửa ô trong `DEADLINE_COLS` hoặc thêm hàng -> tính lại sự kiện của riêng hàng đó (`_deadline_index_rows`);
+sheet bị thay hàng loạt hoặc đổi cấu hình ngày lễ -> dựng lại (lười) ở lượt kế tiếp (`_invalidate_deadlines`).
+Sự kiện cũ của hàng đã sửa/xoá không bị gỡ khỏi heap mà bị bỏ qua khi lấy ra (so phiên bản hàng).
+"""
+DEADLINE_COLS = {
+    'Sizing': {'Thời gian hoàn thành theo KPI'},
+    'CapPhat': {'Mã SR', 'Thời gian tiếp nhận y/c'},
+}
+
+class DeadlineIndex:
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.signature = None  # cấu hình ngày lễ lúc dựng; None = cần dựng lại
+        self.today = 0
+        self._heap = []        # (từ ngày, seq, sheet, row_id, phiên bản, kind, due, đến ngày)
+        self._active = []      # sự kiện đã tới ngày bắt đầu và chưa hết hạn
+        self._versions = {}    # (sheet, row_id) -> (phiên bản, số sự kiện)
+        self._seq = 0
+        self._stale = 0
+
+    def clear(self, signature, today=0):
+        self.signature, self.today = signature, today
+        self._heap, self._active, self._versions, self._stale = [], [], {}, 0
+
+    def set_row(self, sheet_name, row_id, events):
+        """Thay toàn bộ sự kiện của một hàng; `events` = [(từ ngày, đến ngày, kind, due)]."""
+        key = (sheet_name, row_id)
+        version, count = self._versions.get(key, (0, 0))
+        self._stale += count
+        events = [e for e in events if e[1] >= self.today]
+        self._versions[key] = (version + 1, len(events))
+        for start, end, kind, due in events:
+            self._seq += 1
+            heapq.heappush(self._heap, (start, self._seq, sheet_name, row_id, version + 1, kind, due, end))
+        # Dọn heap khi phần lớn là sự kiện cũ
+        if self._stale > 1024 and self._stale * 2 > len(self._heap):
+            self._heap = [e for e in self._heap if self._current(e)]
+            heapq.heapify(self._heap)
+            self._stale = 0
+
+    def forget_row(self, sheet_name, row_id):
+        version, count = self._versions.pop((sheet_name, row_id), (0, 0))
+        self._stale += count
+
+    def _current(self, event):
+        return self._versions.get((event[2], event[3]), (None,))[0] == event[4]
+
+    def pop_due(self, today):
+        """Các sự kiện có hiệu lực ở ngày `today` (ordinal): [(sheet, row_id, kind, due)]."""
+        self.today = today
+        while self._heap and self._heap[0][0] <= today:
+            self._active.append(heapq.heappop(self._heap))
+        self._active = [e for e in self._active if e[7] >= today and self._current(e)]
+        return [(e[2], e[3], e[5], e[6]) for e in self._active]
+
+    def __len__(self):
+        return len(self._heap) + len(self._active)
+
+_deadline_index = DeadlineIndex()
+
+"""Các mốc cảnh báo của một hàng theo lịch ngày làm việc `calendar` (cùng điều kiện với từng loại cảnh báo)."""
+def _deadline_events(sheet_name, row, calendar, sr_map):
+    if sheet_name == 'Sizing':
+        kpi = str(row.get('Thời gian hoàn thành theo KPI', '')).strip()
+        k = _date_ordinal(row.get('Thời gian hoàn thành theo KPI', ''))
+        if not k:
+            return []
+        # 'Đến hạn': không còn ngày làm việc nào trước KPI; 'Còn 1 ngày': còn đúng một
+        w1 = calendar.prev_working_day(k)
+        w2 = calendar.prev_working_day(w1)
+        return [(w1 + 1, k, 'kpi_due', kpi), (w2 + 1, w1, 'kpi_due_1', kpi),
+                (k + 1, k + 1, 'kpi_late_1', kpi), (k + 2, k + 2, 'kpi_late_2', kpi)]
+    if sheet_name != 'CapPhat':
+        return []
+    if not str(row.get('Mã SR', '')).strip():
+        r = _date_ordinal(row.get('Thời gian tiếp nhận y/c', ''))
+        if not r:
+            return []
+        received = str(row.get('Thời gian tiếp nhận y/c', '')).strip()
+        return [(r + d, r + d, kind, received) for d, kind in enumerate(('sr_reminder', 'sr_due', 'sr_late_1', 'sr_late_2'))]
+    created_str = sr_map.get(row.get('row_id'))
+    c = _date_ordinal(created_str) if created_str else 0
+    if not c:
+        return []
+    # Deadline = 2 ngày sau ngày tạo mã SR: còn 1 ngày (+1), đến hạn (+2)
+    return [(c + 1, c + 1, 'sr_deadline_1', created_str), (c + 2, c + 2, 'sr_deadline_0', created_str)]
+
+def _invalidate_deadlines(sheet_name):
+    if sheet_name in DEADLINE_COLS:
+        with _deadline_index.lock:
+            _deadline_index.signature = None
+
+"""Tính lại sự kiện cho các hàng vừa sửa/thêm: `rows` = [(sheet, hàng)]."""
+def _deadline_index_rows(rows):
+    rows = [(s, r) for s, r in rows if s in DEADLINE_COLS]
+    if not rows:
+        return
+    with _deadline_index.lock:
+        if _deadline_index.signature is None:
+            return
+        calendar = _business_calendar()
+        sr_map = _load_sr_created_map() if any(s == 'CapPhat' for s, _ in rows) else {}
+        for sheet_name, row in rows:
+            _deadline_index.set_row(sheet_name, row.get('row_id'), _deadline_events(sheet_name, row, calendar, sr_map))
+
+def _deadline_forget_row(sheet_name, row):
+    if sheet_name in DEADLINE_COLS:
+        with _deadline_index.lock:
+            _deadline_index.forget_row(sheet_name, row.get('row_id'))
+
+"""Các sự kiện đến hạn hôm nay (hoặc `today`); dựng lại chỉ mục nếu cần."""
+def _due_deadline_events(today=None):
+    calendar = _business_calendar(today)
+    with _deadline_index.lock:
+        if _deadline_index.signature != calendar.signature or calendar.today < _deadline_index.today:
+            _deadline_index.clear(calendar.signature, calendar.today)
+            sr_map = _load_sr_created_map()
+            for sheet_name in DEADLINE_COLS:
+                for row in data_store.get(sheet_name, []):
+                    events = _deadline_events(sheet_name, row, calendar, sr_map)
+                    if events:
+                        _deadline_index.set_row(sheet_name, row.get('row_id'), events)
+        return _deadline_index.pop_due(calendar.today)
+
+def _alert_group(kind):
+    # Thứ tự tin như khi quét bảng: KPI Sizing, nhắc tạo SR, tiến độ SR
+    return 0 if kind.startswith('kpi') else (2 if kind.startswith('sr_deadline') else 1)
+
+"""Thu thập (chưa gửi) các tin cảnh báo của một lần chạy từ các sự kiện đến hạn trong `_deadline_index`.
+
+Mỗi tin là dict: sheet, row_id, kind (loại cảnh báo), due (mốc ngày liên quan), to, body, variables.
+"""
+def _collect_whatsapp_alerts(today=None):
+    messages = []
+
+    def add(sheet_name, row, kind, due, to_numbers, base_body, vars0):
+        for num in to_numbers:
+            body, vars1 = _prepare_message_for_recipient(sheet_name, row, num, base_body, vars0)
+            messages.append({'sheet': sheet_name, 'row_id': row.get('row_id'), 'kind': kind, 'due': due,
+                             'to': num, 'body': body, 'variables': vars1})
+
+    recipients_cfg = _load_phone_recipients()
+    # Khoá ghi Sizing vì lượt chạy ghi lại 'Tiến độ' của hàng có cảnh báo (như `_refresh_sizing_window`);
+    # CapPhat chỉ đọc. Không chen giữa lúc sửa hàng, thứ tự khoá theo `SHEET_NAMES`
+    with write_sheets('Sizing'), read_sheets('Sizing', 'CapPhat'):
+        due_events = []
+        for sheet_name, rid, kind, due in _due_deadline_events(today):
+            row = get_row_by_id(sheet_name, rid)
+            if row is not None:
+                due_events.append((_alert_group(kind), sheet_name, row, kind, due))
+        due_events.sort(key=lambda e: e[0])
+        # 'Tiến độ' chỉ cần tính lại cho các hàng Sizing có cảnh báo (nội dung tin dùng cột này)
+        _refresh_sizing_progress([row for _, _, row, kind, _ in due_events if kind in ('kpi_due', 'kpi_due_1')], today)
+        for _, sheet_name, row, kind, due in due_events:
+            try:
+                if sheet_name == 'Sizing':
+                    # Gửi cảnh báo đến hạn / còn 1 ngày, muộn 1 ngày, muộn 2 ngày theo KPI
+                    to_numbers = _get_recipients_for_row('Sizing', row, recipients_cfg)
+                    project = str(row.get('Tên dự án - Mục đích sizing', '')).strip()
+                    if kind in ('kpi_due', 'kpi_due_1'):
+                        status = 'Đến hạn' if kind == 'kpi_due' else 'Còn 1 ngày'
+                        add('Sizing', row, kind, due, to_numbers, _build_whatsapp_body(row),
+                            {"project": project, "kpi": due, "status": status})
+                    else:
+                        overdue_days = int(kind[-1])
+                        add('Sizing', row, kind, due, to_numbers, _build_kpi_overdue_body(row, overdue_days),
+                            {"project": project, "kpi": due, "status": f"Muộn {overdue_days} ngày"})
+                    continue
+                to_numbers = _get_recipients_for_row('CapPhat', row, recipients_cfg)
+                project = str(row.get('Dự án', '')).strip()
+                if kind.startswith('sr_deadline_'):
+                    # Nhắc tiến độ sau khi đã có Mã SR: Deadline = 2 ngày sau ngày tạo mã SR (calendar days)
+                    due_label = 'Đến hạn' if kind == 'sr_deadline_0' else 'Còn 1 ngày'
+                    add('CapPhat', row, kind, due, to_numbers, _build_sr_deadline_body(row, due_label, due),
+                        {"project": project, "created": due, "due": due_label})
+                elif kind == 'sr_reminder':
+                    # Ngày tiếp nhận: gửi nhắc tạo SR
+                    add('CapPhat', row, kind, due, to_numbers, _build_sr_reminder_body(row),
+                        {"project": project, "received": due})
+                elif kind == 'sr_due':
+                    # Ngày hôm sau: gửi cảnh báo đã đến hạn tạo SR
+                    add('CapPhat', row, kind, due, to_numbers, _build_sr_overdue_body(row),
+                        {"project": project, "received": due})
+                else:
+                    # Muộn 1-2 ngày kể từ hạn tạo SR nếu chưa tạo mã SR
+                    label = f"Muộn {kind[-1]} ngày"
+                    body = (
+                        f"NHẮC TẠO MÃ SR ({label})\n"
+                        f"Dự án: {project}\n"
+                        f"Tiếp nhận: {due}\n"
+                        f"Vui lòng tạo mã SR ngay để đảm bảo tiến độ."
+                    )
+                    add('CapPhat', row, kind, due, to_numbers, body,
+                        {"project": project, "received": due, "status": label})
+            except Exception:
+                continue
+    return messages
+
+"""Chế độ gửi tổng hợp (digest): gom mọi cảnh báo của một lượt chạy theo người nhận.
+
+Bật bằng `WHATSAPP_DIGEST=1`. Mỗi người nhận một tin (hoặc vài tin nếu vượt `WHATSAPP_DIGEST_MAX_CHARS`,
+mặc định 1600 ký tự = giới hạn body của Twilio) ghép từ nội dung từng cảnh báo. Người chỉ có một cảnh báo
+vẫn nhận đúng tin gốc. Không cắt bỏ nội dung: cảnh báo dài hơn một tin được tách (theo dòng, rồi theo từ)
+thành nhiều đoạn nối tiếp nhau, đoạn sau mở đầu bằng `(tiếp)`. Với `TWILIO_CONTENT_SID`, tin tổng hợp
+truyền nội dung qua biến `body`/`count` nên template cần dùng các biến này.
+"""
+WHATSAPP_DIGEST = os.environ.get('WHATSAPP_DIGEST', '0').strip().lower() in ('1', 'true', 'yes', 'on')
+WHATSAPP_DIGEST_MAX_CHARS = int(os.environ.get('WHATSAPP_DIGEST_MAX_CHARS', '1600') or 1600)
+_DIGEST_SEPARATOR = "\n\n"
+_DIGEST_CONTINUED = "(tiếp) "
+
+def _digest_header(total, part, parts):
+    suffix = f" - phần {part}/{parts}" if parts > 1 else ""
+    return f"TỔNG HỢP CẢNH BÁO ({total} mục{suffix})"
+
+"""Tách `text` thành các đoạn dài tối đa `limit` ký tự, ưu tiên ngắt ở xuống dòng rồi khoảng trắng."""
+def _split_digest_text(text, limit):
+    pieces = []
+    while len(text) > limit:
+        cut = text.rfind('\n', 0, limit + 1)
+        if cut <= 0:
+            cut = text.rfind(' ', 0, limit + 1)
+        if cut <= 0:
+            cut = limit
+        pieces.append(text[:cut].rstrip())
+        text = text[cut:].lstrip()
+    pieces.append(text)
+    return pieces
+
+"""Xếp cảnh báo của một người nhận vào các tin, mỗi phần thân tin (không kể tiêu đề) tối đa `budget` ký tự."""
+def _pack_digest(items, budget):
+    chunks, current, size = [], [], 0
+    for m in items:
+        body = m['body']
+        pieces = [body] if len(body) <= budget else _split_digest_text(body, budget - len(_DIGEST_CONTINUED))
+        for i, piece in enumerate(pieces):
+            text = piece if i == 0 else _DIGEST_CONTINUED + piece
+            extra = len(text) + (len(_DIGEST_SEPARATOR) if current else 0)
+            if current and size + extra > budget:
+                chunks.append(current)
+                current, size = [], 0
+                extra = len(text)
+            current.append((m, text))
+            size += extra
+    if current:
+        chunks.append(current)
+    return chunks
+
+def _build_digest_messages(messages, max_chars=None):
+    max_chars = max_chars or WHATSAPP_DIGEST_MAX_CHARS
+    by_recipient = {}
+    for m in messages:
+        by_recipient.setdefault(m['to'], []).append(m)
+    digests = []
+    for to_number, items in by_recipient.items():
+        if len(items) == 1 and len(items[0]['body']) <= max_chars:
+            digests.append(items[0])
             continue
-        # Gửi cảnh báo đến hạn / còn 1 ngày
-        if status in ['Đến hạn', 'Còn 1 ngày']:
-            for num in to_numbers:
-                base_body = _build_whatsapp_body(row)
-                vars0 = {
-                    "project": str(row.get('Tên dự án - Mục đích sizing', '')).strip(),
-                    "kpi": str(row.get('Thời gian hoàn thành theo KPI', '')).strip(),
-                    "status": status
-                }
-                body, vars1 = _prepare_message_for_recipient('Sizing', row, num, base_body, vars0)
-                if _send_whatsapp(num, body, variables=vars1):
-                    sent += 1
-        # Thêm cảnh báo muộn 1 ngày, muộn 2 ngày theo KPI
-        kpi_dt = _parse_date(row.get('Thời gian hoàn thành theo KPI', ''))
-        if kpi_dt:
-            today = pd.Timestamp('today').normalize()
-            kpi_norm = pd.Timestamp(kpi_dt).normalize()
-            overdue_days = (today - kpi_norm).days
-            if overdue_days in [1, 2]:
-                for num in to_numbers:
-                    base_body = _build_kpi_overdue_body(row, overdue_days)
-                    vars0 = {
-                        "project": str(row.get('Tên dự án - Mục đích sizing', '')).strip(),
-                        "kpi": str(row.get('Thời gian hoàn thành theo KPI', '')).strip(),
-                        "status": f"Muộn {overdue_days} ngày"
-                    }
-                    body, vars1 = _prepare_message_for_recipient('Sizing', row, num, base_body, vars0)
-                    if _send_whatsapp(num, body, variables=vars1):
-                        sent += 1
-    # Quét sheet Cấp phát TN: nếu đã tiếp nhận hôm nay hoặc hôm qua mà chưa có 'Mã SR' -> nhắc tạo SR
-    try:
-        today = pd.Timestamp('today').normalize()
-        for row in data_store.get('CapPhat', []):
-            sr = str(row.get('Mã SR', '')).strip()
-            recv = _parse_date(row.get('Thời gian tiếp nhận y/c', ''))
-            if not sr and recv:
-                recv = pd.Timestamp(recv).normalize()
-                delta_days = (today - recv).days
-                if 0 <= delta_days <= 3:
-                    to_numbers = _get_recipients_for_row('CapPhat', row)
-                    if to_numbers:
-                        if delta_days == 0:
-                            # Ngày tiếp nhận: gửi nhắc tạo SR
-                            for num in to_numbers:
-                                base_body = _build_sr_reminder_body(row)
-                                vars0 = {
-                                    "project": str(row.get('Dự án', '')).strip(),
-                                    "received": str(row.get('Thời gian tiếp nhận y/c', '')).strip()
-                                }
-                                body, vars1 = _prepare_message_for_recipient('CapPhat', row, num, base_body, vars0)
-                                if _send_whatsapp(num, body, variables=vars1):
-                                    sent += 1
-                        elif delta_days == 1:
-                            # Ngày hôm sau: gửi cảnh báo đã đến hạn tạo SR
-                            for num in to_numbers:
-                                base_body = _build_sr_overdue_body(row)
-                                vars0 = {
-                                    "project": str(row.get('Dự án', '')).strip(),
-                                    "received": str(row.get('Thời gian tiếp nhận y/c', '')).strip()
-                                }
-                                body, vars1 = _prepare_message_for_recipient('CapPhat', row, num, base_body, vars0)
-                                if _send_whatsapp(num, body, variables=vars1):
-                                    sent += 1
-                        elif delta_days in [2, 3]:
-                            # Muộn 1-2 ngày kể từ hạn tạo SR nếu chưa tạo mã SR
-                            label = f"Muộn {delta_days-1} ngày"
-                            body = (
-                                f"NHẮC TẠO MÃ SR ({label})\n"
-                                f"Dự án: {str(row.get('Dự án', '')).strip()}\n"
-                                f"Tiếp nhận: {str(row.get('Thời gian tiếp nhận y/c', '')).strip()}\n"
-                                f"Vui lòng tạo mã SR ngay để đảm bảo tiến độ."
-                            )
-                            for num in to_numbers:
-                                vars0 = {
-                                    "project": str(row.get('Dự án', '')).strip(),
-                                    "received": str(row.get('Thời gian tiếp nhận y/c', '')).strip(),
-                                    "status": label
-                                }
-                                body2, vars1 = _prepare_message_for_recipient('CapPhat', row, num, body, vars0)
-                                if _send_whatsapp(num, body2, variables=vars1):
-                                    sent += 1
-    except Exception:
-        pass
-    # Nhắc tiến độ sau khi đã có Mã SR: Deadline = 2 ngày sau ngày tạo mã SR (calendar days)
+        # Chừa chỗ cho dòng tiêu đề dài nhất; số phần chỉ biết sau khi xếp nên xếp lại nếu tiêu đề dài hơn dự tính
+        parts = len(items)
+        while True:
+            header = len(_digest_header(len(items), parts, parts))
+            chunks = _pack_digest(items, max_chars - header - len(_DIGEST_SEPARATOR))
+            if len(_digest_header(len(items), len(chunks), len(chunks))) <= header:
+                break
+            parts = len(chunks)
+        for part, chunk in enumerate(chunks, start=1):
+            body = _digest_header(len(items), part, len(chunks)) + _DIGEST_SEPARATOR + _DIGEST_SEPARATOR.join(t for _, t in chunk)
+            sources = list({id(m): m for m, _ in chunk}.values())
+            digests.append({
+                'kind': 'digest',
+                'to': to_number,
+                'body': body,
+                'variables': {'body': body, 'count': len(sources)},
+                'items': [{k: m.get(k) for k in ('sheet', 'row_id', 'kind', 'due', 'to')} for m in sources],
+            })
+    return digests
+
+"""Outbox cảnh báo lưu bền (`cache/whatsapp_outbox.json`) để mỗi cảnh báo chỉ gửi một lần.
+
+Khoá mỗi mục: `row_id|kind|due|to` (hàng, loại cảnh báo, mốc ngày, người nhận). Trạng thái:
+- `pending`: đã ghi nhận, đang/chưa gửi (nếu tiến trình chết giữa chừng sẽ được gửi lại ở lượt sau)
+- `sent`: đã gửi thành công -> các lượt sau bỏ qua
+- `failed`: gửi lỗi -> lượt sau thử lại, tối đa `WHATSAPP_OUTBOX_MAX_ATTEMPTS` lần
+Mục cũ hơn `WHATSAPP_OUTBOX_RETENTION_DAYS` ngày được dọn khi ghi outbox.
+"""
+WHATSAPP_OUTBOX_MAX_ATTEMPTS = int(os.environ.get('WHATSAPP_OUTBOX_MAX_ATTEMPTS', '5') or 5)
+WHATSAPP_OUTBOX_RETENTION_DAYS = int(os.environ.get('WHATSAPP_OUTBOX_RETENTION_DAYS', '14') or 14)
+_alert_run_lock = threading.Lock()
+
+def _outbox_key(item):
+    return f"{item.get('row_id')}|{item.get('kind')}|{item.get('due')}|{item.get('to')}"
+
+def _load_outbox():
+    if os.path.exists(WHATSAPP_OUTBOX_FILE):
+        try:
+            with open(WHATSAPP_OUTBOX_FILE, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            return data if isinstance(data, dict) else {}
+        except Exception:
+            return {}
+    return {}
+
+def _save_outbox(outbox):
+    cutoff = (datetime.now() - timedelta(days=WHATSAPP_OUTBOX_RETENTION_DAYS)).isoformat(timespec='seconds')
+    for key in [k for k, e in outbox.items() if e.get('created_at', '') < cutoff]:
+        del outbox[key]
     try:
-        sr_map = _load_sr_created_map()
-        today = pd.Timestamp('today').normalize()
-        for row in data_store.get('CapPhat', []):
-            sr = str(row.get('Mã SR', '')).strip()
-            rid = row.get('row_id')
-            if sr and rid and rid in sr_map:
-                created_str = sr_map.get(rid, '')
-                created_dt = _parse_date(created_str)
-                if not created_dt:
-                    continue
-                created_dt = pd.Timestamp(created_dt).normalize()
-                deadline = created_dt + pd.Timedelta(days=2)
-                days_left = (deadline - today).days
-                if days_left in [0, 1]:
-                    due_label = 'Đến hạn' if days_left == 0 else 'Còn 1 ngày'
-                    to_numbers = _get_recipients_for_row('CapPhat', row)
-                    for num in to_numbers:
-                        base_body = _build_sr_deadline_body(row, due_label, created_str)
-                        vars0 = {
-                            "project": str(row.get('Dự án', '')).strip(),
-                            "created": created_str,
-                            "due": due_label
-                        }
-                        body, vars1 = _prepare_message_for_recipient('CapPhat', row, num, base_body, vars0)
-                        if _send_whatsapp(num, body, variables=vars1):
-                            sent += 1
+        _write_json_atomic(WHATSAPP_OUTBOX_FILE, outbox)
     except Exception:
         pass
-    return sent
+
+def _outbox_should_send(entry):
+    if entry is None or entry.get('status') == 'pending':
+        return True
+    return entry.get('status') == 'failed' and entry.get('attempts', 0) < WHATSAPP_OUTBOX_MAX_ATTEMPTS
+
+"""Chạy một lượt cảnh báo: thu thập tin, lọc qua outbox, gửi song song qua `WhatsAppDispatcher`; trả về báo cáo từng tin."""
+def run_whatsapp_alerts(digest=None):
+    started = time.monotonic()
+    with _alert_run_lock, _file_lock(WHATSAPP_OUTBOX_FILE + '.lock'):
+        messages = _collect_whatsapp_alerts()
+        alerts = len(messages)
+        outbox = _load_outbox()
+        now = datetime.now().isoformat(timespec='seconds')
+        # Chỉ giữ cảnh báo chưa gửi thành công; ghi 'pending' trước khi gửi để chạy lại được nếu bị ngắt
+        pending = [m for m in messages if _outbox_should_send(outbox.get(_outbox_key(m)))]
+        for m in pending:
+            entry = outbox.setdefault(_outbox_key(m), {
+                'sheet': m.get('sheet'), 'row_id': m.get('row_id'), 'kind': m.get('kind'), 'due': m.get('due'),
+                'to': m.get('to'), 'attempts': 0, 'created_at': now,
+            })
+            entry['status'] = 'pending'
+        if pending:
+            _save_outbox(outbox)
+        messages = pending
+        if WHATSAPP_DIGEST if digest is None else digest:
+            messages = _build_digest_messages(messages)
+        results = _get_dispatcher().dispatch(messages) if messages else []
+        # Cảnh báo bị tách qua nhiều tin tổng hợp chỉ tính là đã gửi khi mọi phần đều gửi được
+        outcomes = {}
+        for r in results:
+            for item in r.get('items') or [r]:
+                key = _outbox_key(item)
+                if key in outbox and (key not in outcomes or outcomes[key]['ok']):
+                    outcomes[key] = r
+        for key, r in outcomes.items():
+            entry = outbox[key]
+            entry['status'] = 'sent' if r['ok'] else 'failed'
+            entry['attempts'] = entry.get('attempts', 0) + 1
+            entry['last_attempt_at'] = datetime.now().isoformat(timespec='seconds')
+            entry['status_code'] = r.get('status_code')
+            entry['error'] = r.get('error')
+            entry['sid'] = r.get('sid')
+        if results:
+            _save_outbox(outbox)
+    sent = sum(1 for r in results if r['ok'])
+    metrics.observe('excel_alert_run_duration_seconds', time.monotonic() - started)
+    metrics.inc('excel_alert_messages_total', sent, result='sent')
+    metrics.inc('excel_alert_messages_total', len(results) - sent, result='failed')
+    return {
+        'sent': sent,
+        'failed': len(results) - sent,
+        'total': len(results),
+        'alerts': alerts,
+        'skipped': alerts - len(pending),
+        'duration_ms': int((time.monotonic() - started) * 1000),
+        'results': results,
+    }
+
+def check_and_send_whatsapp_alerts():
+    """Quét sheet Sizing/CapPhat, gửi WhatsApp cho các cảnh báo đến hạn; trả về số tin gửi thành công."""
+    return run_whatsapp_alerts()['sent']
 
 """Khởi tạo ứng dụng và cấu hình chung."""
 app = Flask(__name__)
 app.config['MAX_CONTENT_LENGTH'] = 200 * 1024 * 1024 
-app.config['UPLOAD_FOLDER'] = os.path.join(os.path.dirname(__file__), 'uploads')
+app.config['UPLOAD_FOLDER'] = os.environ.get('UPLOAD_FOLDER') or os.path.join(os.path.dirname(__file__), 'uploads')
 os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
 
+"""Số liệu vận hành trong bộ nhớ, xuất theo định dạng text của Prometheus tại `/metrics`.
+
+- Counter/gauge/histogram có nhãn; mỗi lần ghi chỉ là một phép cộng dưới khoá (đủ nhẹ để luôn bật)
+- Histogram dùng bucket cố định (giây), Prometheus tự tính phân vị từ `_bucket`
+- Số liệu tính lúc scrape (số hàng, thống kê cache) đăng ký qua `collector`
+Mỗi tiến trình có số liệu riêng: chạy nhiều worker thì mỗi lần scrape chỉ thấy worker nhận request đó.
+"""
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+class Metrics:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._meta = {}      # tên -> (loại, mô tả, buckets)
+        self._values = {}    # tên -> {nhãn (tuple cặp) -> giá trị | [đếm theo bucket..., tổng, số lần]}
+        self._collectors = []
+
+    def describe(self, name, kind, help_text, buckets=LATENCY_BUCKETS):
+        self._meta[name] = (kind, help_text, tuple(buckets) if kind == 'histogram' else None)
+        self._values.setdefault(name, {})
+
+    def inc(self, name, value=1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            series = self._values[name]
+            series[key] = series.get(key, 0) + value
+
+    def set(self, name, value, **labels):
+        with self._lock:
+            self._values[name][tuple(sorted(labels.items()))] = value
+
+    def observe(self, name, value, **labels):
+        buckets = self._meta[name][2]
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            series = self._values[name]
+            state = series.get(key)
+            if state is None:
+                state = series[key] = [0] * (len(buckets) + 1) + [0.0, 0]
+            state[bisect.bisect_left(buckets, value)] += 1
+            state[-2] += value
+            state[-1] += 1
+
+    def collector(self, fn):
+        """Đăng ký hàm trả về list (tên, loại, mô tả, [(dict nhãn, giá trị)]) tính lúc scrape."""
+        self._collectors.append(fn)
+        return fn
+
+    @staticmethod
+    def _labels(pairs, extra=()):
+        items = list(pairs) + list(extra)
+        if not items:
+            return ''
+        esc = lambda v: str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        return '{' + ','.join(f'{k}="{esc(v)}"' for k, v in items) + '}'
+
+    def render(self):
+        lines = []
+        with self._lock:
+            snapshot = {name: {k: (list(v) if isinstance(v, list) else v) for k, v in series.items()}
+                        for name, series in self._values.items()}
+        for name, (kind, help_text, buckets) in self._meta.items():
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} {kind}')
+            for key, value in snapshot[name].items():
+                if kind != 'histogram':
+                    lines.append(f'{name}{self._labels(key)} {value}')
+                    continue
+                cumulative = 0
+                for bound, count in zip(buckets + (float('inf'),), value):
+                    cumulative += count
+                    le = '+Inf' if bound == float('inf') else repr(bound)
+                    lines.append(f'{name}_bucket{self._labels(key, [("le", le)])} {cumulative}')
+                lines.append(f'{name}_sum{self._labels(key)} {round(value[-2], 6)}')
+                lines.append(f'{name}_count{self._labels(key)} {value[-1]}')
+        for fn in self._collectors:
+            try:
+                families = fn()
+            except Exception:
+                continue
+            for name, kind, help_text, samples in families:
+                lines.append(f'# HELP {name} {help_text}')
+                lines.append(f'# TYPE {name} {kind}')
+                for labels, value in samples:
+                    lines.append(f'{name}{self._labels(sorted(labels.items()))} {value}')
+        return '\n'.join(lines) + '\n'
+
+metrics = Metrics()
+metrics.describe('excel_http_requests_total', 'counter', 'Số request theo route, method, status.')
+metrics.describe('excel_http_request_duration_seconds', 'histogram', 'Thời gian xử lý request theo route.')
+metrics.describe('excel_save_cache_duration_seconds', 'histogram', 'Thời gian ghi snapshot cache (save_cache).')
+metrics.describe('excel_save_cache_bytes_total', 'counter', 'Tổng số byte snapshot cache đã ghi.')
+metrics.describe('excel_journal_bytes_total', 'counter', 'Tổng số byte đã nối vào nhật ký chỉnh sửa.')
+metrics.describe('excel_persist_errors_total', 'counter', 'Số lần ghi thay đổi vào kho thất bại sau khi thử lại.')
+metrics.describe('excel_progress_refresh_duration_seconds', 'histogram', "Thời gian tính lại 'Tiến độ' Sizing.")
+metrics.describe('excel_import_rows_total', 'counter', 'Tổng số hàng đã import.')
+metrics.describe('excel_import_rows_per_second', 'gauge', 'Tốc độ đọc + nạp hàng của lần import gần nhất.')
+metrics.describe('excel_alert_run_duration_seconds', 'histogram', 'Thời gian một lượt cảnh báo WhatsApp.')
+metrics.describe('excel_alert_messages_total', 'counter', 'Số tin WhatsApp theo kết quả (sent/failed).')
+
+"""Đo thời gian mỗi request (đăng ký trước mọi hook khác nên tính cả đồng bộ nhiều worker và nén response)."""
+@app.before_request
+def _metrics_start_request():
+    g._metrics_started = time.perf_counter()
+
+@app.after_request
+def _metrics_finish_request(response):
+    started = g.pop('_metrics_started', None)
+    if started is not None:
+        route = request.endpoint or 'unmatched'
+        metrics.observe('excel_http_request_duration_seconds', time.perf_counter() - started, route=route)
+        metrics.inc('excel_http_requests_total', route=route, method=request.method, status=response.status_code)
+    return response
+
 """Định nghĩa cột chuẩn cho từng sheet."""
 SIZING_COLUMNS = [
     "STT","Mã PYC","Đơn vị","Đầu mối tạo PYC","Đầu mối xử lý","Trạng thái","Thời điểm đẩy yêu cầu","Thời gian hoàn thành theo KPI","Tiến độ","Thời gian hoàn thành ký PNX và đóng y/c","Thời gian ký bản chốt sizing","Tên dự án - Mục đích sizing","Ghi chú"
@@ -407,6 +822,131 @@ CLOUD_COLUMNS = [
     "Com_Bigdata vCPU","Com_Bigdata RAM","Bigdata(GB)","Archiving(GB)","Bare_metal vCPU","Bare_metal RAM","2022 Ghi chú"
 ]
 
+"""Engine lưu trữ dạng cột (tuỳ chọn, `DATA_STORE_ENGINE=columnar`): mỗi sheet là một
+`columnar.ColumnarSheet`, các cột số của Chi tiết lưu float64. Mặc định (`rows`) là list các dict hàng.
+"""
+DATA_STORE_ENGINE = os.environ.get('DATA_STORE_ENGINE', 'rows').strip().lower()
+
+"""Tạo container hàng rỗng cho sheet theo engine đang dùng."""
+def _new_sheet_rows(columns):
+    if DATA_STORE_ENGINE == 'columnar':
+        return ColumnarSheet(columns, numeric_columns=CHI_TIET_NUMERIC_COLS)
+    return []
+
+"""Chuyển list dict hàng sang container của engine đang dùng (giữ nguyên nếu đã đúng kiểu)."""
+def _to_engine_rows(rows, columns):
+    if DATA_STORE_ENGINE == 'columnar' and not isinstance(rows, ColumnarSheet):
+        return ColumnarSheet(columns, rows, numeric_columns=CHI_TIET_NUMERIC_COLS)
+    return rows
+
+"""Bản ghi dict thuần của sheet (để ghi JSON)."""
+def _rows_as_records(rows):
+    if isinstance(rows, ColumnarSheet):
+        return rows.to_records()
+    return rows
+
+"""Dựng DataFrame từ danh sách hàng của sheet (dùng cho export)."""
+def _rows_to_frame(rows):
+    if isinstance(rows, ColumnarSheet):
+        return pd.DataFrame(rows.to_columns())
+    return pd.DataFrame(rows)
+
+"""Giá trị của một cột theo thứ tự hàng, dùng chung cho cả hai engine."""
+def sheet_column(rows, col):
+    if isinstance(rows, ColumnarSheet):
+        return rows.column_values(col) if col == 'row_id' or rows.has_column(col) else [''] * len(rows)
+    return [r.get(col, '') for r in rows]
+
+"""Mảng float64 của một cột (NaN nếu không phải số), dùng chung cho cả hai engine."""
+def sheet_numeric_column(rows, col):
+    if isinstance(rows, ColumnarSheet):
+        if rows.has_column(col):
+            return rows.numeric_column(col)
+        return np.full(len(rows), np.nan)
+    return pd.to_numeric(pd.Series([r.get(col, '') for r in rows], dtype=object), errors='coerce').to_numpy(dtype=np.float64)
+
+"""Lược đồ cột của sheet: hàng lưu giá trị theo id cột cố định, tên hiển thị chỉ là metadata.
+
+- Cột mặc định (`SIZING_COLUMNS`, ...) có id chính là tên gốc, nên logic nghiệp vụ (tổng hợp, KPI,
+  cảnh báo) đọc hàng theo id như trước và vẫn chạy đúng sau khi người dùng đổi tên cột
+- Cột người dùng thêm nhận id mới `col_<hex>`; chèn lại cột mang tên một cột mặc định đã xoá dùng lại id gốc
+- Đổi tên/chèn/xoá cột chỉ sửa lược đồ (O(số cột)), không viết lại từng hàng; lược đồ được lưu cùng dữ liệu
+  (bản ghi nhật ký `schema`, `_meta.schemas` trong snapshot, bảng `meta` của SQLite)
+"""
+class SheetSchema:
+    def __init__(self, defaults, ids=None, names=None):
+        self.defaults = list(defaults)
+        self.ids = list(ids) if ids is not None else list(self.defaults)
+        names = names or {}
+        self.names = {i: names.get(i, i) for i in self.ids}
+        self._by_name = {n: i for i, n in self.names.items()}
+
+    @classmethod
+    def from_json(cls, defaults, data):
+        if not isinstance(data, dict) or not isinstance(data.get('ids'), list):
+            return cls(defaults)
+        return cls(defaults, data['ids'], data.get('names'))
+
+    def to_json(self):
+        return {'ids': list(self.ids), 'names': dict(self.names)}
+
+    def name(self, col_id):
+        return self.names.get(col_id, col_id)
+
+    def display_names(self):
+        return [self.names[i] for i in self.ids]
+
+    def id_for(self, name):
+        """Id của cột có tên hiển thị `name` (None nếu không có)."""
+        return self._by_name.get(name)
+
+    def rename(self, col_id, new_name):
+        del self._by_name[self.names[col_id]]
+        self.names[col_id] = new_name
+        self._by_name[new_name] = col_id
+
+    def insert(self, index, name):
+        col_id = name if (name in self.defaults and name not in self.names) else f'col_{uuid.uuid4().hex[:8]}'
+        self.ids.insert(index, col_id)
+        self.names[col_id] = name
+        self._by_name[name] = col_id
+        return col_id
+
+    def delete(self, col_id):
+        self.ids.remove(col_id)
+        del self._by_name[self.names.pop(col_id)]
+
+    def is_default(self, col_id):
+        return col_id in self.defaults
+
+DEFAULT_SHEET_COLUMNS = {
+    'Sizing': SIZING_COLUMNS,
+    'CapPhat': CAP_PHAT_COLUMNS,
+    'ChiTiet': CHI_TIET_COLUMNS,
+    'Cloud': CLOUD_COLUMNS,
+}
+_schemas = {name: SheetSchema(cols) for name, cols in DEFAULT_SHEET_COLUMNS.items()}
+# Số phiên bản lược đồ của từng sheet, tăng mỗi lần lược đồ bị thay (khoá cache fragment hàng)
+_schema_version_seq = itertools.count(1)
+_schema_versions = dict.fromkeys(DEFAULT_SHEET_COLUMNS, 0)
+
+"""Nạp lược đồ đã lưu (dict sheet -> `to_json()`); sheet không có lược đồ dùng cột mặc định."""
+def _load_schemas(saved, sheets=None):
+    saved = saved if isinstance(saved, dict) else {}
+    for name in sheets or DEFAULT_SHEET_COLUMNS:
+        if name in DEFAULT_SHEET_COLUMNS:
+            _schemas[name] = SheetSchema.from_json(DEFAULT_SHEET_COLUMNS[name], saved.get(name))
+            _schema_versions[name] = next(_schema_version_seq)
+
+def _schemas_payload():
+    return {name: schema.to_json() for name, schema in _schemas.items()}
+
+"""Tên hiển thị của cột (dùng trong template: `column_name(sheet, col_id)`)."""
+@app.template_global('column_name')
+def column_name(sheet_name, col_id):
+    schema = _schemas.get(sheet_name)
+    return schema.name(col_id) if schema else col_id
+
 """Bộ nhớ dữ liệu chính trong runtime (3 sheet)."""
 data_store = {
     'Sizing': initial_rows(SIZING_COLUMNS),
@@ -415,8 +955,408 @@ data_store = {
     'Cloud': initial_rows(CLOUD_COLUMNS)
 }
 
+"""Chỉ mục row_id -> hàng (dict) cho từng sheet, giúp tra cứu hàng theo id với O(1).
+
+Luôn thay danh sách hàng của sheet qua `_set_sheet_rows` và gọi `_index_row`/`_unindex_row`
+khi thêm/xoá từng hàng để chỉ mục không bị lệch với `data_store`.
+"""
+_row_index = {}
+
+"""Chỉ mục row_id -> vị trí cho engine `rows` (`ColumnarSheet` tự giữ chỉ mục riêng).
+
+Chỉ đúng với các vị trí < `valid`: thêm/xoá hàng ở vị trí p chỉ hạ mốc xuống p (truyền `pos` cho `_index_row`),
+lần tra sau (`get_row_position`) tính lại phần đuôi từ mốc đó.
+"""
+_row_positions = {}  # sheet -> {'pos': {row_id: vị trí}, 'valid': số vị trí đầu còn đúng}
+
+def _rebuild_row_index(sheet_name):
+    _row_index[sheet_name] = {r.get('row_id'): r for r in data_store.get(sheet_name, [])}
+    _row_positions[sheet_name] = {'pos': {}, 'valid': 0}
+    _reset_row_versions(sheet_name)
+    # Danh sách hàng/cột bị thay hàng loạt -> bảng tổng hợp dashboard và chỉ mục mốc cảnh báo cần dựng lại
+    _invalidate_aggregates(sheet_name)
+    _invalidate_deadlines(sheet_name)
+
+"""Danh sách id cột hiện tại của sheet theo thứ tự hiển thị (không sửa trực tiếp list trả về)."""
+def _sheet_columns(sheet_name):
+    schema = _schemas.get(sheet_name)
+    return schema.ids if schema else []
+
+def _set_sheet_rows(sheet_name, rows):
+    data_store[sheet_name] = _to_engine_rows(rows, _sheet_columns(sheet_name))
+    _rebuild_row_index(sheet_name)
+
+"""Thay lược đồ của sheet đang chạy (đổi tên/chèn/xoá cột, hoặc lược đồ do worker khác ghi).
+
+Không duyệt hàng, trừ khi xoá một cột mặc định ở engine `rows` (logic nghiệp vụ đọc cột đó theo id,
+nên giá trị cũ phải được gỡ ngay). Cột mặc định bị thêm/xoá -> dựng lại tổng hợp và mốc cảnh báo.
+"""
+def _apply_schema(sheet_name, schema):
+    old = _schemas[sheet_name]
+    rows = data_store[sheet_name]
+    removed = [c for c in old.ids if c not in schema.names]
+    added = [c for c in schema.ids if c not in old.names]
+    _schemas[sheet_name] = schema
+    _schema_versions[sheet_name] = next(_schema_version_seq)
+    _touch_sheet(sheet_name)
+    for col in removed:
+        if isinstance(rows, ColumnarSheet):
+            rows.drop_column(col)
+        elif old.is_default(col):
+            for row in rows:
+                row.pop(col, None)
+    if isinstance(rows, ColumnarSheet):
+        for col in added:
+            rows.add_column(col)
+    if any(old.is_default(c) for c in removed + added):
+        _invalidate_aggregates(sheet_name)
+        _invalidate_deadlines(sheet_name)
+
+"""Ghi nhận hàng vừa được chèn vào sheet tại vị trí `pos` (không rõ vị trí -> chỉ mục vị trí tính lại từ đầu)."""
+def _index_row(sheet_name, row, pos=None):
+    _row_index.setdefault(sheet_name, {})[row.get('row_id')] = row
+    state = _row_positions.get(sheet_name)
+    if state is not None:
+        state['valid'] = min(state['valid'], 0 if pos is None else pos)
+    _touch_sheet(sheet_name)
+
+def _unindex_row(sheet_name, row):
+    _row_index.get(sheet_name, {}).pop(row.get('row_id'), None)
+    state = _row_positions.get(sheet_name)
+    if state is not None:
+        # Vị trí đã biết (< valid) là vị trí thật của hàng vừa gỡ; không biết thì hàng nằm sau mốc, mốc giữ nguyên
+        pos = state['pos'].pop(row.get('row_id'), None)
+        if pos is not None:
+            state['valid'] = min(state['valid'], pos)
+    _touch_sheet(sheet_name)
+
+def get_row_by_id(sheet_name, row_id):
+    """Trả về hàng có `row_id` tương ứng trong sheet (None nếu không có)."""
+    if not row_id:
+        return None
+    return _row_index.get(sheet_name, {}).get(row_id)
+
+"""Phiên bản hàng (optimistic concurrency) cho các thao tác sửa/xoá từ client.
+
+- Phiên bản lấy từ bộ đếm chung của kho dữ liệu (`_version_state['seq']`): mỗi bản ghi được lưu qua
+  `persist_changes` nhận một số mới (trường `seq`), hàng bị sửa mang số của bản ghi `set` gần nhất;
+  sheet bị thay hàng loạt (import) thì mọi hàng của sheet nhận chung một mốc mới (`floor`)
+- Bộ đếm, mốc và phiên bản từng hàng được lưu cùng dữ liệu (snapshot `_meta.versions` + `seq` của bản ghi nhật ký,
+  hoặc meta/bảng `row_versions` trong SQLite), nên mọi worker và các lần khởi động lại thấy cùng một phiên bản
+- Phiên bản gửi cho client có dạng `<mã kho>.<số>` (`data-version` trên mỗi nhóm hàng); client gửi lại trong
+  trường `version` khi sửa ô/xoá hàng. Lệch phiên bản, kể cả mã kho lạ (cache đã bị thay) -> 409 (`RowConflict`)
+"""
+_version_state = {'store': uuid.uuid4().hex[:8], 'seq': 0}
+_row_versions = {}         # (sheet, row_id) -> số thứ tự bản ghi sửa hàng gần nhất
+_sheet_version_floor = {}  # sheet -> số thứ tự lần thay hàng loạt gần nhất
+
+# Bộ đếm riêng của tiến trình cho ETag: sheet -> số thứ tự lần thay đổi bất kỳ gần nhất (sửa ô, thêm/xoá hàng, đổi cột)
+_DATA_VERSION_EPOCH = uuid.uuid4().hex[:8]
+_data_version_seq = itertools.count(1)
+_sheet_data_versions = {}
+
+class RowConflict(Exception):
+    """Hàng đã bị thay đổi/xoá bởi thao tác khác so với phiên bản client đang giữ."""
+    def __init__(self, sheet_name, row_id, index=None):
+        super().__init__(f'Row {row_id} in {sheet_name} was changed by another request')
+        self.sheet_name = sheet_name
+        self.row_id = row_id
+        self.index = index
+
+def _next_store_seq():
+    _version_state['seq'] += 1
+    return _version_state['seq']
+
+def _reset_row_versions(sheet_name):
+    for key in [k for k in _row_versions if k[0] == sheet_name]:
+        del _row_versions[key]
+    _sheet_version_floor[sheet_name] = _next_store_seq()
+    _touch_sheet(sheet_name)
+
+def _set_row_version(sheet_name, row_id, seq):
+    _row_versions[(sheet_name, row_id)] = seq
+    _version_state['seq'] = max(_version_state['seq'], seq)
+    _touch_sheet(sheet_name)
+
+def _touch_sheet(sheet_name):
+    _sheet_data_versions[sheet_name] = next(_data_version_seq)
+
+def _forget_row_version(sheet_name, row_id):
+    _row_versions.pop((sheet_name, row_id), None)
+
+"""Cập nhật phiên bản hàng theo các bản ghi đã được đánh số `seq` (do tiến trình này hoặc worker khác ghi)."""
+def _apply_record_versions(records):
+    for rec in records:
+        seq = rec.get('seq')
+        if not seq:
+            continue
+        if rec.get('op') == 'set':
+            _set_row_version(rec.get('sheet'), rec.get('row_id'), seq)
+        else:
+            if rec.get('op') == 'delete':
+                _forget_row_version(rec.get('sheet'), rec.get('row_id'))
+            _version_state['seq'] = max(_version_state['seq'], seq)
+
+"""Đánh số `seq` cho các bản ghi sắp lưu rồi cập nhật phiên bản hàng; gọi khi giữ `_store_lock` (đã đồng bộ worker khác)."""
+def _stamp_records(records):
+    for rec in records:
+        rec['seq'] = _next_store_seq()
+    _apply_record_versions(records)
+
+"""Trạng thái phiên bản để lưu cùng snapshot (`_meta.versions`); chỉ giữ hàng mới hơn mốc của sheet."""
+def _versions_payload():
+    rows = {}
+    for (sheet, row_id), seq in _row_versions.items():
+        if seq > _sheet_version_floor.get(sheet, 0):
+            rows.setdefault(sheet, {})[row_id] = seq
+    return {'store': _version_state['store'], 'seq': _version_state['seq'],
+            'floor': dict(_sheet_version_floor), 'rows': rows}
+
+"""Khôi phục trạng thái phiên bản đã lưu sau khi nạp hàng của `sheets`.
+
+Cache cũ chưa có `versions`: giữ các mốc vừa tạo khi nạp (mọi worker khởi động cùng cách nên cho cùng số)
+và lấy mã kho từ `fallback_store` (ví dụ generation của snapshot) để các worker dùng chung.
+"""
+def _restore_versions(saved, sheets, fallback_store=None):
+    saved = saved or {}
+    store = saved.get('store') or fallback_store
+    if store:
+        _version_state['store'] = store
+    floors = saved.get('floor') or {}
+    rows = saved.get('rows') or {}
+    for sheet in sheets:
+        if sheet in floors:
+            _sheet_version_floor[sheet] = int(floors[sheet])
+        for key in [k for k in _row_versions if k[0] == sheet]:
+            del _row_versions[key]
+        index = _row_index.get(sheet, {})
+        for row_id, seq in (rows.get(sheet) or {}).items():
+            if row_id in index:
+                _row_versions[(sheet, row_id)] = int(seq)
+        _touch_sheet(sheet)
+    if 'seq' in saved:
+        _version_state['seq'] = int(saved['seq'])
+    _version_state['seq'] = max([_version_state['seq']] + list(_sheet_version_floor.values()))
+
+"""Phiên bản hiện tại của hàng dạng `<mã kho>.<số>` (dùng trong template: `row_version(sheet, row_id)`)."""
+@app.template_global('row_version')
+def row_version(sheet_name, row_id):
+    seq = _row_versions.get((sheet_name, row_id), _sheet_version_floor.get(sheet_name, 0))
+    return f"{_version_state['store']}.{seq}"
+
+"""Báo `RowConflict` nếu hàng không còn tồn tại hoặc `expected` (phiên bản client gửi) đã cũ."""
+def check_row_version(sheet_name, row_id, expected, index=None):
+    if get_row_by_id(sheet_name, row_id) is None:
+        raise RowConflict(sheet_name, row_id, index)
+    if not expected or not isinstance(expected, str):
+        return
+    if expected != row_version(sheet_name, row_id):
+        raise RowConflict(sheet_name, row_id, index)
+
+"""409: trả về phiên bản hiện tại của hàng (None nếu hàng đã bị xoá) để client tải lại."""
+@app.errorhandler(RowConflict)
+def _row_conflict_response(e):
+    current = row_version(e.sheet_name, e.row_id) if get_row_by_id(e.sheet_name, e.row_id) is not None else None
+    body = {'error': 'Conflict', 'sheet': e.sheet_name, 'row_id': e.row_id, 'version': current}
+    if e.index is not None:
+        body['index'] = e.index
+    return jsonify(body), 409
+
+"""Bảng tổng hợp dashboard được duy trì sẵn (materialized) thay vì tính lại mỗi lần tải trang:
+- Sizing: số yêu cầu theo Owner × năm × quý (từ 'Thời điểm đẩy yêu cầu') và số 'Từ chối'
+- ChiTiet: tổng các cột tài nguyên theo 'Nhóm tài nguyên'
+
+Tổng hợp được dựng lại (lười, ở lần đọc kế tiếp) khi sheet bị thay hàng loạt (import, load cache,
+đổi/chèn/xoá cột) và cập nhật theo delta khi thêm/xoá hàng hoặc sửa ô liên quan:
+gọi `_aggregate_row(sheet, row, -1)` TRƯỚC khi sửa/xoá hàng và `_aggregate_row(sheet, row, 1)` SAU khi sửa/thêm.
+"""
+SIZING_SUMMARY_OWNERS = ["khanhnd23", "ductn8", "vinhtq18", "thongnv31", "tuanha3"]
+SIZING_SUMMARY_COLS = {'Đầu mối xử lý', 'Trạng thái', 'Thời điểm đẩy yêu cầu'}
+CHI_TIET_SUM_COLS = [
+    'vCPU', 'Cint', 'RAM(GB)', 'SAN(GB)', 'NAS(GB)', 'Ceph(GB)', 'Bigdata(GB)', 'Archiving(GB)', 'S3 Object(GB)'
+]
+_aggregates = {'Sizing': None, 'ChiTiet': None}  # None = cần dựng lại
+
+def _invalidate_aggregates(sheet_name):
+    if sheet_name in _aggregates:
+        _aggregates[sheet_name] = None
+
+def _aggregate_affected(sheet_name, col):
+    if sheet_name == 'Sizing':
+        return col in SIZING_SUMMARY_COLS
+    if sheet_name == 'ChiTiet':
+        return col == 'Nhóm tài nguyên' or col in CHI_TIET_SUM_COLS
+    return False
+
+def _bump(counter, key, delta):
+    n = counter.get(key, 0) + delta
+    if n:
+        counter[key] = n
+    else:
+        counter.pop(key, None)
+
+def _numeric_cell(val):
+    # Cùng quy tắc với `sheet_numeric_column` (pd.to_numeric, lỗi -> bỏ qua)
+    num = pd.to_numeric(pd.Series([val], dtype=object), errors='coerce').iloc[0]
+    return None if pd.isna(num) else float(num)
+
+"""Phần đóng góp của một hàng Sizing: (owner trong danh sách hoặc None, có 'Từ chối' không, năm, quý)."""
+def _sizing_contribution(row):
+    owner = str(row.get('Đầu mối xử lý', '')).strip()
+    rejected = str(row.get('Trạng thái', '')).strip().lower() == 'từ chối'
+    year = quarter = None
+    dt = _parse_date(row.get('Thời điểm đẩy yêu cầu', ''))
+    if dt:
+        ts = pd.Timestamp(dt)
+        # Bỏ qua các năm không hợp lệ (ví dụ: 1970 do lỗi parse Excel)
+        if 2000 <= ts.year <= 2100:
+            year, quarter = int(ts.year), (int(ts.month) - 1) // 3 + 1
+    return (owner if owner in SIZING_SUMMARY_OWNERS else None), rejected, year, quarter
+
+def _apply_sizing_contribution(agg, contribution, delta):
+    owner, rejected, year, quarter = contribution
+    if owner:
+        _bump(agg['owner_rows'], owner, delta)
+        if rejected:
+            _bump(agg['rejects'], owner, delta)
+    if year:
+        # Năm được tính cho mọi hàng (kể cả owner ngoài danh sách), số đếm chỉ cho owner trong danh sách
+        _bump(agg['years'], year, delta)
+        if owner:
+            _bump(agg['counts'], (owner, year, quarter), delta)
+
+def _new_chitiet_group(agg, group):
+    return agg.setdefault(group, {'rows': 0, 'sum': {c: 0.0 for c in CHI_TIET_SUM_COLS}, 'n': {c: 0 for c in CHI_TIET_SUM_COLS}})
+
+def _build_aggregate(sheet_name):
+    rows = data_store.get(sheet_name, [])
+    if sheet_name == 'Sizing':
+        agg = {'owner_rows': {}, 'rejects': {}, 'years': {}, 'counts': {}}
+        for r in rows:
+            _apply_sizing_contribution(agg, _sizing_contribution(r), 1)
+        return agg
+    # ChiTiet: mã hoá nhóm một lần rồi cộng dồn từng cột số bằng bincount (giữ thứ tự xuất hiện)
+    agg = {}
+    groups = pd.Series([str(g).strip() for g in sheet_column(rows, 'Nhóm tài nguyên')], dtype=object)
+    codes, labels = pd.factorize(groups)
+    labels = list(labels)
+    valid = codes >= 0
+    row_counts = np.bincount(codes[valid], minlength=len(labels))
+    for i, g in enumerate(labels):
+        if g:
+            _new_chitiet_group(agg, g)['rows'] = int(row_counts[i])
+    for c in CHI_TIET_SUM_COLS:
+        values = sheet_numeric_column(rows, c)
+        present = valid & ~np.isnan(values)
+        sums = np.bincount(codes[present], weights=values[present], minlength=len(labels))
+        counts = np.bincount(codes[present], minlength=len(labels))
+        for i, g in enumerate(labels):
+            if g:
+                agg[g]['sum'][c] = float(sums[i])
+                agg[g]['n'][c] = int(counts[i])
+    return agg
+
+def _get_aggregate(sheet_name):
+    with _persist_lock:
+        if _aggregates.get(sheet_name) is None:
+            _aggregates[sheet_name] = _build_aggregate(sheet_name)
+        return _aggregates[sheet_name]
+
+"""Cộng (delta=1) hoặc trừ (delta=-1) phần đóng góp của một hàng vào bảng tổng hợp."""
+def _aggregate_row(sheet_name, row, delta):
+    agg = _aggregates.get(sheet_name)
+    if agg is None:
+        return
+    try:
+        if sheet_name == 'Sizing':
+            _apply_sizing_contribution(agg, _sizing_contribution(row), delta)
+            return
+        group = str(row.get('Nhóm tài nguyên', '')).strip()
+        if not group:
+            return
+        entry = _new_chitiet_group(agg, group)
+        entry['rows'] += delta
+        for c in CHI_TIET_SUM_COLS:
+            num = _numeric_cell(row.get(c, ''))
+            if num is not None:
+                entry['n'][c] += delta
+                # Về đúng 0 khi nhóm không còn ô số, tránh sai số cộng/trừ float tích luỹ
+                entry['sum'][c] = entry['sum'][c] + delta * num if entry['n'][c] else 0.0
+        if entry['rows'] <= 0:
+            agg.pop(group, None)
+    except Exception:
+        # Không để lỗi tổng hợp làm hỏng thao tác sửa dữ liệu: dựng lại ở lần đọc kế tiếp
+        _aggregates[sheet_name] = None
+
+"""Số liệu dashboard từ bảng tổng hợp (chi phí O(số nhóm), không duyệt lại các hàng)."""
+def dashboard_summary():
+    sizing = _get_aggregate('Sizing')
+    owners = [o for o in SIZING_SUMMARY_OWNERS if sizing['owner_rows'].get(o)]
+    years = sorted(sizing['years'])
+    counts = sizing['counts']
+    sizing_summary_rows = []
+    for owner in owners:
+        sizing_summary_rows.append({
+            'owner': owner,
+            'quarters': {y: {q: counts.get((owner, y, q), 0) for q in (1, 2, 3, 4)} for y in years},
+            'owner_false': sizing['rejects'].get(owner, 0),
+        })
+    # Hàng tổng
+    sizing_summary_rows.append({
+        'owner': 'Tổng',
+        'quarters': {y: {q: sum(counts.get((o, y, q), 0) for o in owners) for q in (1, 2, 3, 4)} for y in years},
+        'owner_false': sum(sizing['rejects'].values()),
+    })
+    chitiet_group_totals = {}
+    for grp, entry in _get_aggregate('ChiTiet').items():
+        # Nhóm không có ô số nào giữ giá trị 0 (int) như trước; làm tròn để ẩn sai số float của delta
+        chitiet_group_totals[grp] = {
+            c: (round(entry['sum'][c], 9) + 0.0) if entry['n'][c] else 0 for c in CHI_TIET_SUM_COLS
+        }
+    # Hàng tổng cộng
+    chitiet_total_row = {c: 0 for c in CHI_TIET_SUM_COLS}
+    for sums in chitiet_group_totals.values():
+        for c in CHI_TIET_SUM_COLS:
+            chitiet_total_row[c] += sums.get(c, 0)
+    for c in CHI_TIET_SUM_COLS:
+        if isinstance(chitiet_total_row[c], float):
+            chitiet_total_row[c] = round(chitiet_total_row[c], 9) + 0.0
+    return {
+        'sizing_summary_years': years,
+        'sizing_summary_rows': sizing_summary_rows,
+        'chitiet_group_totals': chitiet_group_totals,
+        'chitiet_sum_cols': CHI_TIET_SUM_COLS,
+        'chitiet_total_row': chitiet_total_row,
+    }
+
+"""Vị trí hiện tại (0-based) của hàng có `row_id` trong sheet, -1 nếu không có."""
+def get_row_position(sheet_name, row_id):
+    rows = data_store.get(sheet_name, [])
+    if isinstance(rows, ColumnarSheet):
+        return rows.position_of(row_id)
+    row = get_row_by_id(sheet_name, row_id)
+    if row is None:
+        return -1
+    state = _row_positions.setdefault(sheet_name, {'pos': {}, 'valid': 0})
+    positions = state['pos']
+    pos = positions.get(row_id)
+    if pos is not None and pos < state['valid'] and pos < len(rows) and rows[pos] is row:
+        return pos
+    # Tính lại phần đuôi từ mốc; vẫn không khớp (danh sách bị sửa không qua `_index_row`/`_unindex_row`) -> tính lại toàn bộ
+    for start in (state['valid'], 0):
+        for i in range(start, len(rows)):
+            positions[rows[i].get('row_id')] = i
+        state['valid'] = len(rows)
+        pos = positions.get(row_id, -1)
+        if 0 <= pos < len(rows) and rows[pos] is row:
+            return pos
+    return -1
+
 """Đánh lại số thứ tự STT theo vị trí hiện tại."""
 def ensure_stt(rows):
+    if isinstance(rows, ColumnarSheet):
+        rows.renumber('STT')
+        return
     for idx, row in enumerate(rows, start=1):
         row['STT'] = idx
 
@@ -488,61 +1428,470 @@ def ensure_cloud_min_rows():
     needed = 6 - len(target)
     if needed > 0:
         for _ in range(needed):
-            target.append(blank_row(CLOUD_COLUMNS))
+            target.append(blank_row(_sheet_columns('Cloud')))
+            _index_row('Cloud', target[-1], len(target) - 1)
         ensure_stt(target)
     data_store['Cloud'] = target
 
+for _sheet_name in list(data_store):
+    _set_sheet_rows(_sheet_name, data_store[_sheet_name])
 ensure_cloud_min_rows()
 
-"""Thiết lập đường dẫn cache để lưu/khôi phục `data_store`."""
-CACHE_DIR = os.path.join(os.path.dirname(__file__), 'cache')
+"""Thiết lập đường dẫn cache để lưu/khôi phục `data_store` (đổi thư mục bằng biến môi trường `CACHE_DIR`)."""
+CACHE_DIR = os.environ.get('CACHE_DIR') or os.path.join(os.path.dirname(__file__), 'cache')
 os.makedirs(CACHE_DIR, exist_ok=True)
 CACHE_FILE = os.path.join(CACHE_DIR, 'data_store.json')
 PHONE_RECIPIENTS_FILE = os.path.join(CACHE_DIR, 'phone_recipients.json')  # mapping row_id -> whatsapp phone
 CAP_PHAT_SR_CREATED_FILE = os.path.join(CACHE_DIR, 'cap_phat_sr_created.json')  # mapping row_id -> Ngày tạo mã SR (dd/mm/YYYY)
+WHATSAPP_OUTBOX_FILE = os.path.join(CACHE_DIR, 'whatsapp_outbox.json')  # outbox cảnh báo WhatsApp (chống gửi trùng)
+CACHE_JOURNAL_FILE = os.path.join(CACHE_DIR, 'data_store.journal')  # nhật ký chỉnh sửa (JSON lines)
+
+# Chế độ lưu: 'journal' (mặc định) nối bản ghi nhỏ vào nhật ký, 'snapshot' ghi lại toàn bộ cache mỗi lần
+CACHE_PERSIST_MODE = os.environ.get('CACHE_PERSIST_MODE', 'journal').strip().lower()
+# Số bản ghi nhật ký tối đa trước khi compaction (ghi lại snapshot)
+CACHE_COMPACT_EVERY = int(os.environ.get('CACHE_COMPACT_EVERY', '500') or 500)
+# Backend lưu bền: 'json' (mặc định, snapshot + nhật ký ở trên) hoặc 'sqlite' (xem `SqliteStore`)
+STORAGE_BACKEND = os.environ.get('STORAGE_BACKEND', 'json').strip().lower()
+SQLITE_FILE = os.environ.get('SQLITE_FILE') or os.path.join(CACHE_DIR, 'data_store.sqlite')
+
+_persist_lock = threading.RLock()
+_journal_state = {'generation': None, 'count': 0, 'offset': 0, 'snapshot_due': False}  # offset = số byte nhật ký đã áp dụng vào bộ nhớ
+
+"""Chế độ nhiều worker (gunicorn, `MULTI_WORKER=1`, xem `gunicorn.conf.py`): các worker dùng chung cache trên đĩa.
+
+- Mọi lần ghi (nhật ký, snapshot, SQLite) giữ khoá file `cache/data_store.lock` và áp dụng thay đổi của
+  worker khác trước khi ghi, nên không worker nào ghi đè dữ liệu của worker khác
+- Đầu mỗi request chỉ stat snapshot + nhật ký (SQLite: `PRAGMA data_version`). Nếu worker khác đã ghi,
+  các bản ghi mới ở cuối nhật ký được áp dụng vào `data_store`; snapshot đổi (import, compaction, đổi cột)
+  thì nạp lại toàn bộ
+- Scheduler WhatsApp chỉ chạy ở worker giữ khoá `cache/whatsapp_scheduler.lock`
+Khoá file dùng `fcntl.flock` (Linux/macOS); trên Windows chỉ hỗ trợ một tiến trình.
+"""
+MULTI_WORKER = os.environ.get('MULTI_WORKER', '0').strip().lower() in ('1', 'true', 'yes', 'on')
+STORE_LOCK_FILE = os.path.join(CACHE_DIR, 'data_store.lock')
+SCHEDULER_LOCK_FILE = os.path.join(CACHE_DIR, 'whatsapp_scheduler.lock')
+_sync_state = {'snapshot': None, 'sqlite_version': None, 'lock_depth': 0, 'lock_file': None}
+
+"""Khoá file độc quyền giữa các tiến trình (không làm gì nếu không ở chế độ nhiều worker hoặc không có fcntl)."""
+@contextmanager
+def _file_lock(path):
+    if not (MULTI_WORKER and fcntl):
+        yield
+        return
+    with open(path, 'a+') as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+"""Khoá ghi cache: khoá luồng `_persist_lock` + khoá file giữa các worker (lồng nhau được trong cùng tiến trình)."""
+@contextmanager
+def _store_lock():
+    with _persist_lock:
+        if _sync_state['lock_depth'] == 0 and MULTI_WORKER and fcntl:
+            f = open(STORE_LOCK_FILE, 'a+')
+            fcntl.flock(f, fcntl.LOCK_EX)
+            _sync_state['lock_file'] = f
+        _sync_state['lock_depth'] += 1
+        try:
+            yield
+        finally:
+            _sync_state['lock_depth'] -= 1
+            if _sync_state['lock_depth'] == 0 and _sync_state['lock_file'] is not None:
+                f, _sync_state['lock_file'] = _sync_state['lock_file'], None
+                fcntl.flock(f, fcntl.LOCK_UN)
+                f.close()
+
+def _file_signature(path):
+    try:
+        st = os.stat(path)
+        return (st.st_mtime_ns, st.st_size)
+    except OSError:
+        return None
+
+class SheetLock:
+    """Khoá đọc/ghi cho một sheet: nhiều luồng đọc song song, luồng ghi độc quyền và được ưu tiên
+    (luồng đọc mới chờ khi có luồng ghi đang đợi). Lồng nhau được trong cùng luồng; không nâng đọc -> ghi.
+    """
+
+    def __init__(self):
+        self._cond = threading.Condition(threading.Lock())
+        self._readers = {}  # ident luồng -> số lần giữ khoá đọc
+        self._writer = None
+        self._writer_depth = 0
+        self._writers_waiting = 0
+
+    def acquire_read(self):
+        me = threading.get_ident()
+        with self._cond:
+            if self._writer == me:
+                self._writer_depth += 1
+                return
+            if me not in self._readers:
+                while self._writer is not None or self._writers_waiting:
+                    self._cond.wait()
+            self._readers[me] = self._readers.get(me, 0) + 1
+
+    def release_read(self):
+        me = threading.get_ident()
+        with self._cond:
+            if self._writer == me:
+                self._writer_depth -= 1
+                return
+            self._readers[me] -= 1
+            if not self._readers[me]:
+                del self._readers[me]
+                if not self._readers:
+                    self._cond.notify_all()
+
+    def acquire_write(self):
+        me = threading.get_ident()
+        with self._cond:
+            if self._writer == me:
+                self._writer_depth += 1
+                return
+            if me in self._readers:
+                raise RuntimeError('Cannot upgrade a sheet read lock to a write lock')
+            self._writers_waiting += 1
+            try:
+                while self._writer is not None or self._readers:
+                    self._cond.wait()
+            finally:
+                self._writers_waiting -= 1
+            self._writer = me
+            self._writer_depth = 1
+
+    def release_write(self):
+        with self._cond:
+            self._writer_depth -= 1
+            if not self._writer_depth:
+                self._writer = None
+                self._cond.notify_all()
+
+"""Khoá theo sheet cho server đa luồng: render/đọc giữ khoá đọc của các sheet liên quan, thêm/xoá/sửa hàng
+và đổi cột giữ khoá ghi của đúng sheet đó, nên thao tác trên các sheet khác nhau và các lượt đọc chạy song song.
+
+Luôn lấy khoá theo thứ tự `SHEET_NAMES` (tránh deadlock) và TRƯỚC `_persist_lock`/`_store_lock`.
+Ở chế độ nhiều worker, ghi giữ khoá mọi sheet vì lúc ghi nhật ký có thể phải áp dụng thay đổi của worker khác.
+"""
+SHEET_NAMES = ('Sizing', 'CapPhat', 'ChiTiet', 'Cloud')
+_sheet_locks = {name: SheetLock() for name in SHEET_NAMES}
+
+def _ordered_sheet_locks(names):
+    wanted = set(names)
+    return [_sheet_locks[name] for name in SHEET_NAMES if name in wanted]
+
+@contextmanager
+def read_sheets(*names):
+    locks = _ordered_sheet_locks(names or SHEET_NAMES)
+    acquired = []
+    try:
+        for lock in locks:
+            lock.acquire_read()
+            acquired.append(lock)
+        yield
+    finally:
+        for lock in reversed(acquired):
+            lock.release_read()
+
+_sheet_lock_local = threading.local()
+
+"""Tên các sheet luồng hiện tại đang giữ khoá ghi (sheet -> số lần lồng nhau)."""
+def _held_sheet_writes():
+    held = getattr(_sheet_lock_local, 'writes', None)
+    if held is None:
+        held = _sheet_lock_local.writes = {}
+    return held
+
+@contextmanager
+def write_sheets(*names):
+    names = SHEET_NAMES if (MULTI_WORKER or not names) else tuple(n for n in SHEET_NAMES if n in names)
+    held = _held_sheet_writes()
+    acquired = []
+    try:
+        for lock in _ordered_sheet_locks(names):
+            lock.acquire_write()
+            acquired.append(lock)
+        for name in names:
+            held[name] = held.get(name, 0) + 1
+        yield
+    finally:
+        if len(acquired) == len(names):
+            for name in names:
+                held[name] -= 1
+                if not held[name]:
+                    del held[name]
+        for lock in reversed(acquired):
+            lock.release_write()
+        # Snapshot bị hoãn khi đang giữ khoá ghi một phần sheet: ghi khi đã nhả hết, dưới khoá đọc mọi sheet
+        if not held and _journal_state.get('snapshot_due'):
+            with read_sheets():
+                if _journal_state.get('snapshot_due'):
+                    save_cache()
+
+"""Ghi snapshot toàn bộ cache khi an toàn: ngay nếu luồng không giữ khoá ghi sheet nào hoặc giữ tất cả,
+ngược lại hoãn tới khi `write_sheets` ngoài cùng nhả khoá (sheet khác có thể đang bị sửa dở).
+"""
+def request_snapshot():
+    held = _held_sheet_writes()
+    if held and not all(held.get(name) for name in SHEET_NAMES):
+        _journal_state['snapshot_due'] = True
+        return
+    save_cache()
+
+"""Lớp parse ngày dùng chung cho mọi nơi xử lý ngày (tiến độ, cảnh báo, import, export, filter).
+
+Kết quả tương đương `pd.to_datetime(val, dayfirst=True, errors='coerce')` (NaT/lỗi -> None), nhưng:
+- Chuỗi `dd/mm/YYYY` (định dạng lưu trong sheet) được parse thẳng, không qua pandas
+- Kết quả được nhớ trong cache LRU có giới hạn `DATE_PARSE_CACHE_SIZE` theo (kiểu, giá trị)
+- Chỉ đầu vào lạ (có giờ, ISO, số serial, tháng > 12...) mới rơi về pandas
+Tỉ lệ cache hit xem qua `/debug-date-cache`.
+"""
+DATE_PARSE_CACHE_SIZE = int(os.environ.get('DATE_PARSE_CACHE_SIZE', '4096') or 4096)
+_DMY_FULL = re.compile(r"\s*([0-9]{1,2})/([0-9]{1,2})/([0-9]{4})\s*")
+_date_cache = OrderedDict()
+_date_cache_lock = threading.Lock()
+_date_cache_stats = {'hits': 0, 'misses': 0, 'fast_path': 0, 'fallback': 0}
+
+def _parse_date_uncached(val):
+    m = _DMY_FULL.fullmatch(val) if isinstance(val, str) else None
+    if m:
+        year = int(m.group(3))
+        # Ngoài khoảng này pandas có thể trả NaT/báo tràn tuỳ phiên bản -> để pandas quyết định
+        if 1678 <= year <= 2261:
+            try:
+                ts = pd.Timestamp(year, int(m.group(2)), int(m.group(1)))
+                _date_cache_stats['fast_path'] += 1
+                return ts
+            except ValueError:
+                pass  # ví dụ tháng > 12: pandas có thể đảo ngày/tháng như trước
+    _date_cache_stats['fallback'] += 1
+    try:
+        dt = pd.to_datetime(val, dayfirst=True, errors='coerce')
+        return None if pd.isna(dt) else dt
+    except Exception:
+        return None
+
+"""Parse một giá trị thành Timestamp (None nếu không phải ngày), có cache."""
+def parse_date_value(val):
+    if isinstance(val, (datetime, pd.Timestamp)):
+        return None if pd.isna(val) else pd.Timestamp(val)
+    if isinstance(val, float) and val != val:
+        return None
+    try:
+        key = (type(val), val)
+        hash(key)
+    except TypeError:
+        return _parse_date_uncached(val)
+    with _date_cache_lock:
+        if key in _date_cache:
+            _date_cache.move_to_end(key)
+            _date_cache_stats['hits'] += 1
+            return _date_cache[key]
+    result = _parse_date_uncached(val)
+    with _date_cache_lock:
+        _date_cache_stats['misses'] += 1
+        _date_cache[key] = result
+        while len(_date_cache) > DATE_PARSE_CACHE_SIZE:
+            _date_cache.popitem(last=False)
+    return result
+
+def date_cache_info():
+    stats = dict(_date_cache_stats)
+    lookups = stats['hits'] + stats['misses']
+    stats['size'] = len(_date_cache)
+    stats['max_size'] = DATE_PARSE_CACHE_SIZE
+    stats['hit_rate'] = round(stats['hits'] / lookups, 4) if lookups else None
+    return stats
 
 """Cố gắng parse chuỗi ngày thành Timestamp; lỗi trả về None."""
 def _parse_date(val):
     if not val:
         return None
+    return parse_date_value(val)
+
+"""Ngày nghỉ lễ không tính là ngày làm việc khi tính tiến độ KPI.
+
+Mặc định gồm các ngày lễ dương lịch cố định của Việt Nam (`VN_FIXED_HOLIDAYS`, dạng (ngày, tháng)).
+Tết Nguyên đán, Giỗ Tổ Hùng Vương, ngày nghỉ kèm Quốc khánh và ngày nghỉ bù đổi theo từng năm nên
+cấu hình thêm qua biến môi trường `PUBLIC_HOLIDAYS` (phân tách bởi dấu phẩy) hoặc file
+`cache/holidays.json` (list chuỗi). Mỗi mục là `dd/mm/YYYY` (một ngày cụ thể) hoặc `dd/mm` (lặp lại hằng năm).
+"""
+VN_FIXED_HOLIDAYS = [(1, 1), (30, 4), (1, 5), (2, 9)]
+PUBLIC_HOLIDAYS_FILE = os.path.join(CACHE_DIR, 'holidays.json')
+BUSINESS_CALENDAR_DAYS = 800         # số ngày tính sẵn kể từ hôm nay (KPI xa hơn chắc chắn > 3 ngày làm việc)
+BUSINESS_CALENDAR_DAYS_BEFORE = 366  # và trước hôm nay (JS cần ngày lễ khi nhập ngày đẩy yêu cầu cũ)
+
+"""Nhãn tiến độ theo mã: 0 = rỗng, 1 = quá hạn, 2.. = còn 0..3 ngày làm việc."""
+PROGRESS_LABELS = ["", "Quá hạn", "Đến hạn", "Còn 1 ngày", "Còn 2 ngày", "Còn 3 ngày"]
+
+def _holiday_entries():
+    entries = [e.strip() for e in os.environ.get('PUBLIC_HOLIDAYS', '').split(',') if e.strip()]
     try:
-        dt = pd.to_datetime(val, dayfirst=True, errors='coerce')
-        if pd.isna(dt):
-            return None
-        return dt
+        if os.path.exists(PUBLIC_HOLIDAYS_FILE):
+            with open(PUBLIC_HOLIDAYS_FILE, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            if isinstance(data, list):
+                entries.extend(str(e).strip() for e in data if str(e).strip())
     except Exception:
-        return None
+        pass
+    return entries
 
-"""Tính trạng thái tiến độ dựa trên ngày KPI so với hôm nay."""
-def _calc_progress_status(kpi_str):
-    kpi = _parse_date(kpi_str)
-    if not kpi:
-        return ""
-    today = pd.Timestamp('today').normalize()
-    kpi = pd.Timestamp(kpi).normalize()
+class BusinessCalendar:
+    """Bảng tra ngày làm việc tính sẵn quanh `today`: số thứ tự ngày -> số ngày làm việc luỹ kế.
+
+    `cum[i]` là số ngày làm việc trong [base, base + i) với base = today - `days_before`, nên số ngày
+    làm việc giữa hai ngày bất kỳ trong khoảng (không tính ngày cuối) chỉ là hiệu hai phép tra mảng.
+    """
 
-    if kpi < today:
-        return "Quá hạn"
+    def __init__(self, today, holidays=(), days_before=BUSINESS_CALENDAR_DAYS_BEFORE, days_after=BUSINESS_CALENDAR_DAYS):
+        self.today = today.toordinal()
+        self.base = self.today - days_before
+        self.days = days_before + days_after
+        ordinals = np.arange(self.base, self.base + self.days)
+        weekdays = (ordinals - 1) % 7 < 5  # ordinal 1 (01/01/0001) là thứ Hai
+        working = weekdays.copy()
+        years = range(date.fromordinal(self.base).year, date.fromordinal(self.base + self.days - 1).year + 1)
+        fixed = list(VN_FIXED_HOLIDAYS)
+        for entry in holidays:
+            parts = entry.split('/')
+            try:
+                if len(parts) == 2:
+                    fixed.append((int(parts[0]), int(parts[1])))
+                    continue
+                dt = _parse_date(entry)
+                if dt is not None:
+                    self._close(working, pd.Timestamp(dt).toordinal())
+            except (ValueError, TypeError):
+                continue
+        self.fixed = set(fixed)
+        for day, month in fixed:
+            for year in years:
+                try:
+                    self._close(working, date(year, month, day).toordinal())
+                except ValueError:
+                    continue
+        self.cum = np.zeros(self.days + 1, dtype=np.int32)
+        np.cumsum(working, out=self.cum[1:])
+        self._today_cum = int(self.cum[days_before])
+        # Ngày lễ rơi vào ngày thường (YYYY-MM-DD), gửi cho JS phía client để tính KPI khớp server
+        self.holidays = [date.fromordinal(int(o)).isoformat() for o in ordinals[weekdays & ~working]]
+
+    def _close(self, working, ordinal):
+        if self.base <= ordinal < self.base + self.days:
+            working[ordinal - self.base] = False
+
+    def working_days_between(self, start_ordinal, end_ordinal):
+        """Số ngày làm việc trong [start, end) (ngoài khoảng tính sẵn thì bị chặn ở biên)."""
+        lo = min(max(start_ordinal - self.base, 0), self.days)
+        hi = min(max(end_ordinal - self.base, 0), self.days)
+        return int(self.cum[hi] - self.cum[lo]) if hi > lo else 0
+
+    def is_working_day(self, ordinal):
+        """Ngày `ordinal` có phải ngày làm việc không (ngoài khoảng tính sẵn: chỉ xét cuối tuần và ngày lễ cố định)."""
+        if self.base <= ordinal < self.base + self.days:
+            return bool(self.cum[ordinal - self.base + 1] - self.cum[ordinal - self.base])
+        d = date.fromordinal(ordinal)
+        return d.weekday() < 5 and (d.day, d.month) not in self.fixed
+
+    def prev_working_day(self, ordinal, limit=31):
+        """Ngày làm việc gần nhất trước `ordinal` (tìm lùi tối đa `limit` ngày)."""
+        for prev in range(ordinal - 1, ordinal - limit - 1, -1):
+            if self.is_working_day(prev):
+                return prev
+        return ordinal - limit
+
+    def progress_code(self, kpi_ordinal):
+        """Mã tiến độ cho một ngày KPI (bản vô hướng của `progress_codes`)."""
+        if kpi_ordinal <= 0:
+            return 0
+        if kpi_ordinal < self.today:
+            return 1
+        wdays = int(self.cum[min(kpi_ordinal - self.base, self.days)]) - self._today_cum
+        return wdays + 2 if wdays <= 3 else 0
+
+    def progress_codes(self, kpi_ordinals):
+        """Mã tiến độ (chỉ số trong `PROGRESS_LABELS`) cho mảng ordinal ngày KPI (<= 0 = không có ngày)."""
+        kpi = np.asarray(kpi_ordinals, dtype=np.int64)
+        wdays = self.cum[np.clip(kpi - self.base, 0, self.days)] - self._today_cum
+        codes = np.where(wdays <= 3, wdays + 2, 0)
+        codes = np.where(kpi < self.today, 1, codes)
+        return np.where(kpi <= 0, 0, codes)
+
+"""Khoảng dương lịch có thể rơi vào của các ngày lễ âm lịch: Tết Nguyên đán (mùng 1 tháng Giêng) và
+Giỗ Tổ Hùng Vương (10/3 âm lịch), dạng (tháng, ngày). Dùng để cảnh báo khi năm hiện tại chưa cấu hình các ngày này.
+"""
+VN_LUNAR_HOLIDAY_WINDOWS = {
+    'Tết Nguyên đán': ((1, 21), (2, 20)),
+    'Giỗ Tổ Hùng Vương': ((3, 29), (4, 30)),
+}
 
+"""Tên các ngày lễ âm lịch chưa có ngày cụ thể (`dd/mm/YYYY`) nào của năm `year` trong cấu hình ngày lễ."""
+def _missing_lunar_holidays(entries, year):
+    configured = set()
+    for entry in entries:
+        if entry.count('/') != 2:
+            continue
+        dt = _parse_date(entry)
+        if dt is not None and dt.year == year:
+            configured.add((dt.month, dt.day))
+    return [name for name, (start, end) in VN_LUNAR_HOLIDAY_WINDOWS.items()
+            if not any(start <= day <= end for day in configured)]
+
+_calendar_cache = {'key': None, 'calendar': None, 'warned': None}
+
+"""Lịch ngày làm việc cho `today` (mặc định hôm nay); dựng lại khi sang ngày mới hoặc đổi cấu hình ngày lễ."""
+def _business_calendar(today=None):
+    today = pd.Timestamp(today).date() if today is not None else date.today()
     try:
-        wdays = len(pd.bdate_range(start=today, end=kpi, closed='right'))
-    except Exception:
-        d = today
-        wdays = 0
-        while d < kpi:
-            if d.weekday() < 5:
-                wdays += 1
-            d += pd.Timedelta(days=1)
-
-    if wdays == 0:
-        return "Đến hạn"
-    if wdays == 1:
-        return "Còn 1 ngày"
-    if wdays == 2:
-        return "Còn 2 ngày"
-    if wdays == 3:
-        return "Còn 3 ngày"
-    return ""
+        stat = os.stat(PUBLIC_HOLIDAYS_FILE)
+        file_sig = (stat.st_mtime_ns, stat.st_size)
+    except OSError:
+        file_sig = None
+    key = (today.toordinal(), os.environ.get('PUBLIC_HOLIDAYS', ''), file_sig)
+    cached = _calendar_cache
+    if cached['key'] != key:
+        entries = _holiday_entries()
+        calendar = BusinessCalendar(today, holidays=entries)
+        calendar.signature = key[1:]  # cấu hình ngày lễ, không phụ thuộc ngày hiện tại
+        if today == date.today():
+            cached['key'], cached['calendar'] = key, calendar
+            # Cảnh báo một lần cho mỗi năm/cấu hình: thiếu Tết, Giỗ Tổ thì KPI tính cả ngày nghỉ là ngày làm việc
+            missing = _missing_lunar_holidays(entries, today.year)
+            if missing and cached['warned'] != (today.year,) + key[1:]:
+                cached['warned'] = (today.year,) + key[1:]
+                app.logger.warning('Chưa cấu hình ngày lễ âm lịch năm %d (%s) trong PUBLIC_HOLIDAYS/holidays.json: '
+                                   'các ngày này đang được tính là ngày làm việc', today.year, ', '.join(missing))
+        return calendar
+    return cached['calendar']
+
+"""Áp dụng `func` đúng một lần cho mỗi giá trị phân biệt trong cột rồi ánh xạ lại theo mã.
+
+Các cột import thường lặp lại rất nhiều (ngày, đơn vị, số lượng...), nên thay vì gọi hàm
+chuẩn hoá cho từng ô, ta `factorize` cả cột và chỉ xử lý tập giá trị duy nhất.
+"""
+def _map_distinct(series: pd.Series, func) -> pd.Series:
+    values = series.to_numpy(dtype=object)
+    # bool bằng 1/0 khi băm nên factorize có thể gộp nhầm với số -> xử lý từng ô cho chắc
+    if series.dtype == object and any(type(v) is bool for v in values):
+        return pd.Series([func(v) for v in values], index=series.index, dtype=object)
+    codes, uniques = pd.factorize(values, use_na_sentinel=False)
+    mapped = np.empty(len(uniques), dtype=object)
+    for i, u in enumerate(uniques):
+        mapped[i] = func(u)
+    return pd.Series(mapped.take(codes), index=series.index, dtype=object)
+
+def _date_ordinal(val):
+    dt = _parse_date(val)
+    return dt.toordinal() if dt is not None else 0
+
+"""Tính trạng thái tiến độ dựa trên số ngày làm việc (bỏ cuối tuần và ngày lễ) từ hôm nay tới ngày KPI."""
+def _calc_progress_status(kpi_str, today=None):
+    ordinal = _date_ordinal(kpi_str)
+    if not ordinal:
+        return ""
+    return PROGRESS_LABELS[_business_calendar(today).progress_code(ordinal)]
 
 """Cập nhật trường 'Tiến độ' của một hàng Sizing."""
 def _update_progress_for_row(row):
@@ -550,165 +1899,635 @@ def _update_progress_for_row(row):
         row.get("Thời gian hoàn thành theo KPI", "")
     )
 
-"""Quét toàn bộ sheet Sizing để cập nhật tiến độ."""
-def _refresh_sizing_progress():
+"""Cập nhật tiến độ cho cả sheet Sizing (hoặc một cửa sổ hàng) bằng tra cứu vector trên lịch ngày làm việc.
+
+Mỗi giá trị KPI khác nhau chỉ được parse một lần; phần còn lại là phép tra mảng numpy.
+"""
+def _refresh_sizing_progress(rows=None, today=None):
+    started = time.perf_counter()
     try:
-        for row in data_store.get('Sizing', []):
-            _update_progress_for_row(row)
-    except Exception:
+        rows = data_store.get('Sizing', []) if rows is None else rows
+        if not len(rows):
+            return
+        kpis = pd.Series(sheet_column(rows, "Thời gian hoàn thành theo KPI"), dtype=object)
+        ordinals = _map_distinct(kpis, _date_ordinal).to_numpy(dtype=np.int64)
+        codes = _business_calendar(today).progress_codes(ordinals)
+        if isinstance(rows, ColumnarSheet):
+            rows.fill_column("Tiến độ", PROGRESS_LABELS, codes)
+        else:
+            for row, code in zip(rows, codes.tolist()):
+                row["Tiến độ"] = PROGRESS_LABELS[code]
+    except (ValueError, TypeError, KeyError, OSError):
+        # Chỉ bỏ qua lỗi dữ liệu/cấu hình ngày lễ; lỗi lập trình (NameError...) phải lộ ra
         pass
+    metrics.observe('excel_progress_refresh_duration_seconds', time.perf_counter() - started)
 
-"""Ghi `data_store` ra file JSON cache (best-effort)."""
+"""Ghi snapshot đầy đủ `data_store` ra file JSON cache (best-effort), hoặc ghi lại toàn bộ kho SQLite.
+
+Đây cũng là bước compaction: sau khi snapshot mới được ghi (atomic qua file tạm),
+nhật ký chỉnh sửa được khởi tạo lại với cùng `generation` của snapshot.
+Khi nào snapshot được ghi: xem `persist_changes`.
+"""
 def save_cache():
+    _journal_state['snapshot_due'] = False
+    started = time.perf_counter()
+    if STORAGE_BACKEND == 'sqlite':
+        with _store_lock():
+            try:
+                _sqlite_store.save_all(_sqlite_payload(), _schemas_payload(), _versions_payload())
+                _sync_state['sqlite_version'] = _sqlite_store.data_version()
+                _observe_save_cache(started, SQLITE_FILE)
+            except Exception:
+                pass
+        return
+    with _store_lock():
+        try:
+            generation = uuid.uuid4().hex
+            payload = {name: _rows_as_records(rows) for name, rows in data_store.items()}
+            payload['_meta'] = {'generation': generation, 'saved_at': datetime.now().isoformat(timespec='seconds'),
+                                'schemas': _schemas_payload(), 'versions': _versions_payload()}
+            tmp_path = CACHE_FILE + '.tmp'
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(payload, f, ensure_ascii=False, indent=2)
+            os.replace(tmp_path, CACHE_FILE)
+            _sync_state['snapshot'] = _file_signature(CACHE_FILE)
+            _reset_journal(generation)
+            _observe_save_cache(started, CACHE_FILE)
+        except Exception:
+            pass
+
+def _observe_save_cache(started, path):
+    backend = 'sqlite' if STORAGE_BACKEND == 'sqlite' else 'json'
+    metrics.observe('excel_save_cache_duration_seconds', time.perf_counter() - started, backend=backend)
+    metrics.inc('excel_save_cache_bytes_total', os.path.getsize(path), backend=backend)
+
+"""Khởi tạo lại nhật ký: chỉ còn dòng header gắn với snapshot hiện tại."""
+def _reset_journal(generation):
+    _journal_state['generation'] = None
+    _journal_state['count'] = 0
+    header = json.dumps({'op': 'header', 'generation': generation}) + '\n'
+    with open(CACHE_JOURNAL_FILE, 'w', encoding='utf-8') as f:
+        f.write(header)
+    _journal_state['generation'] = generation
+    _journal_state['offset'] = len(header.encode('utf-8'))
+
+class StoreWriteError(Exception):
+    """Không lưu được thay đổi vào kho dữ liệu sau khi đã thử lại."""
+
+@app.errorhandler(StoreWriteError)
+def _store_write_error_response(e):
+    return jsonify({'error': 'Không lưu được thay đổi, vui lòng tải lại trang và thử lại'}), 503
+
+"""Áp dụng bản ghi vào SQLite (gọi khi giữ `_store_lock`), thử lại khi file đang bị khoá.
+
+Vẫn lỗi: nạp lại các sheet liên quan từ SQLite để bộ nhớ không giữ thay đổi chưa được lưu, rồi báo lỗi.
+"""
+def _sqlite_apply(records):
+    for attempt in range(SQLITE_APPLY_RETRIES + 1):
+        try:
+            # Số `seq` được cấp trong cùng giao dịch SQLite nên không trùng giữa các worker
+            _sqlite_store.apply(records)
+            _apply_record_versions(records)
+            return
+        except sqlite3.OperationalError:
+            if attempt >= SQLITE_APPLY_RETRIES:
+                break
+            time.sleep(0.05 * 2 ** attempt)
+        except Exception:
+            break
+    app.logger.exception('SQLite: không lưu được %d bản ghi', len(records))
+    metrics.inc('excel_persist_errors_total', backend='sqlite')
+    sheets = {rec.get('sheet') for rec in records if rec.get('sheet') in SQLITE_TABLES}
     try:
-        with open(CACHE_FILE, 'w', encoding='utf-8') as f:
-            json.dump(data_store, f, ensure_ascii=False, indent=2)
+        loaded = _sqlite_store.load_all()
+        _apply_loaded({**{name: loaded[name] for name in sheets if name in loaded}, '_meta': loaded['_meta']})
     except Exception:
-        pass
-
-def _load_sr_created_map():
-    if os.path.exists(CAP_PHAT_SR_CREATED_FILE):
+        app.logger.exception('SQLite: không nạp lại được %s', sorted(sheets))
+    raise StoreWriteError()
+
+"""Lưu các thay đổi nhỏ (sửa ô, thêm/xoá dòng, đổi lược đồ). Đây là nơi duy nhất quyết định thay đổi đi đường nào:
+
+- `STORAGE_BACKEND=sqlite`: một giao dịch SQLite cho mỗi lần gọi (`_sqlite_apply`), không bao giờ ghi snapshot
+- `CACHE_PERSIST_MODE=snapshot`: mỗi lần gọi ghi lại toàn bộ file cache (hành vi cũ)
+- `journal` (mặc định): nối bản ghi vào cuối `data_store.journal`, chi phí không phụ thuộc kích thước sheet.
+  Snapshot (`save_cache`, cũng là bước compaction) chỉ được ghi trong ba trường hợp:
+  1. chưa có snapshot gắn generation (lần chạy đầu, hoặc cache cũ từ trước khi có nhật ký)
+  2. nối nhật ký lỗi (đầy đĩa, lỗi quyền...): snapshot chứa luôn thay đổi này
+  3. nhật ký đã đủ `CACHE_COMPACT_EVERY` bản ghi
+Ngoài các đường trên, `save_cache` chỉ được gọi trực tiếp khi import thay toàn bộ dữ liệu và khi chuyển cache JSON
+sang SQLite. Ở mọi đường, bản ghi được đánh `seq` (phiên bản hàng, `_stamp_records`) trong `_store_lock` trước khi ghi;
+snapshot luôn đi qua `request_snapshot` (hoãn tới khi nhả khoá nếu luồng chỉ giữ khoá ghi một phần sheet).
+
+Dừng đột ngột ở bất kỳ bước nào đều khôi phục được: bản ghi đã nối vào nhật ký được phát lại khi khởi động; snapshot
+ghi atomic (file tạm + `os.replace`) và nhật ký chỉ được đặt lại sau đó, nên nhật ký còn header generation cũ bị bỏ
+qua (các bản ghi đó đã nằm trong snapshot mới); dòng cuối ghi dở bị bỏ qua (`_replay_journal`).
+Gọi khi đang giữ khoá ghi (`write_sheets`) của các sheet bị sửa.
+"""
+def persist_changes(*records):
+    if STORAGE_BACKEND == 'sqlite':
+        with _store_lock():
+            _sqlite_apply(records)
+        return
+    if CACHE_PERSIST_MODE != 'journal':
+        with _store_lock():
+            _stamp_records(records)
+        request_snapshot()
+        return
+    with _store_lock():
+        # Nhiều worker: lấy thay đổi của worker khác trước, để phần nối thêm khớp với offset đã áp dụng
+        # và số `seq` cấp cho các bản ghi này tiếp nối số của worker khác
+        if MULTI_WORKER:
+            _sync_journal_locked()
+        _stamp_records(records)
+        if _journal_state['generation'] is None:
+            # Chưa có snapshot gắn generation (cache cũ hoặc lần chạy đầu) -> ghi snapshot
+            request_snapshot()
+            return
         try:
-            with open(CAP_PHAT_SR_CREATED_FILE, 'r', encoding='utf-8') as f:
-                return json.load(f)
+            lines = ''.join(
+                json.dumps(rec, ensure_ascii=False, separators=(',', ':')) + '\n' for rec in records
+            )
+            if os.path.getsize(CACHE_JOURNAL_FILE) > _journal_state['offset']:
+                # Dòng cuối ghi dở (tiến trình trước dừng giữa lúc ghi, đã bị bỏ qua khi phát lại):
+                # cắt bỏ để bản ghi mới không nối vào sau nó
+                with open(CACHE_JOURNAL_FILE, 'r+b') as f:
+                    f.truncate(_journal_state['offset'])
+            with open(CACHE_JOURNAL_FILE, 'a', encoding='utf-8') as f:
+                f.write(lines)
+            written = len(lines.encode('utf-8'))
+            _journal_state['count'] += len(records)
+            _journal_state['offset'] += written
+            metrics.inc('excel_journal_bytes_total', written)
         except Exception:
-            return {}
-    return {}
+            request_snapshot()
+            return
+        if _journal_state['count'] >= CACHE_COMPACT_EVERY:
+            request_snapshot()
+
+"""Áp dụng một bản ghi nhật ký lên dữ liệu thô (list dict) đọc từ snapshot."""
+def _apply_journal_record(loaded, rec, by_id):
+    sheet = rec.get('sheet')
+    rows = loaded.get(sheet)
+    if rows is None:
+        return
+    seq = rec.get('seq')
+    if seq:
+        versions = loaded.setdefault('_meta', {}).setdefault('versions', {})
+        versions['seq'] = max(versions.get('seq', 0), seq)
+        if rec.get('op') == 'set':
+            versions.setdefault('rows', {}).setdefault(sheet, {})[rec.get('row_id')] = seq
+        elif rec.get('op') == 'delete':
+            versions.get('rows', {}).get(sheet, {}).pop(rec.get('row_id'), None)
+    if rec.get('op') == 'schema':
+        schemas = loaded.setdefault('_meta', {}).setdefault('schemas', {})
+        old = SheetSchema.from_json(DEFAULT_SHEET_COLUMNS.get(sheet, []), schemas.get(sheet))
+        schemas[sheet] = rec.get('schema')
+        # Cột mặc định đã xoá không được "sống lại" giá trị cũ nếu sau đó được chèn lại
+        dropped = [c for c in old.ids if old.is_default(c) and c not in (rec.get('schema') or {}).get('ids', ())]
+        if dropped:
+            for row in rows:
+                for c in dropped:
+                    row.pop(c, None)
+        return
+    ids = by_id.get(sheet)
+    if ids is None:
+        ids = by_id[sheet] = {r.get('row_id'): r for r in rows}
+    op = rec.get('op')
+    if op == 'set':
+        row = ids.get(rec.get('row_id'))
+        if row is not None:
+            row[rec.get('col')] = rec.get('value', '')
+    elif op == 'insert':
+        new_row = dict(rec.get('row') or {})
+        after = rec.get('after')
+        pos = 0
+        if after is not None:
+            after_row = ids.get(after)
+            pos = rows.index(after_row) + 1 if after_row is not None else len(rows)
+        rows.insert(pos, new_row)
+        ids[new_row.get('row_id')] = new_row
+    elif op == 'delete':
+        row = ids.pop(rec.get('row_id'), None)
+        if row is not None:
+            rows.remove(row)
+
+"""Đọc nhật ký và áp dụng các bản ghi thuộc đúng generation của snapshot.
+
+Nếu header không khớp (ví dụ dừng giữa lúc compaction), các bản ghi đó đã nằm trong
+snapshot nên bị bỏ qua. Dòng cuối bị ghi dở (JSON lỗi) cũng được bỏ qua.
+"""
+def _replay_journal(loaded, generation):
+    if not generation or not os.path.exists(CACHE_JOURNAL_FILE):
+        return None
+    applied = 0
+    by_id = {}
+    with open(CACHE_JOURNAL_FILE, 'r', encoding='utf-8') as f:
+        header = f.readline()
+        try:
+            if json.loads(header).get('generation') != generation:
+                return None
+        except Exception:
+            return None
+        offset = len(header.encode('utf-8'))
+        for line in f:
+            if not line.endswith('\n'):
+                break
+            try:
+                rec = json.loads(line)
+            except Exception:
+                break
+            _apply_journal_record(loaded, rec, by_id)
+            applied += 1
+            offset += len(line.encode('utf-8'))
+    _journal_state['offset'] = offset
+    return applied
+
+"""Áp dụng các bản ghi nhật ký do worker khác ghi lên `data_store` đang chạy (giữ đồng bộ chỉ mục/tổng hợp)."""
+def _apply_live_records(records):
+    touched = set()
+    changed_rows = {}
+    for rec in records:
+        sheet = rec.get('sheet')
+        rows = data_store.get(sheet)
+        if rows is None:
+            continue
+        op = rec.get('op')
+        if rec.get('seq'):
+            _version_state['seq'] = max(_version_state['seq'], rec['seq'])
+        if op == 'schema':
+            _apply_schema(sheet, SheetSchema.from_json(DEFAULT_SHEET_COLUMNS[sheet], rec.get('schema')))
+        elif op == 'set':
+            row = get_row_by_id(sheet, rec.get('row_id'))
+            col = rec.get('col')
+            if row is None or col not in _sheet_columns(sheet):
+                continue
+            affects_summary = _aggregate_affected(sheet, col)
+            if affects_summary:
+                _aggregate_row(sheet, row, -1)
+            row[col] = rec.get('value', '')
+            if affects_summary:
+                _aggregate_row(sheet, row, 1)
+            _set_row_version(sheet, row.get('row_id'), rec.get('seq') or _next_store_seq())
+            changed_rows[(sheet, row.get('row_id'))] = (sheet, row)
+        elif op == 'insert':
+            data = rec.get('row') or {}
+            new_row = {c: data.get(c, '') for c in _sheet_columns(sheet)}
+            new_row['row_id'] = data.get('row_id') or str(uuid.uuid4())
+            after = rec.get('after')
+            pos = 0
+            if after is not None:
+                after_pos = get_row_position(sheet, after)
+                pos = after_pos + 1 if after_pos >= 0 else len(rows)
+            rows.insert(pos, new_row)
+            _index_row(sheet, rows[pos], pos)
+            _aggregate_row(sheet, rows[pos], 1)
+            changed_rows[(sheet, new_row['row_id'])] = (sheet, rows[pos])
+            touched.add(sheet)
+        elif op == 'delete':
+            pos = get_row_position(sheet, rec.get('row_id'))
+            if pos < 0:
+                continue
+            _aggregate_row(sheet, rows[pos], -1)
+            removed = rows.pop(pos)
+            _unindex_row(sheet, removed)
+            _deadline_forget_row(sheet, removed)
+            _forget_row_version(sheet, removed.get('row_id'))
+            changed_rows.pop((sheet, removed.get('row_id')), None)
+            touched.add(sheet)
+    for sheet in touched:
+        ensure_stt(data_store[sheet])
+    _refresh_sizing_progress([row for s, row in changed_rows.values() if s == 'Sizing'])
+    _deadline_index_rows(list(changed_rows.values()))
+
+"""Nạp lại toàn bộ `data_store` từ cache trên đĩa (khi worker khác đã ghi snapshot mới)."""
+def _reload_from_store():
+    _journal_state.update({'generation': None, 'count': 0, 'offset': 0})
+    _sync_state['snapshot'] = _file_signature(CACHE_FILE)
+    load_cache()
+
+"""Áp dụng phần nhật ký worker khác mới ghi (snapshot đổi -> nạp lại toàn bộ); gọi khi đang giữ `_store_lock`."""
+def _sync_journal_locked():
+    journal = _file_signature(CACHE_JOURNAL_FILE)
+    size = journal[1] if journal else 0
+    if size == _journal_state['offset'] and _file_signature(CACHE_FILE) == _sync_state['snapshot']:
+        return False
+    if _file_signature(CACHE_FILE) != _sync_state['snapshot'] or size < _journal_state['offset'] or not _journal_state['offset']:
+        _reload_from_store()
+        return True
+    with open(CACHE_JOURNAL_FILE, 'rb') as f:
+        f.seek(_journal_state['offset'])
+        tail = f.read()
+    records = []
+    for line in tail.splitlines(keepends=True):
+        # Dòng cuối đang được worker khác ghi dở -> để lần sau
+        if not line.endswith(b'\n'):
+            break
+        try:
+            records.append(json.loads(line))
+        except Exception:
+            break
+        _journal_state['offset'] += len(line)
+    _journal_state['count'] += len(records)
+    _apply_live_records(records)
+    return bool(records)
+
+"""Chế độ nhiều worker: áp dụng thay đổi do worker khác ghi vào cache; trả về True nếu có thay đổi.
+
+Kiểm tra nhanh (chỉ stat file / một PRAGMA) trước khi lấy khoá ghi nên gọi được ở mỗi request;
+chỉ khi có thay đổi mới giữ khoá ghi mọi sheet để áp dụng.
+"""
+def sync_from_store():
+    if not MULTI_WORKER:
+        return False
+    if STORAGE_BACKEND == 'sqlite':
+        if _sqlite_store.data_version() == _sync_state['sqlite_version']:
+            return False
+        with write_sheets(), _store_lock():
+            version = _sqlite_store.data_version()
+            if version == _sync_state['sqlite_version']:
+                return False
+            _apply_loaded(_sqlite_store.load_all())
+            _sync_state['sqlite_version'] = version
+            return True
+    journal = _file_signature(CACHE_JOURNAL_FILE)
+    if (journal[1] if journal else 0) == _journal_state['offset'] and _file_signature(CACHE_FILE) == _sync_state['snapshot']:
+        return False
+    with write_sheets(), _store_lock():
+        return _sync_journal_locked()
+
+"""Backend SQLite (tuỳ chọn, `STORAGE_BACKEND=sqlite`): mỗi sheet là một bảng trong `cache/data_store.sqlite`.
+
+- Bảng `sizing`, `cap_phat`, `chi_tiet`, `cloud`: khoá chính `row_id`, cột `pos` giữ thứ tự hàng, mỗi cột
+  của sheet là một cột cùng tên (không ép kiểu, giá trị giữ nguyên như trong `data_store`)
+- Chỉ mục trên `pos` và `SQLITE_INDEXED_COLUMNS` (đầu mối, "Mã SR", "Dự án", các cột ngày dùng cho cảnh báo/tổng hợp)
+- Sửa ô / thêm / xoá hàng / đổi lược đồ: mỗi lần `persist_changes` là một giao dịch chỉ chạm đúng các hàng liên quan.
+  Giao dịch lỗi được thử lại `SQLITE_APPLY_RETRIES` lần (khi file đang bị worker khác khoá); vẫn lỗi thì các sheet
+  liên quan được nạp lại từ SQLite và request trả 503, không bao giờ chuyển sang ghi lại toàn bộ
+- `save_all` (ghi lại toàn bộ) chỉ dùng cho import thay toàn bộ dữ liệu (import `replace`, chuyển từ cache JSON,
+  `sqlite-import`): xoá rồi chèn lại hàng trong một giao dịch, giữ nguyên bảng/chỉ mục
+- Lần đầu bật khi chưa có file SQLite: dữ liệu từ cache JSON (snapshot + nhật ký) được chuyển sang tự động
+Chuyển đổi thủ công: `flask --app app sqlite-import [file.json]` / `flask --app app sqlite-export [file.json]`.
+Khi khởi động dữ liệu vẫn được nạp lên `data_store` để render/tính toán như trước.
+"""
+SQLITE_TABLES = {'Sizing': 'sizing', 'CapPhat': 'cap_phat', 'ChiTiet': 'chi_tiet', 'Cloud': 'cloud'}
+SQLITE_APPLY_RETRIES = max(0, int(os.environ.get('SQLITE_APPLY_RETRIES', '3') or 0))
+SQLITE_INDEXED_COLUMNS = [
+    'Đầu mối xử lý', 'Đầu mối P.HT', 'Mã SR', 'Dự án',
+    'Thời điểm đẩy yêu cầu', 'Thời gian hoàn thành theo KPI', 'Thời gian tiếp nhận y/c',
+]
+
+_sqlite_store = SqliteStore(SQLITE_FILE, SQLITE_TABLES, SQLITE_INDEXED_COLUMNS, DEFAULT_SHEET_COLUMNS)
+
+def _sqlite_payload():
+    return {name: (_sheet_columns(name), _rows_as_records(rows)) for name, rows in data_store.items()}
+
+"""Ghi JSON an toàn: ghi ra file tạm cùng thư mục rồi `os.replace` (người đọc không bao giờ thấy file ghi dở)."""
+def _write_json_atomic(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = path + '.tmp'
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False, indent=2)
+    os.replace(tmp, path)
+
+class JsonFileCache:
+    """Mapping JSON nhỏ trên đĩa (cấu hình/trạng thái) được giữ trong bộ nhớ.
+
+    `get()` chỉ đọc lại file khi (mtime, size) thay đổi, nên sửa tay file vẫn có hiệu lực ngay
+    mà không phải parse lại mỗi lần dùng. Giá trị trả về dùng chung, không sửa trực tiếp: ghi qua
+    `save()`/`update()` (ghi atomic rồi cập nhật bản trong bộ nhớ).
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.RLock()
+        self._sig = None
+        self._data = {}
+
+    def _stat(self):
+        try:
+            st = os.stat(self.path)
+            return (st.st_mtime_ns, st.st_size)
+        except OSError:
+            return None
+
+    def get(self):
+        with self._lock:
+            sig = self._stat()
+            if sig != self._sig:
+                data = {}
+                if sig is not None:
+                    try:
+                        with open(self.path, 'r', encoding='utf-8') as f:
+                            data = json.load(f)
+                    except Exception:
+                        data = {}
+                self._data = data if isinstance(data, dict) else {}
+                self._sig = sig
+            return self._data
+
+    def save(self, data):
+        with self._lock:
+            _write_json_atomic(self.path, data)
+            self._data, self._sig = data, self._stat()
+
+    def update(self, changes):
+        with self._lock:
+            data = dict(self.get())
+            data.update(changes)
+            self.save(data)
+
+_phone_recipients_cache = JsonFileCache(PHONE_RECIPIENTS_FILE)
+_sr_created_cache = JsonFileCache(CAP_PHAT_SR_CREATED_FILE)
+
+def _load_sr_created_map():
+    return _sr_created_cache.get()
 
 def _save_sr_created_map(mapping: dict):
     try:
-        with open(CAP_PHAT_SR_CREATED_FILE, 'w', encoding='utf-8') as f:
-            json.dump(mapping, f, ensure_ascii=False, indent=2)
+        _sr_created_cache.save(dict(mapping))
     except Exception:
         pass
 
-"""Đọc cache JSON nếu có và hợp nhất vào `data_store`."""
+"""Đọc cache JSON (snapshot + phát lại nhật ký nếu là file cache chính); None nếu không có file."""
+def _read_json_cache(path=CACHE_FILE):
+    if not os.path.exists(path):
+        return None
+    with open(path, 'r', encoding='utf-8') as f:
+        loaded = json.load(f)
+    if path == CACHE_FILE:
+        generation = (loaded.get('_meta') or {}).get('generation')
+        replayed = _replay_journal(loaded, generation)
+        if replayed is not None:
+            _journal_state['generation'] = generation
+            _journal_state['count'] = replayed
+    return loaded
+
+"""Nạp dữ liệu đã đọc (dict sheet -> list dict, lược đồ cột trong `_meta.schemas`) vào `data_store`."""
+def _apply_loaded(loaded):
+    _load_schemas((loaded.get('_meta') or {}).get('schemas'), [name for name in loaded if name in DEFAULT_SHEET_COLUMNS])
+    if 'Sizing' in loaded:
+        _set_sheet_rows('Sizing', sanitize_rows(loaded['Sizing'], _sheet_columns('Sizing')))
+        ensure_stt(data_store['Sizing'])
+        _refresh_sizing_progress()
+    if 'CapPhat' in loaded:
+        _set_sheet_rows('CapPhat', sanitize_rows(loaded['CapPhat'], _sheet_columns('CapPhat')))
+        ensure_stt(data_store['CapPhat'])
+    if 'ChiTiet' in loaded:
+        _set_sheet_rows('ChiTiet', sanitize_rows(loaded['ChiTiet'], _sheet_columns('ChiTiet')))
+        # Sửa các ô số nếu từng bị lưu dạng ngày (01/01/1970, ...)
+        _fix_chitiet_numeric_rows(data_store['ChiTiet'])
+        ensure_stt(data_store['ChiTiet'])
+    if 'Cloud' in loaded:
+        _set_sheet_rows('Cloud', sanitize_rows(loaded['Cloud'], _sheet_columns('Cloud')))
+        ensure_stt(data_store['Cloud'])
+        ensure_cloud_min_rows()
+    meta = loaded.get('_meta') or {}
+    _restore_versions(meta.get('versions'), [name for name in loaded if name in DEFAULT_SHEET_COLUMNS],
+                      (meta.get('generation') or '')[:8] or None)
+
+"""Đọc dữ liệu đã lưu từ backend đang dùng và hợp nhất vào `data_store`.
+
+Với backend SQLite chưa có dữ liệu, cache JSON (nếu có) được nạp rồi ghi sang SQLite; không có thì ghi dữ liệu khởi tạo.
+"""
 def load_cache():
-    if os.path.exists(CACHE_FILE):
+    try:
+        if STORAGE_BACKEND == 'sqlite':
+            _version_state['store'] = _sqlite_store.version_store() or _version_state['store']
+        if STORAGE_BACKEND == 'sqlite' and _sqlite_store.exists():
+            _sync_state['sqlite_version'] = _sqlite_store.data_version()
+            _apply_loaded(_sqlite_store.load_all())
+            return
+        _sync_state['snapshot'] = _file_signature(CACHE_FILE)
+        loaded = _read_json_cache()
+        if loaded is not None:
+            _apply_loaded(loaded)
+        if STORAGE_BACKEND == 'sqlite':
+            # Chuyển cache JSON sang SQLite, hoặc khởi tạo bảng cho kho mới (bản ghi sau đó chỉ ghi từng hàng)
+            save_cache()
+    except Exception:
+        pass
+
+load_cache()
+# Dựng lịch ngày làm việc ngay khi khởi động (cảnh báo sớm nếu thiếu ngày lễ âm lịch của năm nay)
+_business_calendar()
+
+"""Nhiều worker: trước mỗi request, áp dụng thay đổi do worker khác ghi (bỏ qua file tĩnh)."""
+@app.before_request
+def _sync_before_request():
+    if MULTI_WORKER and request.endpoint != 'static':
         try:
-            with open(CACHE_FILE, 'r', encoding='utf-8') as f:
-                loaded = json.load(f)
-            if 'Sizing' in loaded:
-                data_store['Sizing'] = sanitize_rows(loaded['Sizing'], SIZING_COLUMNS)
-                ensure_stt(data_store['Sizing'])
-                for row in data_store['Sizing']:
-                    _update_progress_for_row(row)
-            if 'CapPhat' in loaded:
-                data_store['CapPhat'] = sanitize_rows(loaded['CapPhat'], CAP_PHAT_COLUMNS)
-                ensure_stt(data_store['CapPhat'])
-            if 'ChiTiet' in loaded:
-                data_store['ChiTiet'] = sanitize_rows(loaded['ChiTiet'], CHI_TIET_COLUMNS)
-                # Sửa các ô số nếu từng bị lưu dạng ngày (01/01/1970, ...)
-                _fix_chitiet_numeric_rows(data_store['ChiTiet'])
-                ensure_stt(data_store['ChiTiet'])
-            if 'Cloud' in loaded:
-                data_store['Cloud'] = sanitize_rows(loaded['Cloud'], CLOUD_COLUMNS)
-                ensure_stt(data_store['Cloud'])
-                ensure_cloud_min_rows()
+            sync_from_store()
         except Exception:
             pass
 
-load_cache()
+"""Nén response HTML/JSON (gzip, hoặc brotli nếu đã cài `brotli` và trình duyệt hỗ trợ).
 
-"""Trang chính: render giao diện với 3 bảng dữ liệu."""
+Bảng HTML lặp lại rất nhiều thuộc tính giống nhau trên mỗi ô nên nén giảm kích thước nhiều lần.
+Bỏ qua response nhỏ hơn `COMPRESS_MIN_SIZE` byte, file gửi trực tiếp (export, file tĩnh) và response stream.
+Tắt bằng `RESPONSE_COMPRESSION=0`. ETag của bản nén được thêm hậu tố `-gzip`/`-br`.
+"""
+RESPONSE_COMPRESSION = os.environ.get('RESPONSE_COMPRESSION', '1').strip().lower() not in ('0', 'false', 'no', 'off')
+COMPRESS_MIN_SIZE = int(os.environ.get('COMPRESS_MIN_SIZE', '1024') or 1024)
+COMPRESS_LEVEL = min(9, max(1, int(os.environ.get('COMPRESS_LEVEL', '6') or 6)))
+BROTLI_QUALITY = min(11, max(0, int(os.environ.get('BROTLI_QUALITY', '5') or 5)))
+_COMPRESSIBLE_TYPES = ('text/html', 'application/json', 'text/css', 'text/javascript', 'application/javascript')
+_ETAG_ENCODINGS = ('', '-gzip', '-br')
+
+@app.after_request
+def _compress_response(response):
+    if not RESPONSE_COMPRESSION or response.mimetype not in _COMPRESSIBLE_TYPES:
+        return response
+    response.vary.add('Accept-Encoding')
+    encoding = request.accept_encodings.best_match(['br', 'gzip'] if brotli else ['gzip'])
+    if not encoding or response.direct_passthrough or response.is_streamed or 'Content-Encoding' in response.headers:
+        return response
+    etag, weak = response.get_etag()
+    if response.status_code == 304:
+        # 304 trả lại đúng ETag của bản nén mà client đang giữ
+        if etag:
+            response.set_etag(f'{etag}-{encoding}', weak)
+        return response
+    data = response.get_data()
+    if response.status_code != 200 or len(data) < COMPRESS_MIN_SIZE:
+        return response
+    if encoding == 'br':
+        response.set_data(brotli.compress(data, quality=BROTLI_QUALITY))
+    else:
+        response.set_data(gzip.compress(data, compresslevel=COMPRESS_LEVEL))
+    response.headers['Content-Encoding'] = encoding
+    if etag:
+        response.set_etag(f'{etag}-{encoding}', weak)
+    return response
+
+"""ETag mạnh cho trang/partial dựng từ các sheet `names` (mặc định mọi sheet).
+
+Gồm epoch tiến trình, ngày hiện tại ('Tiến độ' và lịch ngày lễ đổi theo ngày), dấu cấu hình ngày lễ
+(sửa `PUBLIC_HOLIDAYS`/`holidays.json` đổi 'Tiến độ' dù dữ liệu không đổi) và phiên bản dữ liệu của từng sheet;
+phải gọi trong khoá đọc của các sheet đó để khớp với nội dung được render.
+"""
+def sheets_etag(*names):
+    versions = '.'.join(str(_sheet_data_versions.get(name, 0)) for name in names or SHEET_NAMES)
+    holidays = zlib.crc32(repr(_business_calendar().signature).encode('utf-8'))
+    return f'{_DATA_VERSION_EPOCH}-{date.today().toordinal()}-{holidays:08x}-{versions}'
+
+"""Client đã có bản ứng với `etag` (header If-None-Match, chấp nhận cả ETag của bản nén)."""
+def _etag_matches(etag):
+    return any(request.if_none_match.contains(etag + suffix) for suffix in _ETAG_ENCODINGS)
+
+"""Gắn ETag cho response; `no-cache` để trình duyệt luôn hỏi lại server (nhận 304 nếu không đổi)."""
+def _etag_response(body, etag):
+    response = make_response(body)
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+"""Trang chính: render giao diện với 3 bảng dữ liệu (304 nếu dữ liệu không đổi so với bản client đang giữ)."""
 @app.route('/')
 def index():
-    _refresh_sizing_progress()
-    # Tính bảng tổng hợp Sizing theo quý/năm và Owner
-    def _quarter_of(dt: pd.Timestamp) -> int:
-        m = int(dt.month)
-        return 1 if m<=3 else (2 if m<=6 else (3 if m<=9 else 4))
-    allowed_owners = ["khanhnd23","ductn8","vinhtq18","thongnv31","tuanha3"]
-    owners = []
-    year_set = set()
-    counts = {}
-    reject_counts = {}
-    for r in data_store.get('Sizing', []):
-        owner = str(r.get('Đầu mối xử lý','')).strip() or ''
-        if owner and owner in allowed_owners:
-            if owner not in owners:
-                owners.append(owner)
-        # đếm trạng thái Từ chối
-        status = str(r.get('Trạng thái','')).strip().lower()
-        if owner and owner in allowed_owners:
-            reject_counts[owner] = reject_counts.get(owner, 0) + (1 if status == 'từ chối' else 0)
-        # quý/năm từ Thời điểm đẩy yêu cầu
-        dt = _parse_date(r.get('Thời điểm đẩy yêu cầu',''))
-        if dt:
-            y = int(pd.Timestamp(dt).year)
-            # Bỏ qua các năm không hợp lệ (ví dụ: 1970 do lỗi parse Excel)
-            if y < 2000 or y > 2100:
-                continue
-            q = _quarter_of(pd.Timestamp(dt))
-            year_set.add(y)
-            key = (owner, y, q)
-            if owner in allowed_owners:
-                counts[key] = counts.get(key, 0) + 1
-    years = sorted(list(year_set))
-    # Chuẩn hoá dữ liệu cho template
-    sizing_summary_rows = []
-    # Cố định thứ tự theo allowed_owners
-    owners = [o for o in allowed_owners if o in owners]
-    for owner in owners:
-        row = {'owner': owner, 'quarters': {}, 'owner_false': reject_counts.get(owner, 0)}
-        for y in years:
-            row['quarters'][y] = {
-                1: counts.get((owner, y, 1), 0),
-                2: counts.get((owner, y, 2), 0),
-                3: counts.get((owner, y, 3), 0),
-                4: counts.get((owner, y, 4), 0)
-            }
-        sizing_summary_rows.append(row)
-    # Hàng tổng
-    total_row = {'owner': 'Tổng', 'quarters': {}, 'owner_false': sum(reject_counts.values())}
-    for y in years:
-        total_row['quarters'][y] = {
-            1: sum(counts.get((o, y, 1), 0) for o in owners),
-            2: sum(counts.get((o, y, 2), 0) for o in owners),
-            3: sum(counts.get((o, y, 3), 0) for o in owners),
-            4: sum(counts.get((o, y, 4), 0) for o in owners)
-        }
-    sizing_summary_rows.append(total_row)
-    # Tính tổng hợp Chi tiết theo 'Nhóm tài nguyên'
-    CHI_TIET_SUM_COLS = [
-        'vCPU','Cint','RAM(GB)','SAN(GB)','NAS(GB)','Ceph(GB)','Bigdata(GB)','Archiving(GB)','S3 Object(GB)'
-    ]
-    chitiet_group_totals = {}
-    for r in data_store.get('ChiTiet', []):
-        group = str(r.get('Nhóm tài nguyên','')).strip() or ''
-        if not group:
-            continue
-        if group not in chitiet_group_totals:
-            chitiet_group_totals[group] = {c: 0 for c in CHI_TIET_SUM_COLS}
-        for c in CHI_TIET_SUM_COLS:
-            try:
-                val = r.get(c, '')
-                num = pd.to_numeric(val, errors='coerce')
-                if not pd.isna(num):
-                    chitiet_group_totals[group][c] += float(num)
-            except Exception:
-                pass
-    # Hàng tổng cộng
-    chitiet_total_row = {c: 0 for c in CHI_TIET_SUM_COLS}
-    for grp, sums in chitiet_group_totals.items():
-        for c in CHI_TIET_SUM_COLS:
-            chitiet_total_row[c] += sums.get(c, 0)
-    return render_template(
-        'index.html',
-        sizing_columns=SIZING_COLUMNS,
-        cap_phat_columns=CAP_PHAT_COLUMNS,
-        chi_tiet_columns=CHI_TIET_COLUMNS,
-        cloud_columns=CLOUD_COLUMNS,
-        sizing_rows=data_store['Sizing'],
-        cap_phat_rows=data_store['CapPhat'],
-        chi_tiet_rows=data_store['ChiTiet'],
-        cloud_rows=data_store['Cloud'],
-        sizing_summary_years=years,
-        sizing_summary_rows=sizing_summary_rows,
-        chitiet_group_totals=chitiet_group_totals,
-        chitiet_sum_cols=CHI_TIET_SUM_COLS,
-        chitiet_total_row=chitiet_total_row
-    )
+    with read_sheets():
+        etag = sheets_etag()
+        if _etag_matches(etag):
+            return _etag_response(('', 304), etag)
+    # Chỉ cửa sổ hàng đầu của Sizing được render ở trang chính, phần còn lại tải qua `/sheet/Sizing`
+    _refresh_sizing_window(0, SHEET_PAGE_SIZE)
+    with read_sheets():
+        etag = sheets_etag()
+        return _etag_response(render_template(
+            'index.html',
+            sizing_columns=_sheet_columns('Sizing'),
+            cap_phat_columns=_sheet_columns('CapPhat'),
+            chi_tiet_columns=_sheet_columns('ChiTiet'),
+            cloud_columns=_sheet_columns('Cloud'),
+            sizing_rows=data_store['Sizing'],
+            cap_phat_rows=data_store['CapPhat'],
+            chi_tiet_rows=data_store['ChiTiet'],
+            cloud_rows=data_store['Cloud'],
+            **dashboard_summary()
+        ), etag)
+
+"""Số liệu tổng hợp dashboard dạng JSON (Sizing theo Owner/năm/quý, Chi tiết theo nhóm tài nguyên)."""
+@app.route('/dashboard-summary')
+def dashboard_summary_json():
+    with read_sheets('Sizing', 'ChiTiet'):
+        etag = sheets_etag('Sizing', 'ChiTiet')
+        if _etag_matches(etag):
+            return _etag_response(('', 304), etag)
+        summary = dashboard_summary()
+    return _etag_response(jsonify({
+        'sizing': {
+            'years': summary['sizing_summary_years'],
+            'rows': [
+                {'owner': r['owner'], 'owner_false': r['owner_false'],
+                 'quarters': {str(y): {f'Q{q}': n for q, n in qs.items()} for y, qs in r['quarters'].items()}}
+                for r in summary['sizing_summary_rows']
+            ],
+        },
+        'chi_tiet': {
+            'columns': summary['chitiet_sum_cols'],
+            'groups': summary['chitiet_group_totals'],
+            'total': summary['chitiet_total_row'],
+        },
+    }), etag)
 
 """Chuẩn hoá hiển thị ngày về định dạng dd/mm/YYYY (hoặc rỗng)."""
 def _format_date(val) -> str:
@@ -721,219 +2540,710 @@ def _format_date(val) -> str:
     if isinstance(val, (datetime, pd.Timestamp)):
         return val.strftime("%d/%m/%Y")
 
-    try:
-        dt = pd.to_datetime(str(val), dayfirst=True, errors="coerce")
-        if pd.isna(dt):
-            return ""
-        return dt.strftime("%d/%m/%Y")
-    except Exception:
+    dt = parse_date_value(str(val))
+    return dt.strftime("%d/%m/%Y") if dt is not None else ""
+
+"""Nhận diện cột ngày theo TÊN CỘT (keyword) để tránh việc các cột số
+(ví dụ trong sheet 'Chi tiết': 'Số lượng máy chủ', 'S3 Object(GB)', ...) bị hiểu nhầm thành ngày tháng.
+"""
+DATE_KEYWORDS = ["Thời", "Timeline", "Qúy"]
+
+def _is_date_col_by_name(name: str) -> bool:
+    n = (name or "").lower()
+    return any(kw.lower() in n for kw in DATE_KEYWORDS)
+
+def _format_date_cell(v):
+    if v is None or (isinstance(v, float) and pd.isna(v)):
         return ""
+    dt = parse_date_value(v)
+    return dt.strftime('%d/%m/%Y') if dt is not None else str(v).strip()
 
 """Đảm bảo DataFrame có đủ cột, làm sạch và format ngày theo mẫu.
 
 Chú ý: Chỉ định dạng ngày theo TÊN CỘT (keyword) để tránh việc
 các cột số (ví dụ trong sheet 'Chi tiết': 'Số lượng máy chủ', 'S3 Object(GB)', ...)
-bị hiểu nhầm thành ngày tháng.
+bị hiểu nhầm thành ngày tháng. Mọi cột được xử lý theo cả mảng (vectorized),
+các phép parse đắt chỉ chạy trên tập giá trị duy nhất.
 """
-def _read_sheet(df: pd.DataFrame, expected_cols):
+def _read_sheet(df: pd.DataFrame, expected_cols, sheet_name=None):
     for col in expected_cols:
         if col not in df.columns:
             df[col] = ""
 
     df = df[expected_cols].fillna("").replace({pd.NaT: ""})
 
-    # Chỉ nhận diện cột ngày theo tên cột để tránh nhầm lẫn
-    DATE_KEYWORDS = ["Thời", "Timeline", "Qúy"]
-    def is_date_col_by_name(name: str) -> bool:
-        n = (name or "").lower()
-        return any(kw.lower() in n for kw in DATE_KEYWORDS)
-
-    # Helper làm sạch chuỗi và chuẩn hoá giá trị theo cột
-    def _normalize_cell(col_name: str, value: str) -> str:
-        s = str(value)
-        s = s.strip()
-        if not s:
-            return ""
-        # Chuẩn hoá owner ductn -> ductn8 cho sheet Sizing
-        if col_name == 'Đầu mối xử lý' and s.lower() == 'ductn':
-            return 'ductn8'
-        return s
-
     processed = {}
     for col in df.columns:
         series = df[col]
-        if is_date_col_by_name(col):
-            def fmt(v):
-                if v is None or (isinstance(v, float) and pd.isna(v)):
-                    return ""
-                try:
-                    dt = pd.to_datetime(v, dayfirst=True, errors='coerce')
-                    if pd.isna(dt):
-                        return str(v).strip()
-                    return dt.strftime('%d/%m/%Y')
-                except Exception:
-                    return str(v).strip()
-            processed[col] = series.apply(fmt)
+        if _is_date_col_by_name(column_name(sheet_name, col) if sheet_name else col):
+            if pd.api.types.is_datetime64_any_dtype(series):
+                processed[col] = series.dt.strftime('%d/%m/%Y').fillna('').astype(object)
+            else:
+                processed[col] = _map_distinct(series, _format_date_cell)
         elif col in CHI_TIET_NUMERIC_COLS:
             # Ép về dạng số và xuất chuỗi số; tránh bị hiểu thành ngày
-            processed[col] = series.apply(_clean_numeric_string)
+            processed[col] = _map_distinct(series, _clean_numeric_string)
         else:
             # Không cố parse ngày ở các cột còn lại; giữ nguyên như chuỗi sạch và chuẩn hoá cần thiết.
-            processed[col] = series.astype(str).apply(
-                lambda x: '' if str(x).strip().lower() in ['nan','nat'] else _normalize_cell(col, x)
-            )
+            stripped = series.astype(str).str.strip()
+            lowered = stripped.str.lower()
+            cleaned = stripped.mask(lowered.isin(['nan', 'nat']), '')
+            # Chuẩn hoá owner ductn -> ductn8 cho sheet Sizing
+            if col == 'Đầu mối xử lý':
+                cleaned = cleaned.mask(lowered == 'ductn', 'ductn8')
+            processed[col] = cleaned.astype(object)
+
+    return pd.DataFrame(processed, index=df.index)[expected_cols]
+
+"""Chuyển DataFrame đã qua `_read_sheet` thành list dict hàng.
 
-    return pd.DataFrame(processed)[expected_cols]
+Tương đương `sanitize_rows(df.to_dict(orient='records'), columns)` nhưng kiểm tra
+'nan'/'nat' trên tập giá trị duy nhất của từng cột thay vì từng ô; mỗi hàng nhận một `row_id` mới.
+"""
+def _frame_to_rows(df: pd.DataFrame, columns):
+    values = []
+    for c in columns:
+        if c not in df.columns:
+            values.append([''] * len(df))
+            continue
+        arr = df[c].to_numpy(dtype=object)
+        codes, uniques = pd.factorize(arr, use_na_sentinel=False)
+        bad = [i for i, u in enumerate(uniques) if str(u).strip().lower() in ('nan', 'nat')]
+        if bad:
+            arr = arr.copy()
+            arr[np.isin(codes, bad)] = ''
+        values.append(arr.tolist())
+    keys = list(columns) + ['row_id']
+    row_ids = [str(uuid.uuid4()) for _ in range(len(df))]
+    return [dict(zip(keys, vals)) for vals in zip(*values, row_ids)]
+
+"""Đổi header Excel (tên hiển thị) sang id cột theo lược đồ của sheet; cột không có trong lược đồ bị bỏ."""
+def _frame_by_column_id(df: pd.DataFrame, sheet_name):
+    schema = _schemas[sheet_name]
+    known = [c for c in df.columns if schema.id_for(c) is not None]
+    return df[known].rename(columns=schema.id_for)
+
+"""Ánh xạ tên sheet nội bộ -> tên sheet trong file Excel."""
+EXCEL_SHEET_NAMES = {
+    'Sizing': 'Sizing',
+    'CapPhat': 'Cấp phát TN',
+    'ChiTiet': 'Chi tiết',
+    'Cloud': 'Tài nguyên Cloud',
+}
+
+# File lớn hơn ngưỡng này (MB) sẽ import theo kiểu streaming; có thể ép bằng form field `stream=1`
+IMPORT_STREAM_THRESHOLD_MB = int(os.environ.get('IMPORT_STREAM_THRESHOLD_MB', '20') or 20)
+# Số hàng tối đa mỗi khối khi import streaming
+IMPORT_CHUNK_ROWS = int(os.environ.get('IMPORT_CHUNK_ROWS', '5000') or 5000)
+
+# Các chuỗi được pandas.read_excel coi là NaN theo mặc định (giữ hành vi giống khi import streaming)
+_EXCEL_NA_STRINGS = {
+    '', '#N/A', '#N/A N/A', '#NA', '-1.#IND', '-1.#QNAN', '-NaN', '-nan', '1.#IND', '1.#QNAN',
+    '<NA>', 'N/A', 'NA', 'NULL', 'NaN', 'None', 'n/a', 'nan', 'null',
+}
+
+"""Đọc workbook bằng pandas (toàn bộ từng sheet), xử lý lần lượt để giải phóng DataFrame sớm."""
+def _read_workbook_pandas(path):
+    result = {}
+    with pd.ExcelFile(path) as xl:
+        for name, excel_name in EXCEL_SHEET_NAMES.items():
+            columns = get_sheet_info(name)[1]
+            df = pd.read_excel(xl, sheet_name=excel_name) if excel_name in xl.sheet_names else pd.DataFrame(columns=columns)
+            result[name] = _frame_to_rows(_read_sheet(_frame_by_column_id(df, name), columns, name), columns)
+            del df
+    return result
+
+def _excel_cell_value(v):
+    # Giống pandas: số thực nguyên -> int, chuỗi NaN mặc định -> None
+    if isinstance(v, float) and v.is_integer():
+        return int(v)
+    if isinstance(v, str) and v in _EXCEL_NA_STRINGS:
+        return None
+    return v
 
-"""Import file Excel: đọc 3 sheet, chuẩn hoá và cập nhật `data_store`."""
+"""Đọc hàng của worksheet (read-only) và trả về từng khối DataFrame tối đa `chunk_rows` hàng.
+
+Hàng trống ở cuối sheet bị bỏ như `pandas.read_excel`; tên cột trùng được đánh hậu tố `.1`, `.2`.
+"""
+def _iter_sheet_chunks(ws, chunk_rows):
+    rows_iter = ws.iter_rows(values_only=True)
+    header = next(rows_iter, None)
+    if header is None:
+        return
+    names = []
+    seen = {}
+    for i, h in enumerate(header):
+        name = f"Unnamed: {i}" if h is None else str(h)
+        if name in seen:
+            seen[name] += 1
+            name = f"{name}.{seen[name]}"
+        else:
+            seen[name] = 0
+        names.append(name)
+    width = len(names)
+    blank_row = (None,) * width
+    buf = []
+    pending_blank = 0
+    for values in rows_iter:
+        values = tuple(_excel_cell_value(v) for v in values[:width])
+        if len(values) < width:
+            values = values + (None,) * (width - len(values))
+        if values == blank_row:
+            # Chỉ giữ hàng trống nếu phía sau còn dữ liệu
+            pending_blank += 1
+            continue
+        if pending_blank:
+            buf.extend([blank_row] * pending_blank)
+            pending_blank = 0
+        buf.append(values)
+        if len(buf) >= chunk_rows:
+            yield pd.DataFrame(buf, columns=names, dtype=object)
+            buf = []
+    if buf:
+        yield pd.DataFrame(buf, columns=names, dtype=object)
+
+"""Import streaming: đọc từng sheet theo hàng (openpyxl read-only), chuẩn hoá theo khối.
+
+Chỉ giữ trong bộ nhớ danh sách hàng kết quả và một khối DataFrame tại một thời điểm.
+Khác biệt nhỏ so với đọc bằng pandas: ô số nguyên trong cột văn bản giữ dạng '4'
+(pandas sẽ suy kiểu cả cột thành float và cho ra '4.0' nếu cột có ô trống).
+"""
+def _read_workbook_streaming(path, chunk_rows=None):
+    from openpyxl import load_workbook
+    chunk_rows = chunk_rows or IMPORT_CHUNK_ROWS
+    result = {}
+    wb = load_workbook(path, read_only=True, data_only=True)
+    try:
+        for name, excel_name in EXCEL_SHEET_NAMES.items():
+            columns = get_sheet_info(name)[1]
+            rows = _new_sheet_rows(columns)
+            if excel_name in wb.sheetnames:
+                ws = wb[excel_name]
+                ws.reset_dimensions()
+                for chunk in _iter_sheet_chunks(ws, chunk_rows):
+                    rows.extend(_frame_to_rows(_read_sheet(_frame_by_column_id(chunk, name), columns, name), columns))
+            result[name] = rows
+    finally:
+        wb.close()
+    return result
+
+def _use_streaming_import(path, filename):
+    if not filename.lower().endswith(('.xlsx', '.xlsm')):
+        return False
+    flag = (request.values.get('stream') or '').strip().lower()
+    if flag in ('1', 'true', 'yes'):
+        return True
+    if flag in ('0', 'false', 'no'):
+        return False
+    return os.path.getsize(path) >= IMPORT_STREAM_THRESHOLD_MB * 1024 * 1024
+
+"""Chế độ import mặc định khi form không gửi `mode`: `replace` (thay toàn bộ sheet) hoặc `merge` (gộp theo khoá)."""
+IMPORT_MODE = (os.environ.get('IMPORT_MODE', 'replace') or 'replace').strip().lower()
+
+"""Cột khoá nghiệp vụ để khớp hàng khi import `merge`, thử lần lượt theo thứ tự.
+
+Mỗi lượt chỉ xét các hàng chưa khớp ở lượt trước và có khoá khác rỗng; khoá trùng được ghép theo thứ tự xuất hiện.
+Ở lượt sau, hai hàng đã có khoá của lượt trước (ví dụ hai "Mã SR" khác nhau) không bị ghép với nhau, nên hàng
+vừa được cấp "Mã SR" trong file vẫn khớp với hàng cũ theo "Dự án". Sau các lượt theo khoá, hàng còn lại có mọi khoá
+rỗng được ghép theo thứ tự với hàng hiện có cũng rỗng mọi khoá (giữ `row_id`, không xoá rồi chèn lại).
+Sheet không có khoá (Cloud) khớp theo vị trí.
+"""
+MERGE_KEYS = {
+    'Sizing': ('Mã PYC',),
+    'CapPhat': ('Mã SR', 'Dự án'),
+    'ChiTiet': ('Mã SR', 'Dự án'),
+    'Cloud': (),
+}
+
+# Cột không so sánh khi gộp: STT đánh lại theo vị trí, Tiến độ (Sizing) tính lại từ KPI
+MERGE_IGNORED_COLS = {'Sizing': ('STT', 'Tiến độ')}
+
+def _merge_text(v):
+    return '' if v is None else str(v).strip()
+
+"""Ghép hàng trong file với hàng hiện có: trả về list (vị trí hàng hiện có hoặc None) theo thứ tự hàng trong file."""
+def _merge_match(sheet_name, existing, incoming):
+    matched = [None] * len(incoming)
+    if not MERGE_KEYS.get(sheet_name):
+        for i in range(min(len(incoming), len(existing))):
+            matched[i] = i
+        return matched
+    taken = set()
+    existing_blank = [True] * len(existing)
+    incoming_blank = [True] * len(incoming)
+    for key in MERGE_KEYS[sheet_name]:
+        if key not in _sheet_columns(sheet_name):
+            continue
+        existing_keys = [_merge_text(v) for v in sheet_column(existing, key)]
+        incoming_keys = [_merge_text(v) for v in sheet_column(incoming, key)]
+        # khoá -> (hàng chưa có khoá lượt trước, hàng đã có)
+        buckets = {}
+        for pos, k in enumerate(existing_keys):
+            if k and pos not in taken:
+                buckets.setdefault(k, (deque(), deque()))[0 if existing_blank[pos] else 1].append(pos)
+        for i, k in enumerate(incoming_keys):
+            if matched[i] is not None or not k or k not in buckets:
+                continue
+            free, bound = buckets[k]
+            if free:
+                pos = free.popleft()
+            elif bound and incoming_blank[i]:
+                pos = bound.popleft()
+            else:
+                continue
+            matched[i] = pos
+            taken.add(pos)
+        existing_blank = [b and not k for b, k in zip(existing_blank, existing_keys)]
+        incoming_blank = [b and not k for b, k in zip(incoming_blank, incoming_keys)]
+    # Hàng rỗng mọi khoá: ghép theo thứ tự xuất hiện giữa phần còn lại của hai bên
+    free = deque(pos for pos, blank in enumerate(existing_blank) if blank and pos not in taken)
+    for i, blank in enumerate(incoming_blank):
+        if not free:
+            break
+        if blank and matched[i] is None:
+            matched[i] = free.popleft()
+    return matched
+
+"""Gộp hàng đọc từ file vào sheet đang chạy, giữ `row_id` của hàng khớp khoá (`MERGE_KEYS`).
+
+- Hàng khớp: chỉ ô khác giá trị được ghi (qua `_apply_cell_edits`: phiên bản hàng, tổng hợp, mốc cảnh báo, nhật ký)
+- Hàng mới: chèn ngay sau hàng khớp đứng trước nó trong file; hàng khớp giữ thứ tự hiện tại trong sheet
+- Hàng hiện có không còn trong file: xoá, trừ khi `keep_missing`
+Trả về (các thao tác sửa ô chưa áp dụng, bản ghi nhật ký thêm/xoá hàng, tóm tắt). Gọi khi giữ khoá ghi của sheet.
+"""
+def _merge_sheet(name, incoming, keep_missing=False):
+    rows = data_store[name]
+    columns = _sheet_columns(name)
+    matched = _merge_match(name, rows, incoming)
+    taken = {pos for pos in matched if pos is not None}
+    summary = {'matched': len(taken), 'updated': 0, 'cells': 0, 'unchanged': 0,
+               'inserted': 0, 'deleted': 0, 'kept': 0}
+
+    edits = []
+    updated = set()
+    ignored = MERGE_IGNORED_COLS.get(name, ('STT',))
+    for col in columns:
+        if col in ignored:
+            continue
+        current = sheet_column(rows, col)
+        values = sheet_column(incoming, col)
+        for i, pos in enumerate(matched):
+            if pos is not None and _merge_text(current[pos]) != _merge_text(values[i]):
+                edits.append((name, rows[pos], col, values[i]))
+                updated.add(pos)
+    summary['updated'] = len(updated)
+    summary['cells'] = len(edits)
+    summary['unchanged'] = len(taken) - len(updated)
+
+    records = []
+    original_ids = sheet_column(rows, 'row_id')
+    missing = [pos for pos in range(len(rows)) if pos not in taken]
+    if keep_missing:
+        summary['kept'] = len(missing)
+    else:
+        for pos in reversed(missing):
+            _aggregate_row(name, rows[pos], -1)
+            removed = rows.pop(pos)
+            _unindex_row(name, removed)
+            _deadline_forget_row(name, removed)
+            _forget_row_version(name, removed.get('row_id'))
+            records.append({'op': 'delete', 'sheet': name, 'row_id': removed.get('row_id')})
+        summary['deleted'] = len(missing)
+
+    # Hàng mới neo sau hàng khớp gần nhất phía trước nó trong file (None -> đầu sheet)
+    new_rows = {}
+    anchor = None
+    for i, pos in enumerate(matched):
+        if pos is not None:
+            anchor = original_ids[pos]
+            continue
+        data = incoming[i]
+        row = {c: data.get(c, '') for c in columns}
+        row['row_id'] = data.get('row_id') or str(uuid.uuid4())
+        new_rows.setdefault(anchor, []).append(row)
+    if not new_rows:
+        return edits, records, summary
+    if name == 'Sizing':
+        _refresh_sizing_progress([row for group in new_rows.values() for row in group])
+
+    # Thứ tự cuối = hàng còn lại theo thứ tự hiện tại, xen các hàng mới sau hàng neo;
+    # chèn theo vị trí cuối tăng dần nên mỗi lần chèn đã đúng chỗ
+    placed = []
+    final_ids = []
+    for rid in [None] + sheet_column(rows, 'row_id'):
+        if rid is not None:
+            final_ids.append(rid)
+        for row in new_rows.get(rid, ()):
+            placed.append((len(final_ids), final_ids[-1] if final_ids else None, row))
+            final_ids.append(row['row_id'])
+    inserted = []
+    for pos, after_id, row in placed:
+        rows.insert(pos, row)
+        _index_row(name, rows[pos], pos)
+        _aggregate_row(name, rows[pos], 1)
+        inserted.append((name, rows[pos]))
+        records.append({'op': 'insert', 'sheet': name, 'after': after_id, 'row': row})
+    _deadline_index_rows(inserted)
+    summary['inserted'] = len(placed)
+    return edits, records, summary
+
+"""Gộp dữ liệu đọc từ file vào các sheet (import `merge`); sheet trống/không có trong file được giữ nguyên.
+
+Chỉ ô thay đổi và hàng thêm/xoá được ghi vào nhật ký (hoặc SQLite), không ghi lại snapshot toàn bộ.
+Trả về tóm tắt theo sheet. Gọi khi giữ khoá ghi mọi sheet.
+"""
+def _merge_import(imported, keep_missing=False):
+    edits = []
+    records = []
+    summary = {}
+    for name, rows in imported.items():
+        if not len(rows):
+            continue
+        sheet_edits, sheet_records, summary[name] = _merge_sheet(name, rows, keep_missing)
+        edits.extend(sheet_edits)
+        records.extend(sheet_records)
+        if sheet_records:
+            ensure_stt(data_store[name])
+    if records:
+        persist_changes(*records)
+    if edits:
+        _apply_cell_edits(edits)
+    return summary
+
+"""Import file Excel: đọc 4 sheet, chuẩn hoá và cập nhật `data_store`.
+
+Form field `mode` (mặc định `IMPORT_MODE`): `replace` thay toàn bộ sheet bằng dữ liệu trong file;
+`merge` gộp theo khoá nghiệp vụ (`_merge_import`), thêm `keep_missing=1` để giữ hàng không có trong file.
+Ở chế độ `merge`, tóm tắt thay đổi theo sheet được gửi trong header `HX-Trigger` (sự kiện `importMerged`).
+"""
 @app.route('/import', methods=['POST'])
 def import_excel():
     file = request.files.get('excel_file')
     if not file:
         return jsonify({'error': 'No file provided'}), 400
+    mode = (request.values.get('mode') or IMPORT_MODE).strip().lower()
+    if mode not in ('replace', 'merge'):
+        return jsonify({'error': 'Invalid import mode'}), 400
+    keep_missing = (request.values.get('keep_missing') or '').strip().lower() in ('1', 'true', 'yes', 'on')
 
     filename = secure_filename(file.filename)
     path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
     file.save(path)
 
     try:
-        xl = pd.ExcelFile(path)
-        sizing_df = pd.read_excel(xl, sheet_name='Sizing') if 'Sizing' in xl.sheet_names else pd.DataFrame(columns=SIZING_COLUMNS)
-        cap_phat_df = pd.read_excel(xl, sheet_name='Cấp phát TN') if 'Cấp phát TN' in xl.sheet_names else pd.DataFrame(columns=CAP_PHAT_COLUMNS)
-        chi_tiet_df = pd.read_excel(xl, sheet_name='Chi tiết') if 'Chi tiết' in xl.sheet_names else pd.DataFrame(columns=CHI_TIET_COLUMNS)
-        cloud_df = pd.read_excel(xl, sheet_name='Tài nguyên Cloud') if 'Tài nguyên Cloud' in xl.sheet_names else pd.DataFrame(columns=CLOUD_COLUMNS)
-
-        sizing_df = _read_sheet(sizing_df, SIZING_COLUMNS)
-        cap_phat_df = _read_sheet(cap_phat_df, CAP_PHAT_COLUMNS)
-        chi_tiet_df = _read_sheet(chi_tiet_df, CHI_TIET_COLUMNS)
-        cloud_df = _read_sheet(cloud_df, CLOUD_COLUMNS)
-
-        data_store['Sizing'] = sanitize_rows(sizing_df.to_dict(orient='records'), SIZING_COLUMNS)
-        data_store['CapPhat'] = sanitize_rows(cap_phat_df.to_dict(orient='records'), CAP_PHAT_COLUMNS)
-        data_store['ChiTiet'] = sanitize_rows(chi_tiet_df.to_dict(orient='records'), CHI_TIET_COLUMNS)
-        data_store['Cloud'] = sanitize_rows(cloud_df.to_dict(orient='records'), CLOUD_COLUMNS)
-        _fix_chitiet_numeric_rows(data_store['ChiTiet'])
+        started = time.perf_counter()
+        if _use_streaming_import(path, filename):
+            imported = _read_workbook_streaming(path)
+        else:
+            imported = _read_workbook_pandas(path)
+        imported_rows = sum(len(rows) for rows in imported.values())
+
+        # Đọc file xong mới giữ khoá ghi mọi sheet: chỉ bước thay dữ liệu + render chặn request khác
+        with write_sheets():
+            if mode == 'merge':
+                summary = _merge_import(imported, keep_missing)
+                del imported
+                ensure_cloud_min_rows()
+                elapsed = time.perf_counter() - started
+                metrics.inc('excel_import_rows_total', imported_rows)
+                metrics.set('excel_import_rows_per_second', round(imported_rows / elapsed, 1) if elapsed > 0 else 0)
+                response = make_response(_render_tables())
+                response.headers['HX-Trigger'] = json.dumps({'importMerged': summary})
+                return response
+
+            # Các cột số của Chi tiết đã được `_read_sheet` chuẩn hoá về chuỗi số nên không cần
+            # chạy lại `_fix_chitiet_numeric_rows` (chỉ dùng cho dữ liệu cache cũ).
+            for name, rows in imported.items():
+                _set_sheet_rows(name, rows)
+            del imported
+
+            _refresh_sizing_progress()
+
+            ensure_stt(data_store['Sizing'])
+            ensure_stt(data_store['CapPhat'])
+            ensure_stt(data_store['ChiTiet'])
+            ensure_stt(data_store['Cloud'])
+            ensure_cloud_min_rows()
+            save_cache()
+            elapsed = time.perf_counter() - started
+            metrics.inc('excel_import_rows_total', imported_rows)
+            metrics.set('excel_import_rows_per_second', round(imported_rows / elapsed, 1) if elapsed > 0 else 0)
+
+            return _render_tables()
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
 
-        _refresh_sizing_progress()
+"""Số hàng mỗi "cửa sổ" khi render sheet (trang đầu ở `/` và mỗi lần tải thêm khi cuộn).
 
-        ensure_stt(data_store['Sizing'])
-        ensure_stt(data_store['CapPhat'])
-        ensure_stt(data_store['ChiTiet'])
-        ensure_stt(data_store['Cloud'])
-        ensure_cloud_min_rows()
-        save_cache()
+Trang chủ chỉ render cửa sổ đầu tiên của Sizing/CapPhat/ChiTiet; phần còn lại được HTMX
+tải dần qua `/sheet/<name>/rows?offset=..&limit=..` khi người dùng cuộn tới cuối bảng.
+"""
+SHEET_PAGE_SIZE = max(1, int(os.environ.get('SHEET_PAGE_SIZE', '200') or 200))
 
-        return render_template('tables.html', sizing_columns=SIZING_COLUMNS, cap_phat_columns=CAP_PHAT_COLUMNS,
-                       chi_tiet_columns=CHI_TIET_COLUMNS, cloud_columns=CLOUD_COLUMNS,
-                       sizing_rows=data_store['Sizing'], cap_phat_rows=data_store['CapPhat'], chi_tiet_rows=data_store['ChiTiet'], cloud_rows=data_store['Cloud'])
-    except Exception as e:
-        return jsonify({'error': str(e)}), 500
+@app.context_processor
+def _inject_sheet_page_size():
+    return {'sheet_page_size': SHEET_PAGE_SIZE}
+
+@app.context_processor
+def _inject_business_holidays():
+    try:
+        return {'business_holidays': _business_calendar().holidays}
+    except Exception:
+        return {'business_holidays': []}
 
-"""Render partial cho một sheet bất kỳ (HTMX sử dụng)."""
+"""Đọc offset/limit từ query string (giới hạn limit trong [1, 5 * SHEET_PAGE_SIZE])."""
+def _window_params():
+    offset = request.args.get('offset', 0, type=int) or 0
+    limit = request.args.get('limit', SHEET_PAGE_SIZE, type=int) or SHEET_PAGE_SIZE
+    return max(0, offset), max(1, min(limit, SHEET_PAGE_SIZE * 5))
+
+"""Làm mới 'Tiến độ' cho cửa sổ hàng Sizing sắp render (thay vì quét cả sheet).
+
+Ghi vào hàng nên giữ khoá ghi Sizing trong lúc tính (vài trăm hàng, rất ngắn); route chỉ đọc gọi hàm này
+trước khi lấy khoá đọc vì không nâng được khoá đọc -> ghi.
+"""
+def _refresh_sizing_window(offset, limit):
+    with write_sheets('Sizing'):
+        _refresh_sizing_progress(data_store['Sizing'][offset:offset + limit])
+
+"""Tham số render `rows.html` cho một cửa sổ hàng [offset, offset + limit) của sheet."""
+def _window_context(name, offset, limit):
+    rows, columns, sheet_id = get_sheet_info(name)
+    window = rows[offset:offset + limit]
+    if name == 'Sizing' and _held_sheet_writes().get('Sizing'):
+        # Route ghi render lại cửa sổ: đang giữ khoá ghi nên làm mới tại chỗ (route đọc đã gọi `_refresh_sizing_window`)
+        _refresh_sizing_progress(window)
+    next_offset = offset + limit if offset + limit < len(rows) else None
+    return dict(sheet_name=name, sheet_id=sheet_id, columns=columns, rows=window,
+                offset=offset, limit=limit, next_offset=next_offset)
+
+"""Render partial cho một sheet bất kỳ (HTMX sử dụng), theo cửa sổ offset/limit."""
 @app.route('/sheet/<name>')
 def sheet(name):
     if name not in ['Sizing', 'CapPhat', 'ChiTiet', 'Cloud']:
         abort(404)
+    offset, limit = _window_params()
+    with read_sheets(name):
+        etag = sheets_etag(name)
+        if _etag_matches(etag):
+            return _etag_response(('', 304), etag)
     if name == 'Sizing':
-        columns = SIZING_COLUMNS
-        sheet_id = 'sizing-sheet'
-    elif name == 'CapPhat':
-        columns = CAP_PHAT_COLUMNS
-        sheet_id = 'cap-phat-sheet'
-    elif name == 'ChiTiet':
-        columns = CHI_TIET_COLUMNS
-        sheet_id = 'chi-tiet-sheet'
-    else:
-        columns = CLOUD_COLUMNS
-        sheet_id = 'cloud-sheet'
+        _refresh_sizing_window(offset, limit)
+    with read_sheets(name):
+        etag = sheets_etag(name)
+        return _etag_response(render_template('sheet.html', **_window_context(name, offset, limit)), etag)
+
+"""Render tiếp một cửa sổ hàng (không kèm khung bảng) cho "tải thêm khi cuộn"."""
+@app.route('/sheet/<name>/rows')
+def sheet_rows(name):
+    if name not in ['Sizing', 'CapPhat', 'ChiTiet', 'Cloud']:
+        abort(404)
+    offset, limit = _window_params()
+    with read_sheets(name):
+        etag = sheets_etag(name)
+        if _etag_matches(etag):
+            return _etag_response(('', 304), etag)
     if name == 'Sizing':
-        _refresh_sizing_progress()
-    rows = data_store[name]
-    return render_template('sheet.html', sheet_name=name, sheet_id=sheet_id, columns=columns, rows=rows)
+        _refresh_sizing_window(offset, limit)
+    with read_sheets(name):
+        etag = sheets_etag(name)
+        return _etag_response(render_template('rows.html', **_window_context(name, offset, limit)), etag)
+
+"""Thêm một hàng mới sau vị trí chỉ định trong sheet.
 
-"""Thêm một hàng mới sau vị trí chỉ định trong sheet."""
-@app.route('/add-row/<sheet>/<int:after_index>', methods=['POST'])
+Nếu request gửi kèm `row_id` (nút "+" trên từng hàng), vị trí được xác định theo `row_id`
+và chỉ trả về nhóm hàng mới để HTMX chèn ngay sau hàng đó; ngược lại render lại sheet.
+Hàng neo đã bị xoá bởi request khác -> 409. Vị trí được tra và hàng được chèn trong cùng khoá ghi của sheet.
+"""
+@app.route('/add-row/<sheet>/<int(signed=True):after_index>', methods=['POST'])
 def add_row(sheet, after_index):
     if sheet not in ['Sizing', 'CapPhat', 'ChiTiet', 'Cloud']:
         abort(404)
-    columns = SIZING_COLUMNS if sheet == 'Sizing' else (CAP_PHAT_COLUMNS if sheet == 'CapPhat' else (CHI_TIET_COLUMNS if sheet == 'ChiTiet' else CLOUD_COLUMNS))
-    new_row = {col: '' for col in columns}
-    new_row['row_id'] = str(uuid.uuid4())
-    target_list = data_store[sheet]
-    if after_index < -1 or after_index >= len(target_list):
-        target_list.append(new_row)
-    else:
-        target_list.insert(after_index + 1, new_row)
-    ensure_stt(target_list)
-    if sheet == 'Sizing':
-        _refresh_sizing_progress()
-    save_cache()
-    sheet_id = 'sizing-sheet' if sheet == 'Sizing' else ('cap-phat-sheet' if sheet == 'CapPhat' else ('chi-tiet-sheet' if sheet == 'ChiTiet' else 'cloud-sheet'))
-    return render_template('sheet.html', sheet_name=sheet, sheet_id=sheet_id, columns=columns, rows=target_list)
-
-"""Xoá một hàng theo chỉ số trong sheet."""
+    anchor_id = request.values.get('row_id')
+    with write_sheets(sheet):
+        columns = _sheet_columns(sheet)
+        if anchor_id:
+            after_index = get_row_position(sheet, anchor_id)
+            if after_index < 0:
+                raise RowConflict(sheet, anchor_id)
+        new_row = {col: '' for col in columns}
+        new_row['row_id'] = str(uuid.uuid4())
+        target_list = data_store[sheet]
+        if after_index < -1 or after_index >= len(target_list):
+            after_id = target_list[-1].get('row_id') if target_list else None
+            pos = len(target_list)
+        else:
+            after_id = target_list[after_index].get('row_id') if after_index >= 0 else None
+            pos = after_index + 1
+        target_list.insert(pos, new_row)
+        _index_row(sheet, target_list[pos], pos)
+        _aggregate_row(sheet, target_list[pos], 1)
+        _deadline_index_rows([(sheet, target_list[pos])])
+        ensure_stt(target_list)
+        persist_changes({'op': 'insert', 'sheet': sheet, 'after': after_id, 'row': new_row})
+        if anchor_id:
+            context = _window_context(sheet, pos, 1)
+            context['next_offset'] = None
+            return render_template('rows.html', **context)
+        return render_template('sheet.html', **_window_context(sheet, 0, SHEET_PAGE_SIZE))
+
+"""Xoá một hàng theo chỉ số (hoặc theo `row_id` nếu có) trong sheet.
+
+Khi xoá theo `row_id`, trả về nội dung rỗng để HTMX gỡ đúng nhóm hàng đó; nếu sheet trở nên
+trống thì render lại cả sheet (HX-Retarget) để hiện lại nút thêm dòng đầu tiên.
+Kèm `version` (phiên bản hàng client đang hiển thị): hàng đã bị sửa/xoá bởi request khác -> 409.
+"""
 @app.route('/delete-row/<sheet>/<int:row_index>', methods=['POST'])
 def delete_row(sheet, row_index):
     if sheet not in ['Sizing', 'CapPhat', 'ChiTiet', 'Cloud']:
         abort(404)
-    target_list = data_store[sheet]
-    if row_index < 0 or row_index >= len(target_list):
-        return jsonify({'error': 'Invalid row index'}), 400
-    target_list.pop(row_index)
-    if target_list:
-        ensure_stt(target_list)
-    if sheet == 'Sizing':
-        _refresh_sizing_progress()
-    save_cache()
-    columns = SIZING_COLUMNS if sheet == 'Sizing' else (CAP_PHAT_COLUMNS if sheet == 'CapPhat' else (CHI_TIET_COLUMNS if sheet == 'ChiTiet' else CLOUD_COLUMNS))
-    sheet_id = 'sizing-sheet' if sheet == 'Sizing' else ('cap-phat-sheet' if sheet == 'CapPhat' else ('chi-tiet-sheet' if sheet == 'ChiTiet' else 'cloud-sheet'))
-    return render_template('sheet.html', sheet_name=sheet, sheet_id=sheet_id, columns=columns, rows=target_list)
+    row_id = request.values.get('row_id')
+    with write_sheets(sheet):
+        target_list = data_store[sheet]
+        if row_id:
+            check_row_version(sheet, row_id, request.values.get('version'))
+            row_index = get_row_position(sheet, row_id)
+        elif request.values.get('version') and 0 <= row_index < len(target_list):
+            check_row_version(sheet, target_list[row_index].get('row_id'), request.values.get('version'))
+        if row_index < 0 or row_index >= len(target_list):
+            return jsonify({'error': 'Invalid row index'}), 400
+        _aggregate_row(sheet, target_list[row_index], -1)
+        removed = target_list.pop(row_index)
+        _unindex_row(sheet, removed)
+        _deadline_forget_row(sheet, removed)
+        _forget_row_version(sheet, removed.get('row_id'))
+        if target_list:
+            ensure_stt(target_list)
+        persist_changes({'op': 'delete', 'sheet': sheet, 'row_id': removed.get('row_id')})
+        if row_id and target_list:
+            return ('', 200)
+        context = _window_context(sheet, 0, SHEET_PAGE_SIZE)
+        response = make_response(render_template('sheet.html', **context))
+    if row_id:
+        response.headers['HX-Retarget'] = '#' + context['sheet_id']
+        response.headers['HX-Reswap'] = 'outerHTML'
+    return response
 
-"""Cập nhật một ô dữ liệu (JSON) và xử lý phụ thuộc tiến độ/KPI."""
-@app.route('/update-cell', methods=['POST'])
-def update_cell():
-    data = request.get_json() or {}
+"""Số ô tối đa trong một lần gọi `/update-cells`."""
+UPDATE_CELLS_MAX = int(os.environ.get('UPDATE_CELLS_MAX', '5000') or 5000)
+
+"""Kiểm tra một thao tác sửa ô {sheet, rowId|row, col, value, version?}; trả về (sheet, hàng, cột, giá trị) hoặc (thông báo lỗi).
+
+Hàng theo `rowId` đã bị xoá, hoặc `version` không còn khớp -> `RowConflict` (409). Gọi khi giữ khoá ghi của sheet.
+"""
+def _resolve_cell_edit(data):
     sheet = data.get('sheet')
     row_index = data.get('row')
     row_id = data.get('rowId')
     col = data.get('col')
     value = data.get('value', '')
 
-    if sheet not in ['Sizing', 'CapPhat', 'ChiTiet', 'Cloud']:
-        return jsonify({'error': 'Invalid sheet'}), 400
+    if not isinstance(sheet, str) or sheet not in SHEET_NAMES:
+        return 'Invalid sheet'
+    if row_id and not isinstance(row_id, str):
+        return 'Invalid row id'
+    if not isinstance(col, str):
+        return 'Invalid column'
     target_list = data_store[sheet]
-    target_row = None
     if row_id:
-        for r in target_list:
-            if r.get('row_id') == row_id:
-                target_row = r
-                break
-        if target_row is None:
-            return jsonify({'error': 'Row not found'}), 400
+        check_row_version(sheet, row_id, data.get('version'))
+        target_row = get_row_by_id(sheet, row_id)
     else:
         if not isinstance(row_index, int) or row_index < 0 or row_index >= len(target_list):
-            return jsonify({'error': 'Invalid row index'}), 400
+            return 'Invalid row index'
         target_row = target_list[row_index]
-    columns = SIZING_COLUMNS if sheet == 'Sizing' else (CAP_PHAT_COLUMNS if sheet == 'CapPhat' else (CHI_TIET_COLUMNS if sheet == 'ChiTiet' else CLOUD_COLUMNS))
-    if col not in columns:
-        return jsonify({'error': 'Invalid column'}), 400
-    prev_val = target_row.get(col, '')
-    target_row[col] = value
-    if sheet == 'Sizing' and col == 'Thời gian hoàn thành theo KPI':
-        _update_progress_for_row(target_row)
-    # Khi tạo Mã SR (CapPhat) từ rỗng -> có giá trị: ghi lại 'Ngày tạo mã SR' (ẩn) vào map
-    if sheet == 'CapPhat' and col == 'Mã SR':
+        if data.get('version'):
+            check_row_version(sheet, target_row.get('row_id'), data.get('version'))
+    if col not in _schemas[sheet].names:
+        # Chấp nhận cả tên hiển thị của cột (client cũ gửi tên thay vì id)
+        col = _schemas[sheet].id_for(col)
+        if col is None:
+            return 'Invalid column'
+    return sheet, target_row, col, value
+
+"""Áp dụng các thao tác sửa ô đã kiểm tra: cập nhật tổng hợp, tính lại tiến độ một lần và ghi nhật ký một lần.
+
+Trả về dict row_id -> 'Tiến độ' mới của các hàng Sizing có ô KPI thay đổi.
+"""
+def _apply_cell_edits(edits):
+    records = []
+    progress_rows = {}
+    deadline_rows = {}
+    sr_created = {}
+    for sheet, target_row, col, value in edits:
+        prev_val = target_row.get(col, '')
+        affects_summary = _aggregate_affected(sheet, col)
+        if affects_summary:
+            _aggregate_row(sheet, target_row, -1)
+        target_row[col] = value
+        if affects_summary:
+            _aggregate_row(sheet, target_row, 1)
+        rid = target_row.get('row_id')
+        if col in DEADLINE_COLS.get(sheet, ()):
+            deadline_rows[(sheet, rid)] = (sheet, target_row)
+        if sheet == 'Sizing' and col == 'Thời gian hoàn thành theo KPI':
+            progress_rows[rid] = target_row
+        # Khi tạo Mã SR (CapPhat) từ rỗng -> có giá trị: ghi lại 'Ngày tạo mã SR' (ẩn) vào map
+        if sheet == 'CapPhat' and col == 'Mã SR' and rid and (not str(prev_val).strip()) and str(value).strip():
+            sr_created[rid] = datetime.now().strftime('%d/%m/%Y')
+        records.append({'op': 'set', 'sheet': sheet, 'row_id': rid, 'col': col, 'value': value})
+    if progress_rows:
+        _refresh_sizing_progress(list(progress_rows.values()))
+    if sr_created:
         try:
-            rid = target_row.get('row_id')
-            if rid and (not str(prev_val).strip()) and str(value).strip():
-                sr_map = _load_sr_created_map()
-                sr_map[rid] = datetime.now().strftime('%d/%m/%Y')
-                _save_sr_created_map(sr_map)
+            _sr_created_cache.update(sr_created)
         except Exception:
             pass
-    save_cache()
+    if deadline_rows:
+        _deadline_index_rows(list(deadline_rows.values()))
+    if records:
+        persist_changes(*records)
+    return {rid: row.get('Tiến độ', '') for rid, row in progress_rows.items()}
+
+"""Cập nhật một ô dữ liệu (JSON) và xử lý phụ thuộc tiến độ/KPI."""
+@app.route('/update-cell', methods=['POST'])
+def update_cell():
+    data = request.get_json() or {}
+    with write_sheets(data.get('sheet')):
+        edit = _resolve_cell_edit(data)
+        if isinstance(edit, str):
+            return jsonify({'error': edit}), 400
+        _apply_cell_edits([edit])
     return ('', 204)
 
+"""Cập nhật nhiều ô trong một request: {"edits": [{sheet, rowId|row, col, value}, ...]}.
+
+Tất cả thao tác được kiểm tra trước; chỉ cần một thao tác lỗi là không áp dụng gì (400, kèm `index`;
+hàng bị sửa/xoá bởi request khác -> 409, kèm `index`). Tiến độ được tính lại một lần và nhật ký được ghi
+một lần cho cả lô. Kết quả kèm `versions` (row_id -> phiên bản mới) để client gửi ở lần sửa sau.
+"""
+@app.route('/update-cells', methods=['POST'])
+def update_cells():
+    data = request.get_json(silent=True) or {}
+    raw_edits = data.get('edits')
+    if not isinstance(raw_edits, list):
+        return jsonify({'error': 'Invalid request'}), 400
+    if len(raw_edits) > UPDATE_CELLS_MAX:
+        return jsonify({'error': f'Too many edits (max {UPDATE_CELLS_MAX})'}), 400
+    # Kiểm tra tên sheet trước khi khoá (giá trị không phải chuỗi, vd list, không dùng làm khoá set được)
+    for i, raw in enumerate(raw_edits):
+        if not isinstance(raw, dict) or not isinstance(raw.get('sheet'), str) or raw['sheet'] not in SHEET_NAMES:
+            return jsonify({'error': 'Invalid sheet', 'index': i}), 400
+    edits = []
+    with write_sheets(*{raw['sheet'] for raw in raw_edits}):
+        for i, raw in enumerate(raw_edits):
+            try:
+                edit = _resolve_cell_edit(raw)
+            except RowConflict as e:
+                e.index = i
+                raise
+            if isinstance(edit, str):
+                return jsonify({'error': edit, 'index': i}), 400
+            edits.append(edit)
+        progress = _apply_cell_edits(edits)
+        versions = {row.get('row_id'): row_version(sheet, row.get('row_id')) for sheet, row, _, _ in edits}
+    return jsonify({'applied': len(edits), 'progress': progress, 'versions': versions}), 200
+
 """Các filter Jinja hỗ trợ hiển thị rỗng/ngày/đánh class tiến độ."""
 @app.template_filter('blanknan')
 def blanknan(val):
@@ -961,6 +3271,70 @@ def progress_class(status):
     }
     return mapping.get(status, '')
 
+"""Cache HTML đã render của từng nhóm hàng (`row.html`), để render sheet chỉ ghép các fragment có sẵn.
+
+- Khoá: (sheet, row_id, phiên bản hàng, phiên bản lược đồ cột); với Sizing kèm giá trị 'Tiến độ'
+  (được tính lại theo ngày hiện tại mà không đổi phiên bản hàng)
+- `idx` (vị trí hàng) và ô STT đổi khi thêm/xoá hàng phía trên nên không nằm trong khoá: fragment được
+  render với chỗ giữ (`_FRAGMENT_SLOT`) và điền giá trị thật mỗi lần ghép
+- LRU có giới hạn `ROW_FRAGMENT_CACHE_SIZE` fragment (0 = tắt cache); fragment cũ (phiên bản đã đổi) tự bị đẩy ra
+Tỉ lệ cache hit xem qua `/debug-row-cache`.
+"""
+ROW_FRAGMENT_CACHE_SIZE = max(0, int(os.environ.get('ROW_FRAGMENT_CACHE_SIZE', '20000') or 0))
+_FRAGMENT_IDX = Markup('<!--row-idx-->')
+_FRAGMENT_STT = Markup('<!--row-stt-->')
+_FRAGMENT_SLOT = re.compile('(<!--row-idx-->|<!--row-stt-->)')
+_fragment_cache = OrderedDict()
+_fragment_cache_lock = threading.Lock()
+_fragment_cache_stats = {'hits': 0, 'misses': 0}
+
+class _FragmentRow:
+    """Hàng chỉ đọc cho `row.html`: ô STT trả về chỗ giữ thay vì giá trị thật."""
+    __slots__ = ('_row',)
+
+    def __init__(self, row):
+        self._row = row
+
+    def __getitem__(self, key):
+        return _FRAGMENT_STT if key == 'STT' else self._row[key]
+
+def _render_row_parts(sheet_name, columns, row):
+    html = app.jinja_env.get_template('row.html').render(
+        sheet_name=sheet_name, columns=columns, row=_FragmentRow(row), idx=_FRAGMENT_IDX)
+    return tuple(_FRAGMENT_SLOT.split(html))
+
+"""HTML nhóm hàng tại vị trí `idx` (dùng trong template: `row_fragment(sheet, columns, row, idx)`)."""
+@app.template_global('row_fragment')
+def row_fragment(sheet_name, columns, row, idx):
+    row_id = row['row_id']
+    key = (sheet_name, row_id, row_version(sheet_name, row_id), _schema_versions.get(sheet_name),
+           row.get('Tiến độ') if sheet_name == 'Sizing' else None)
+    parts = None
+    if ROW_FRAGMENT_CACHE_SIZE:
+        with _fragment_cache_lock:
+            parts = _fragment_cache.get(key)
+            if parts is not None:
+                _fragment_cache.move_to_end(key)
+                _fragment_cache_stats['hits'] += 1
+    if parts is None:
+        parts = _render_row_parts(sheet_name, columns, row)
+        if ROW_FRAGMENT_CACHE_SIZE:
+            with _fragment_cache_lock:
+                _fragment_cache_stats['misses'] += 1
+                _fragment_cache[key] = parts
+                while len(_fragment_cache) > ROW_FRAGMENT_CACHE_SIZE:
+                    _fragment_cache.popitem(last=False)
+    slots = {_FRAGMENT_IDX: str(idx), _FRAGMENT_STT: str(escape(blanknan(row.get('STT'))))}
+    return Markup(''.join(slots.get(part, part) for part in parts))
+
+def fragment_cache_info():
+    stats = dict(_fragment_cache_stats)
+    lookups = stats['hits'] + stats['misses']
+    stats['size'] = len(_fragment_cache)
+    stats['max_size'] = ROW_FRAGMENT_CACHE_SIZE
+    stats['hit_rate'] = round(stats['hits'] / lookups, 4) if lookups else None
+    return stats
+
 """Xuất toàn bộ dữ liệu hiện tại ra file Excel (3 sheet)."""
 @app.route('/export')
 def export_excel():
@@ -969,22 +3343,23 @@ def export_excel():
     path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
     try:
         with pd.ExcelWriter(path, engine='openpyxl') as writer:
-            def build_df(rows, cols):
+            def build_df(sheet_name):
+                rows, cols = data_store[sheet_name], _sheet_columns(sheet_name)
+                names = [column_name(sheet_name, c) for c in cols]
                 if not rows:
-                    return pd.DataFrame(columns=cols)
-                df = pd.DataFrame(rows)
-                DATE_KEYWORDS = ["Thời", "Timeline", "Qúy"]
-                def is_date_col(name):
-                    return any(kw.lower() in name.lower() for kw in DATE_KEYWORDS)
-                for c in cols:
-                    if c in df.columns and is_date_col(c):
+                    return pd.DataFrame(columns=names)
+                df = _rows_to_frame(rows).reindex(columns=cols, fill_value='')
+                for c, name in zip(cols, names):
+                    if _is_date_col_by_name(name):
                         df[c] = df[c].apply(lambda v: _format_date(v) if v not in [None,''] else '')
-                return df[cols]
+                df.columns = names
+                return df
 
-            sizing_df = build_df(data_store['Sizing'], SIZING_COLUMNS)
-            cap_df = build_df(data_store['CapPhat'], CAP_PHAT_COLUMNS)
-            chi_tiet_df = build_df(data_store['ChiTiet'], CHI_TIET_COLUMNS)
-            cloud_df = build_df(data_store['Cloud'], CLOUD_COLUMNS)
+            with read_sheets():
+                sizing_df = build_df('Sizing')
+                cap_df = build_df('CapPhat')
+                chi_tiet_df = build_df('ChiTiet')
+                cloud_df = build_df('Cloud')
 
             sizing_df.to_excel(writer, sheet_name='Sizing', index=False)
             cap_df.to_excel(writer, sheet_name='Cấp phát TN', index=False)
@@ -994,32 +3369,42 @@ def export_excel():
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
-"""Truy xuất cặp (rows, columns, sheet_id) theo tên sheet."""
+"""Truy xuất bộ (rows, id cột, sheet_id) theo tên sheet."""
 def get_sheet_info(sheet_name):
     if sheet_name == 'Sizing':
-        return data_store['Sizing'], SIZING_COLUMNS, 'sizing-sheet'
+        return data_store['Sizing'], _sheet_columns('Sizing'), 'sizing-sheet'
     elif sheet_name == 'CapPhat':
-        return data_store['CapPhat'], CAP_PHAT_COLUMNS, 'cap-phat-sheet'
+        return data_store['CapPhat'], _sheet_columns('CapPhat'), 'cap-phat-sheet'
     elif sheet_name == 'ChiTiet':
-        return data_store['ChiTiet'], CHI_TIET_COLUMNS, 'chi-tiet-sheet'
+        return data_store['ChiTiet'], _sheet_columns('ChiTiet'), 'chi-tiet-sheet'
     elif sheet_name == 'Cloud':
-        return data_store['Cloud'], CLOUD_COLUMNS, 'cloud-sheet'
+        return data_store['Cloud'], _sheet_columns('Cloud'), 'cloud-sheet'
     abort(404)
 
-"""Cập nhật danh sách cột chuẩn tương ứng theo tên sheet."""
-def update_columns_constant(sheet_name, new_columns):
-    global SIZING_COLUMNS, CAP_PHAT_COLUMNS, CHI_TIET_COLUMNS, CLOUD_COLUMNS
+"""Áp dụng lược đồ mới cho sheet và ghi bản ghi `schema` vào nhật ký (không ghi lại toàn bộ dữ liệu)."""
+def _commit_schema(sheet_name, schema):
+    _apply_schema(sheet_name, schema)
+    persist_changes({'op': 'schema', 'sheet': sheet_name, 'schema': schema.to_json()})
 
-    if sheet_name == 'Sizing':
-        SIZING_COLUMNS = new_columns
-    elif sheet_name == 'CapPhat':
-        CAP_PHAT_COLUMNS = new_columns
-    elif sheet_name == 'ChiTiet':
-        CHI_TIET_COLUMNS = new_columns
-    elif sheet_name == 'Cloud':
-        CLOUD_COLUMNS = new_columns
+"""Render lại toàn bộ các bảng (sau import hoặc đổi cấu trúc cột)."""
+def _render_tables():
+    return render_template(
+        'tables.html',
+        sizing_columns=_sheet_columns('Sizing'),
+        cap_phat_columns=_sheet_columns('CapPhat'),
+        chi_tiet_columns=_sheet_columns('ChiTiet'),
+        cloud_columns=_sheet_columns('Cloud'),
+        sizing_rows=data_store['Sizing'],
+        cap_phat_rows=data_store['CapPhat'],
+        chi_tiet_rows=data_store['ChiTiet'],
+        cloud_rows=data_store['Cloud'],
+        **dashboard_summary()
+    )
+
+"""Đổi tên cột trong một sheet: chỉ đổi tên hiển thị trong lược đồ, dữ liệu hàng giữ nguyên theo id cột.
 
-"""Đổi tên cột trong một sheet và đồng bộ dữ liệu hàng tương ứng."""
+JSON: {sheet, colId (id cột, ưu tiên) hoặc oldCol (tên hiện tại), newCol}.
+"""
 @app.route('/update-col-name', methods=['POST'])
 def update_col_name():
     data = request.get_json() or {}
@@ -1030,32 +3415,29 @@ def update_col_name():
     if sheet not in data_store or not new_col_name:
         return jsonify({'error': 'Invalid request'}), 400
 
-    rows, columns, sheet_id = get_sheet_info(sheet)
-
-    try:
-        col_index = columns.index(old_col_name)
-    except ValueError:
-        return jsonify({'error': 'Column not found'}), 400
-
-    new_columns = columns[:]
-    new_columns[col_index] = new_col_name
-    update_columns_constant(sheet, new_columns)
-
-    for row in rows:
-        if old_col_name in row:
-            row[new_col_name] = row.pop(old_col_name)
+    with write_sheets(sheet):
+        schema = _schemas[sheet]
+        col_id = data.get('colId')
+        if col_id not in schema.names:
+            col_id = schema.id_for(old_col_name)
+        if col_id is None:
+            return jsonify({'error': 'Column not found'}), 400
+        if schema.name(col_id) == new_col_name:
+            return ('', 204)
+        if schema.id_for(new_col_name) is not None:
+            return jsonify({'error': f"Tên cột '{new_col_name}' đã tồn tại"}), 400
 
-    save_cache()
+        new_schema = SheetSchema.from_json(schema.defaults, schema.to_json())
+        new_schema.rename(col_id, new_col_name)
+        _commit_schema(sheet, new_schema)
     return ('', 204)
 
-"""Chèn/Xoá cột tại vị trí chỉ định, giữ đồng bộ cấu trúc hàng."""
+"""Chèn/Xoá cột tại vị trí chỉ định: chỉ sửa lược đồ của sheet (không viết lại từng hàng)."""
 @app.route('/handle-col/<sheet>/<action>/<int:col_index>', methods=['POST'])
 def handle_col(sheet, action, col_index):
     if sheet not in data_store:
         abort(404, description=f"Sheet '{sheet}' không tồn tại")
 
-    rows, columns, sheet_id = get_sheet_info(sheet)
-
     new_col_name = ''
     if action == 'insert':
         new_col_name = request.values.get('new_col_name', '').strip()
@@ -1064,77 +3446,220 @@ def handle_col(sheet, action, col_index):
             payload = request.get_json(silent=True) or {}
             new_col_name = payload.get('new_col_name', '').strip()
 
-    if action == 'insert':
-        if not new_col_name:
-            return jsonify({'error': 'Tên cột không được để trống'}), 400
-        if new_col_name in columns:
-            return jsonify({'error': f"Tên cột '{new_col_name}' đã tồn tại"}), 400
-        if col_index < 0 or col_index > len(columns):
-            return jsonify({'error': 'Vị trí cột không hợp lệ'}), 400
-
-        new_columns = columns[:]
-        new_columns.insert(col_index, new_col_name)
+    with write_sheets(sheet):
+        schema = _schemas[sheet]
+        columns = schema.ids
+        new_schema = SheetSchema.from_json(schema.defaults, schema.to_json())
+
+        if action == 'insert':
+            if not new_col_name:
+                return jsonify({'error': 'Tên cột không được để trống'}), 400
+            if schema.id_for(new_col_name) is not None:
+                return jsonify({'error': f"Tên cột '{new_col_name}' đã tồn tại"}), 400
+            if col_index < 0 or col_index > len(columns):
+                return jsonify({'error': 'Vị trí cột không hợp lệ'}), 400
+            new_schema.insert(col_index, new_col_name)
+
+        elif action == 'delete':
+            if col_index < 0 or col_index >= len(columns):
+                return jsonify({'error': 'Vị trí cột không hợp lệ'}), 400
+            if columns[col_index] == 'STT':
+                return jsonify({'error': 'Không thể xóa cột STT'}), 400
+            new_schema.delete(columns[col_index])
 
-        update_columns_constant(sheet, new_columns)
-
-        for row in rows:
-            temp_row = {col: row.get(col, '') for col in new_columns}
-            temp_row[new_col_name] = ''
-            temp_row['row_id'] = row.get('row_id') or str(uuid.uuid4())
-            row.clear()
-            row.update(temp_row)
-
-        return render_template(
-            'tables.html',
-            sizing_columns=SIZING_COLUMNS,
-            sizing_rows=data_store['Sizing'],
-            cap_phat_columns=CAP_PHAT_COLUMNS,
-            cap_phat_rows=data_store['CapPhat'],
-            chi_tiet_columns=CHI_TIET_COLUMNS,
-            chi_tiet_rows=data_store['ChiTiet']
-        ), 200
-
-    if action == 'delete':
-        if col_index < 0 or col_index >= len(columns):
-            return jsonify({'error': 'Vị trí cột không hợp lệ'}), 400
-        col_name_to_delete = columns[col_index]
-
-        if col_name_to_delete == 'STT':
-            return jsonify({'error': 'Không thể xóa cột STT'}), 400
-
-        new_columns = columns[:]
-        del new_columns[col_index]
-
-        for row in rows:
-            row.pop(col_name_to_delete, None)
-            if 'row_id' not in row:
-                row['row_id'] = str(uuid.uuid4())
+        else:
+            return jsonify({'error': f'Hành động {action} không được hỗ trợ'}), 400
 
-        update_columns_constant(sheet, new_columns)
+        _commit_schema(sheet, new_schema)
 
-        return render_template(
-            'tables.html',
-            sizing_columns=SIZING_COLUMNS,
-            sizing_rows=data_store['Sizing'],
-            cap_phat_columns=CAP_PHAT_COLUMNS,
-            cap_phat_rows=data_store['CapPhat'],
-            chi_tiet_columns=CHI_TIET_COLUMNS,
-            chi_tiet_rows=data_store['ChiTiet']
-        ), 200
-
-    return jsonify({'error': f'Hành động {action} không được hỗ trợ'}), 400
+    with read_sheets():
+        return _render_tables(), 200
 
 """Endpoint thủ công: kích hoạt gửi cảnh báo WhatsApp ngay lập tức."""
 @app.route('/trigger-whatsapp-alerts', methods=['POST'])
 def trigger_whatsapp_alerts():
     try:
-        count = check_and_send_whatsapp_alerts()
-        return jsonify({'sent': count}), 200
+        digest = request.values.get('digest')
+        return jsonify(run_whatsapp_alerts(None if digest is None else digest == '1')), 200
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+"""Trạng thái outbox cảnh báo WhatsApp (lọc theo `status` nếu có). Chứa số người nhận nên chỉ dành cho admin
+(header `X-Admin-Token`, như các endpoint `/admin/...`)."""
+@app.route('/whatsapp-outbox', methods=['GET'])
+def whatsapp_outbox():
+    _require_admin()
+    outbox = _load_outbox()
+    counts = {}
+    for entry in outbox.values():
+        counts[entry.get('status', '')] = counts.get(entry.get('status', ''), 0) + 1
+    status = request.args.get('status')
+    entries = [dict(entry, key=key) for key, entry in outbox.items() if not status or entry.get('status') == status]
+    return jsonify({'counts': counts, 'total': len(outbox), 'entries': entries}), 200
+
+"""Profiler theo yêu cầu, chỉ dành cho admin (cần cấu hình `ADMIN_TOKEN`; chưa cấu hình thì endpoint admin trả 404
+và cờ profile bị bỏ qua).
+
+- Profile một request: thêm header `X-Profile: 1` (hoặc query `_profile=1`) kèm header `X-Admin-Token` (token chỉ
+  nhận qua header để không lọt vào log truy cập). Request chạy dưới cProfile (bảng top-N hàm theo thời gian cộng dồn) và bộ lấy mẫu stack
+  (`StackSampler`, cho file collapsed stacks dùng với flamegraph.pl/speedscope). Response có header `X-Profile-Id`;
+  `_profile=top` hoặc `_profile=collapsed` trả thẳng kết quả (text) thay cho nội dung thường
+- Scheduler WhatsApp: `PROFILE_SCHEDULER=1` profile mọi lượt gửi theo lịch, hoặc POST `/admin/profile-scheduler?runs=N`
+  để profile N lượt kế tiếp
+- Kết quả lưu vòng trong `cache/profiles` (giữ `PROFILE_KEEP` bản mới nhất), liệt kê ở `/admin/profiles`
+Mỗi tiến trình chỉ profile một request tại một thời điểm; request khác tới lúc đó vẫn chạy bình thường, không bị profile.
+"""
+ADMIN_TOKEN = os.environ.get('ADMIN_TOKEN', '').strip()
+PROFILE_DIR = os.path.join(CACHE_DIR, 'profiles')
+PROFILE_KEEP = max(1, int(os.environ.get('PROFILE_KEEP', '20') or 20))
+PROFILE_TOP_N = max(1, int(os.environ.get('PROFILE_TOP_N', '40') or 40))
+PROFILE_SAMPLE_INTERVAL = max(0.001, float(os.environ.get('PROFILE_SAMPLE_INTERVAL_MS', '5') or 5) / 1000)
+_profile_lock = threading.Lock()        # request đang được profile (không chờ: bận thì bỏ qua)
+_profile_store_lock = threading.Lock()  # ghi/dọn thư mục profile
+_scheduler_profile = {
+    'always': os.environ.get('PROFILE_SCHEDULER', '0').strip().lower() in ('1', 'true', 'yes', 'on'),
+    'runs': 0,
+}
+
+def _admin_token_ok():
+    token = request.headers.get('X-Admin-Token') or ''
+    return bool(ADMIN_TOKEN) and hmac.compare_digest(token.encode('utf-8'), ADMIN_TOKEN.encode('utf-8'))
+
+def _require_admin():
+    if not ADMIN_TOKEN:
+        abort(404)
+    if not _admin_token_ok():
+        abort(403, description='Admin token không hợp lệ')
+
+"""Ghi một profile vào `PROFILE_DIR` (giữ `PROFILE_KEEP` bản mới nhất) dưới khoá thư mục profile."""
+def _save_profile(kind, label, profiler, sampler, duration, extra=None):
+    with _profile_store_lock:
+        return save_profile(PROFILE_DIR, kind, label, profiler, sampler, duration, extra,
+                            keep=PROFILE_KEEP, top_n=PROFILE_TOP_N)
+
+@app.before_request
+def _start_request_profile():
+    mode = (request.headers.get('X-Profile') or request.args.get('_profile') or '').strip().lower()
+    if mode in ('', '0', 'false', 'no', 'off') or not ADMIN_TOKEN:
+        return
+    _require_admin()
+    if not _profile_lock.acquire(blocking=False):
+        g._profile_busy = True
+        return
+    sampler = StackSampler(threading.get_ident(), PROFILE_SAMPLE_INTERVAL).start()
+    profiler = cProfile.Profile()
+    g._profile = (mode, profiler, sampler, time.perf_counter())
+    profiler.enable()
+
+@app.after_request
+def _finish_request_profile(response):
+    state = g.pop('_profile', None)
+    if g.pop('_profile_busy', False):
+        response.headers['X-Profile-Status'] = 'busy'
+    if state is None:
+        return response
+    mode, profiler, sampler, started = state
+    try:
+        profiler.disable()
+        sampler.stop()
+        profile_id = _save_profile('request', request.endpoint or request.path, profiler, sampler,
+                                   time.perf_counter() - started,
+                                   {'method': request.method, 'path': request.full_path.rstrip('?'),
+                                    'status': response.status_code})
+    finally:
+        _profile_lock.release()
+    if mode in PROFILE_FILES:
+        with open(os.path.join(PROFILE_DIR, profile_id + PROFILE_FILES[mode]), encoding='utf-8') as f:
+            response = app.response_class(f.read(), mimetype='text/plain')
+    response.headers['X-Profile-Id'] = profile_id
+    return response
+
+"""Request lỗi không qua `after_request`: vẫn tắt profiler và nhả khoá."""
+@app.teardown_request
+def _abort_request_profile(exc):
+    state = g.pop('_profile', None)
+    if state is not None:
+        state[1].disable()
+        state[2].stop()
+        _profile_lock.release()
+
+"""Chạy `fn` của scheduler, profile nếu bật `PROFILE_SCHEDULER` hoặc đã được hẹn qua `/admin/profile-scheduler`."""
+def _run_scheduler_job(fn):
+    with _profile_store_lock:
+        armed = _scheduler_profile['always'] or _scheduler_profile['runs'] > 0
+        if _scheduler_profile['runs'] > 0:
+            _scheduler_profile['runs'] -= 1
+    if not armed:
+        return fn()
+    sampler = StackSampler(threading.get_ident(), PROFILE_SAMPLE_INTERVAL).start()
+    profiler = cProfile.Profile()
+    started = time.perf_counter()
+    profiler.enable()
+    try:
+        return fn()
+    finally:
+        profiler.disable()
+        sampler.stop()
+        try:
+            _save_profile('scheduler', getattr(fn, '__name__', 'scheduler'), profiler, sampler, time.perf_counter() - started)
+        except Exception:
+            pass
+
+"""Danh sách profile đã lưu (mới nhất trước) và số lượt scheduler đang chờ profile."""
+@app.route('/admin/profiles', methods=['GET'])
+def admin_profiles():
+    _require_admin()
+    profiles = []
+    for profile_id in list_profile_ids(PROFILE_DIR):
+        try:
+            with open(os.path.join(PROFILE_DIR, profile_id + '.json'), encoding='utf-8') as f:
+                profiles.append(json.load(f))
+        except (OSError, ValueError):
+            continue
+    return jsonify({'profiles': profiles, 'keep': PROFILE_KEEP,
+                    'scheduler': dict(_scheduler_profile)}), 200
+
+"""Tải một file của profile: `top` (bảng top-N theo thời gian cộng dồn) hoặc `collapsed` (flame graph)."""
+@app.route('/admin/profiles/<profile_id>/<kind>', methods=['GET'])
+def admin_profile_file(profile_id, kind):
+    _require_admin()
+    if kind not in PROFILE_FILES or profile_id not in list_profile_ids(PROFILE_DIR):
+        abort(404)
+    return send_file(os.path.join(PROFILE_DIR, profile_id + PROFILE_FILES[kind]), mimetype='text/plain',
+                     as_attachment=kind == 'collapsed', download_name=profile_id + PROFILE_FILES[kind])
+
+"""Hẹn profile `runs` lượt gửi kế tiếp của scheduler WhatsApp (mặc định 1)."""
+@app.route('/admin/profile-scheduler', methods=['POST'])
+def admin_profile_scheduler():
+    _require_admin()
+    runs = max(0, min(request.values.get('runs', 1, type=int) or 0, 100))
+    with _profile_store_lock:
+        _scheduler_profile['runs'] = runs
+    running = any(t.name == 'whatsapp-scheduler' for t in threading.enumerate())
+    return jsonify({'runs': runs, 'always': _scheduler_profile['always'], 'scheduler_running': running}), 200
+
+_scheduler_leader = {'lock_file': None}
+
+"""Giữ khoá scheduler (không chờ); True nếu tiến trình này là worker chạy cảnh báo. Khoá tự nhả khi tiến trình dừng."""
+def _acquire_scheduler_leadership():
+    if not (MULTI_WORKER and fcntl):
+        return True
+    if _scheduler_leader['lock_file'] is not None:
+        return True
+    f = open(SCHEDULER_LOCK_FILE, 'a+')
+    try:
+        fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        f.close()
+        return False
+    f.seek(0)
+    f.truncate()
+    f.write(str(os.getpid()))
+    f.flush()
+    _scheduler_leader['lock_file'] = f
+    return True
+
 def _start_whatsapp_daily_scheduler():
-    import threading, time
 
     FIXED_TIMES = [
         (9, 0),   
@@ -1157,6 +3682,7 @@ def _start_whatsapp_daily_scheduler():
 
     def loop():
         # Không gửi ngay khi khởi động; chỉ gửi theo các mốc cố định.
+        # Nhiều worker: chỉ worker giữ khoá scheduler gửi (worker khác tiếp quản nếu worker đó dừng).
         while True:
             try:
                 now = datetime.now()
@@ -1165,7 +3691,9 @@ def _start_whatsapp_daily_scheduler():
                 time.sleep(max(sleep_seconds, 0))
                 # Đến mốc giờ: gửi cảnh báo
                 try:
-                    check_and_send_whatsapp_alerts()
+                    if _acquire_scheduler_leadership():
+                        sync_from_store()
+                        _run_scheduler_job(check_and_send_whatsapp_alerts)
                 except Exception:
                     pass
             except Exception:
@@ -1175,6 +3703,98 @@ def _start_whatsapp_daily_scheduler():
     t = threading.Thread(target=loop, name='whatsapp-scheduler', daemon=True)
     t.start()
 
+"""Lệnh CLI: chuyển cache JSON (mặc định `cache/data_store.json` + nhật ký) sang SQLite."""
+@app.cli.command('sqlite-import')
+@click.argument('path', required=False)
+def sqlite_import_command(path=None):
+    loaded = _read_json_cache(path or CACHE_FILE)
+    if loaded is None:
+        raise click.ClickException(f'Không tìm thấy file {path or CACHE_FILE}')
+    with _persist_lock:
+        _apply_loaded(loaded)
+        _sqlite_store.save_all(_sqlite_payload(), _schemas_payload(), _versions_payload())
+    click.echo(f'Đã ghi {sum(len(rows) for rows in data_store.values())} hàng vào {_sqlite_store.path}')
+
+"""Lệnh CLI: xuất dữ liệu SQLite ra file JSON cùng định dạng cache (mặc định `cache/data_store.json`)."""
+@app.cli.command('sqlite-export')
+@click.argument('path', required=False)
+def sqlite_export_command(path=None):
+    if not _sqlite_store.exists():
+        raise click.ClickException(f'Chưa có dữ liệu SQLite tại {_sqlite_store.path}')
+    payload = _sqlite_store.load_all()
+    payload['_meta'].update({'generation': uuid.uuid4().hex, 'saved_at': datetime.now().isoformat(timespec='seconds')})
+    _write_json_atomic(path or CACHE_FILE, payload)
+    click.echo(f'Đã xuất {sum(len(v) for k, v in payload.items() if k != "_meta")} hàng ra {path or CACHE_FILE}')
+
+"""Endpoint debug: thống kê cache parse ngày (hit rate, số lần đi đường nhanh/fallback pandas). Chỉ dành cho admin
+(header `X-Admin-Token`)."""
+@app.route('/debug-date-cache', methods=['GET'])
+def debug_date_cache():
+    _require_admin()
+    return jsonify(date_cache_info()), 200
+
+"""Số liệu tính lúc scrape: số hàng mỗi sheet, cache parse ngày, cache fragment hàng."""
+@metrics.collector
+def _collect_state_metrics():
+    date_stats, fragment_stats = date_cache_info(), fragment_cache_info()
+    return [
+        ('excel_sheet_rows', 'gauge', 'Số hàng hiện có của mỗi sheet.',
+         [({'sheet': name}, len(data_store.get(name, []))) for name in SHEET_NAMES]),
+        ('excel_date_cache_lookups_total', 'counter', 'Số lần tra cache parse ngày theo kết quả.',
+         [({'result': 'hit'}, date_stats['hits']), ({'result': 'miss'}, date_stats['misses'])]),
+        ('excel_row_fragment_cache_lookups_total', 'counter', 'Số lần tra cache fragment hàng theo kết quả.',
+         [({'result': 'hit'}, fragment_stats['hits']), ({'result': 'miss'}, fragment_stats['misses'])]),
+        ('excel_row_fragment_cache_size', 'gauge', 'Số fragment hàng đang được cache.', [({}, fragment_stats['size'])]),
+    ]
+
+"""Giới hạn truy cập `/metrics` (không cấu hình gì thì mở như các endpoint khác):
+- `METRICS_TOKEN`: yêu cầu header `Authorization: Bearer <token>` (Prometheus: `authorization.credentials`), sai -> 401
+- `METRICS_ALLOWED_IPS`: IP/dải CIDR được phép scrape (phân tách bởi dấu phẩy, theo `request.remote_addr`), ngoài danh sách -> 403
+Đặt cả hai thì phải thoả cả hai.
+"""
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN', '').strip()
+METRICS_ALLOWED_IPS = os.environ.get('METRICS_ALLOWED_IPS', '').strip()
+
+def _parse_allowed_networks(value):
+    networks = []
+    for entry in (e.strip() for e in value.split(',')):
+        if not entry:
+            continue
+        try:
+            networks.append(ipaddress.ip_network(entry, strict=False))
+        except ValueError:
+            app.logger.warning('METRICS_ALLOWED_IPS: bỏ qua giá trị không hợp lệ %r', entry)
+    return networks
+
+# Mọi giá trị đều không hợp lệ thì danh sách rỗng: từ chối tất cả thay vì mở
+METRICS_ALLOWED_NETWORKS = _parse_allowed_networks(METRICS_ALLOWED_IPS)
+
+def _require_metrics_access():
+    if METRICS_ALLOWED_IPS:
+        try:
+            addr = ipaddress.ip_address(request.remote_addr or '')
+        except ValueError:
+            addr = None
+        if addr is None or not any(addr in network for network in METRICS_ALLOWED_NETWORKS):
+            abort(403)
+    if METRICS_TOKEN:
+        scheme, _, token = (request.headers.get('Authorization') or '').partition(' ')
+        if scheme.lower() != 'bearer' or not hmac.compare_digest(token.strip().encode('utf-8'),
+                                                                 METRICS_TOKEN.encode('utf-8')):
+            abort(make_response('Unauthorized\n', 401, {'WWW-Authenticate': 'Bearer'}))
+
+"""Số liệu vận hành dạng Prometheus (text exposition format 0.0.4)."""
+@app.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    _require_metrics_access()
+    return app.response_class(metrics.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+"""Endpoint debug: thống kê cache fragment hàng (hit rate, kích thước). Chỉ dành cho admin (header `X-Admin-Token`)."""
+@app.route('/debug-row-cache', methods=['GET'])
+def debug_row_cache():
+    _require_admin()
+    return jsonify(fragment_cache_info()), 200
+
 """Endpoint debug: xem cấu hình môi trường hiện tại."""
 @app.route('/debug-env', methods=['GET'])
 def debug_env():
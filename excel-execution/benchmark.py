@@ -0,0 +1,364 @@
+"""
+Bộ benchmark các đường nóng của app với workbook tổng hợp (tái lập được nhờ seed cố định).
+
+Cách dùng (chạy trong thư mục excel-execution):
+    python benchmark.py generate --rows 10k -o /tmp/bench_10k.xlsx
+    python benchmark.py run --sizes 1k,10k -o bench-new.json
+    python benchmark.py compare bench-old.json bench-new.json --threshold 0.2
+
+- `generate`: tạo workbook đủ 4 sheet theo `SIZING_COLUMNS`, `CAP_PHAT_COLUMNS`, `CHI_TIET_COLUMNS`,
+  `CLOUD_COLUMNS` (chữ tiếng Việt, ngày dd/mm/YYYY quanh hôm nay để có cảnh báo đến hạn)
+- `run`: với mỗi kích thước (1k, 10k, 100k, 1m hàng mỗi sheet), đo import, render trang chính, sửa ô,
+  save/load cache, export và một lượt cảnh báo WhatsApp (bộ gửi giả, không gọi Twilio); kết quả ghi ra JSON
+- `compare`: so hai file kết quả theo median, đánh dấu REGRESSION khi chậm hơn ngưỡng; có regression -> exit code 1
+App chạy với thư mục cache/uploads tạm (`CACHE_DIR`, `UPLOAD_FOLDER`) và cấu hình Twilio rỗng,
+nên không đụng dữ liệu thật. Engine/backend lấy theo biến môi trường như khi chạy app
+(`DATA_STORE_ENGINE`, `STORAGE_BACKEND`, `CACHE_PERSIST_MODE`).
+"""
+
+import json
+import os
+import platform
+import random
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import date, datetime, timedelta
+
+import click
+
+SIZES = {'1k': 1_000, '10k': 10_000, '100k': 100_000, '1m': 1_000_000}
+
+UNITS = ['Trung tâm Dữ liệu', 'Ban Công nghệ Thông tin', 'Trung tâm Vận hành Khai thác', 'Phòng Hạ tầng Cloud',
+         'Trung tâm Phát triển Phần mềm', 'Ban Chuyển đổi số', 'Phòng An toàn Thông tin']
+PROJECTS = ['Hệ thống quản lý khách hàng', 'Cổng thanh toán điện tử', 'Nền tảng dữ liệu lớn', 'Hóa đơn điện tử',
+            'Ứng dụng chăm sóc khách hàng', 'Hệ thống giám sát mạng lưới', 'Kho dữ liệu báo cáo', 'Nền tảng IoT']
+PURPOSES = ['mở rộng tài nguyên', 'triển khai mới', 'dự phòng thảm hoạ', 'nâng cấp phiên bản', 'kiểm thử hiệu năng']
+STATUSES = ['Đang xử lý', 'Hoàn thành', 'Chờ phê duyệt', 'Đã gửi sizing', 'Từ chối']
+NOTES = ['', '', 'Đã liên hệ đầu mối', 'Chờ bổ sung thông tin', 'Ưu tiên xử lý trong tuần', 'Cần họp thống nhất phương án']
+PROGRESS_NOTES = ['Đang cấp phát', 'Chờ duyệt tài nguyên', 'Vướng quota SAN, đề xuất chuyển Ceph', 'Đã bàn giao', '']
+POOLS = ['Private Cloud', 'QHĐC 2021', 'QHĐC 2023', 'Dự phòng']
+GROUPS = ['Ảo hoá', 'Vật lý', 'Lưu trữ', 'Big Data']
+CLOUD_LABELS = ['Tổng tài nguyên', 'Đã cấp phát', 'Còn lại', 'Đang chờ cấp', 'Dự phòng', 'Tỉ lệ sử dụng']
+
+"""Nạp app với thư mục cache/uploads riêng (phải gọi trước mọi import app khác trong tiến trình)."""
+def _load_app(workdir):
+    os.environ['CACHE_DIR'] = os.path.join(workdir, 'cache')
+    os.environ['UPLOAD_FOLDER'] = os.path.join(workdir, 'uploads')
+    os.environ['MULTI_WORKER'] = '0'
+    # Biến đã đặt (kể cả rỗng) không bị `.env` ghi đè -> không bao giờ gửi Twilio thật
+    for key in ('TWILIO_ACCOUNT_SID', 'TWILIO_AUTH_TOKEN', 'TWILIO_WHATSAPP_FROM', 'WHATSAPP_DEFAULT_TO'):
+        os.environ[key] = ''
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    import app as app_module
+    return app_module
+
+def _parse_size(text):
+    key = text.strip().lower()
+    if key in SIZES:
+        return SIZES[key]
+    return int(key.replace('_', ''))
+
+def _size_label(rows):
+    for label, n in SIZES.items():
+        if n == rows:
+            return label
+    return str(rows)
+
+"""Sinh giá trị một ô theo tên cột (ngày quanh `today`, số cho cột tài nguyên, chữ tiếng Việt cho cột còn lại)."""
+def _cell_value(sheet, col, i, rng, today, owners):
+    def day(lo, hi):
+        return (today + timedelta(days=rng.randint(lo, hi))).strftime('%d/%m/%Y')
+    if col == 'STT':
+        return i + 1
+    if sheet == 'Sizing':
+        if col == 'Mã PYC':
+            return f'PYC{today.year}-{i + 1:07d}'
+        if col == 'Thời điểm đẩy yêu cầu':
+            return day(-60, 0)
+        if col == 'Thời gian hoàn thành theo KPI':
+            return day(-5, 25)
+        if col == 'Tiến độ':
+            return ''
+        if col in ('Thời gian hoàn thành ký PNX và đóng y/c', 'Thời gian ký bản chốt sizing'):
+            return day(-30, 30) if rng.random() < 0.4 else ''
+        if col == 'Trạng thái':
+            return rng.choice(STATUSES)
+        if col == 'Tên dự án - Mục đích sizing':
+            return f'{rng.choice(PROJECTS)} - {rng.choice(PURPOSES)}'
+    if sheet in ('CapPhat', 'ChiTiet'):
+        if col == 'Dự án':
+            return f'{rng.choice(PROJECTS)} giai đoạn {rng.randint(1, 5)}'
+        if col == 'Mã SR':
+            return '' if sheet == 'CapPhat' and rng.random() < 0.3 else f'SR{today.year % 100}{i + 1:08d}'
+    if sheet == 'CapPhat':
+        if col == 'Thời gian tiếp nhận y/c':
+            return day(-4, 2)
+        if col in ('Timeline thực hiện theo GNOC', 'Thời gian hoàn thành'):
+            return day(0, 45) if rng.random() < 0.7 else ''
+        if col == 'Tiến độ, vướng mắc, đề xuất':
+            return rng.choice(PROGRESS_NOTES)
+        if col == 'Hoàn thành':
+            return rng.choice(['Đã hoàn thành', 'Chưa hoàn thành'])
+    if sheet == 'ChiTiet':
+        if col == 'Qúy cấp phát':
+            return f'Q{rng.randint(1, 4)}/{today.year}'
+        if col == 'Pool/Nguồn tài nguyên':
+            return rng.choice(POOLS)
+        if col == 'Nhóm tài nguyên':
+            return rng.choice(GROUPS)
+        if col == 'Số lượng máy chủ':
+            return rng.randint(1, 40)
+        if col.endswith('(GB)') or col in ('vCPU', 'Cint'):
+            return rng.randint(0, 20) * 64
+    if sheet == 'Cloud':
+        if 'Tiêu chí' in col:
+            return CLOUD_LABELS[i % len(CLOUD_LABELS)]
+        if 'Ghi chú' not in col:
+            return rng.randint(100, 50_000)
+    if col == 'Đơn vị':
+        return rng.choice(UNITS)
+    if col.startswith('Đầu mối'):
+        return rng.choice(owners)
+    if 'Ghi chú' in col:
+        return rng.choice(NOTES)
+    return ''
+
+"""Ghi workbook tổng hợp `rows` hàng cho Sizing/Cấp phát/Chi tiết (Cloud cố định 6 hàng) bằng openpyxl write-only."""
+def generate_workbook(app_module, path, rows, seed=0, today=None):
+    from openpyxl import Workbook
+    rng = random.Random(seed)
+    today = today or date.today()
+    owners = sorted(app_module.OWNER_PHONE_MAP) + ['nguyenvana', 'tranthib']
+    columns = {
+        'Sizing': app_module.SIZING_COLUMNS,
+        'CapPhat': app_module.CAP_PHAT_COLUMNS,
+        'ChiTiet': app_module.CHI_TIET_COLUMNS,
+        'Cloud': app_module.CLOUD_COLUMNS,
+    }
+    wb = Workbook(write_only=True)
+    for sheet, excel_name in app_module.EXCEL_SHEET_NAMES.items():
+        ws = wb.create_sheet(excel_name)
+        cols = columns[sheet]
+        ws.append(cols)
+        for i in range(6 if sheet == 'Cloud' else rows):
+            ws.append([_cell_value(sheet, col, i, rng, today, owners) for col in cols])
+    wb.save(path)
+    return path
+
+class _StubDispatcher:
+    """Bộ gửi giả thay `WhatsAppDispatcher`: mọi tin đều "gửi thành công", không gọi mạng."""
+    def __init__(self):
+        self.sent = 0
+
+    def dispatch(self, messages):
+        self.sent += len(messages)
+        return [dict(m, ok=True, status_code=201, error=None, sid=f'SMbench{n}') for n, m in enumerate(messages)]
+
+def _stats(samples, **extra):
+    result = {
+        'runs': len(samples),
+        'min': round(min(samples), 6),
+        'median': round(statistics.median(samples), 6),
+        'mean': round(statistics.fmean(samples), 6),
+        'max': round(max(samples), 6),
+    }
+    if len(samples) >= 20:
+        result['p95'] = round(sorted(samples)[int(len(samples) * 0.95) - 1], 6)
+    result.update(extra)
+    return result
+
+def _time(fn, repeat=1, setup=None):
+    samples = []
+    for _ in range(repeat):
+        if setup:
+            setup()
+        started = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - started)
+    return samples
+
+def _check(response, *ok):
+    if response.status_code not in ok:
+        raise click.ClickException(f'{response.request.path} -> {response.status_code}: {response.get_data(as_text=True)[:200]}')
+    return response
+
+def _cache_bytes(app_module):
+    if app_module.STORAGE_BACKEND == 'sqlite':
+        files = [app_module.SQLITE_FILE, app_module.SQLITE_FILE + '-wal']
+    else:
+        files = [app_module.CACHE_FILE, app_module.CACHE_JOURNAL_FILE]
+    return sum(os.path.getsize(f) for f in files if os.path.exists(f))
+
+"""Đo toàn bộ đường nóng với một workbook `rows` hàng; trả về dict tên -> thống kê (giây)."""
+def bench_size(app_module, workdir, rows, repeat, edits, seed):
+    results = {}
+    client = app_module.app.test_client()
+    uploads = app_module.app.config['UPLOAD_FOLDER']
+    # Lặp lại ít hơn cho workbook lớn để một lượt chạy không kéo dài hàng giờ
+    heavy_repeat = repeat if rows <= 10_000 else 1
+    path = os.path.join(workdir, f'bench_{_size_label(rows)}.xlsx')
+
+    started = time.perf_counter()
+    generate_workbook(app_module, path, rows, seed=seed)
+    click.echo(f'  generate: {time.perf_counter() - started:.2f}s ({os.path.getsize(path) // 1024} KB)')
+
+    def do_import():
+        with open(path, 'rb') as f:
+            _check(client.post('/import', data={'excel_file': (f, os.path.basename(path))},
+                               content_type='multipart/form-data'), 200)
+    samples = _time(do_import, heavy_repeat)
+    total_rows = sum(len(app_module.data_store[name]) for name in app_module.SHEET_NAMES)
+    results['import_excel'] = _stats(samples, rows=total_rows,
+                                     rows_per_sec=round(total_rows / statistics.median(samples)))
+
+    page = {}
+    def render_index():
+        page['bytes'] = len(_check(client.get('/'), 200).data)
+    results['index_cold'] = _stats(_time(render_index, heavy_repeat, setup=app_module._fragment_cache.clear))
+    results['index'] = _stats(_time(render_index, repeat), bytes=page['bytes'])
+
+    rng = random.Random(seed + 1)
+    sizing = app_module.data_store['Sizing']
+    targets = [(sizing[rng.randrange(len(sizing))]['row_id'], col, value) for col, value in
+               [('Ghi chú', f'Ghi chú benchmark {n}') if n % 2 else
+                ('Thời gian hoàn thành theo KPI', (date.today() + timedelta(days=n % 30)).strftime('%d/%m/%Y'))
+                for n in range(edits)]]
+    it = iter(targets)
+    def edit_cell():
+        row_id, col, value = next(it)
+        _check(client.post('/update-cell', json={'sheet': 'Sizing', 'rowId': row_id, 'col': col, 'value': value}), 204)
+    results['update_cell'] = _stats(_time(edit_cell, len(targets)))
+
+    results['save_cache'] = _stats(_time(app_module.save_cache, heavy_repeat), bytes=_cache_bytes(app_module))
+    results['load_cache'] = _stats(_time(app_module.load_cache, heavy_repeat))
+
+    export = {}
+    def do_export():
+        export['bytes'] = len(_check(client.get('/export'), 200).data)
+    results['export_excel'] = _stats(_time(do_export, heavy_repeat), bytes=export['bytes'])
+
+    stub = _StubDispatcher()
+    app_module._dispatcher_state['dispatcher'] = stub
+    def reset_alerts():
+        # Mỗi lượt như lần chạy đầu trong ngày: outbox trống, chỉ mục mốc cảnh báo dựng lại
+        if os.path.exists(app_module.WHATSAPP_OUTBOX_FILE):
+            os.remove(app_module.WHATSAPP_OUTBOX_FILE)
+        app_module._invalidate_deadlines('Sizing')
+        stub.sent = 0
+    runs = {}
+    def run_alerts():
+        runs['sent'] = app_module.check_and_send_whatsapp_alerts()
+    results['whatsapp_alerts'] = _stats(_time(run_alerts, heavy_repeat, setup=reset_alerts),
+                                        sent=runs['sent'], messages=stub.sent)
+
+    for name in os.listdir(uploads):
+        os.remove(os.path.join(uploads, name))
+    os.remove(path)
+    return results
+
+def _git_commit():
+    try:
+        out = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                             cwd=os.path.dirname(os.path.abspath(__file__)), timeout=10)
+        return out.stdout.strip() or None
+    except Exception:
+        return None
+
+@click.group()
+def cli():
+    """Benchmark các đường nóng của app (import, render, sửa ô, cache, export, cảnh báo)."""
+
+@cli.command()
+@click.option('--rows', default='1k', show_default=True, help='Số hàng mỗi sheet (1k, 10k, 100k, 1m hoặc số).')
+@click.option('--seed', default=0, show_default=True, type=int)
+@click.option('-o', '--output', required=True, type=click.Path(dir_okay=False))
+def generate(rows, seed, output):
+    """Tạo workbook tổng hợp để import thử."""
+    workdir = tempfile.mkdtemp(prefix='excel-bench-')
+    try:
+        app_module = _load_app(workdir)
+        generate_workbook(app_module, output, _parse_size(rows), seed=seed)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    click.echo(f'{output}: {os.path.getsize(output) // 1024} KB')
+
+@cli.command()
+@click.option('--sizes', default='1k,10k', show_default=True, help='Danh sách kích thước, ví dụ 1k,10k,100k,1m.')
+@click.option('--repeat', default=3, show_default=True, type=int, help='Số lần lặp mỗi phép đo (workbook > 10k: 1 lần).')
+@click.option('--edits', default=200, show_default=True, type=int, help='Số lần sửa ô được đo.')
+@click.option('--seed', default=0, show_default=True, type=int)
+@click.option('-o', '--output', default='benchmark-results.json', show_default=True, type=click.Path(dir_okay=False))
+def run(sizes, repeat, edits, seed, output):
+    """Chạy benchmark và ghi kết quả JSON."""
+    workdir = tempfile.mkdtemp(prefix='excel-bench-')
+    try:
+        app_module = _load_app(workdir)
+        report = {
+            'meta': {
+                'created_at': datetime.now().isoformat(timespec='seconds'),
+                'commit': _git_commit(),
+                'python': platform.python_version(),
+                'platform': platform.platform(),
+                'cpus': os.cpu_count(),
+                'seed': seed,
+                'repeat': repeat,
+                'config': {
+                    'DATA_STORE_ENGINE': app_module.DATA_STORE_ENGINE,
+                    'STORAGE_BACKEND': app_module.STORAGE_BACKEND,
+                    'CACHE_PERSIST_MODE': app_module.CACHE_PERSIST_MODE,
+                },
+            },
+            'results': {},
+        }
+        for label in [s for s in sizes.split(',') if s.strip()]:
+            rows = _parse_size(label)
+            click.echo(f'[{_size_label(rows)}] {rows} hàng mỗi sheet')
+            results = bench_size(app_module, workdir, rows, max(1, repeat), max(1, edits), seed)
+            for name, res in results.items():
+                click.echo(f'  {name:<16} median {res["median"] * 1000:10.1f} ms')
+            report['results'][_size_label(rows)] = results
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    click.echo(f'Đã ghi {output}')
+
+@cli.command()
+@click.argument('baseline', type=click.Path(exists=True, dir_okay=False))
+@click.argument('current', type=click.Path(exists=True, dir_okay=False))
+@click.option('--threshold', default=0.2, show_default=True, type=float, help='Chậm hơn tỉ lệ này (theo median) là regression.')
+@click.option('--min-delta-ms', default=5.0, show_default=True, type=float, help='Bỏ qua chênh lệch tuyệt đối nhỏ hơn (ms).')
+def compare(baseline, current, threshold, min_delta_ms):
+    """So hai file kết quả; có regression thì exit code 1."""
+    with open(baseline, encoding='utf-8') as f:
+        base = json.load(f)
+    with open(current, encoding='utf-8') as f:
+        cur = json.load(f)
+    if base.get('meta', {}).get('config') != cur.get('meta', {}).get('config'):
+        click.echo(f'Cảnh báo: cấu hình khác nhau {base.get("meta", {}).get("config")} != {cur.get("meta", {}).get("config")}')
+    regressions = 0
+    click.echo(f'{"size":<6} {"benchmark":<16} {"baseline ms":>12} {"current ms":>12} {"change":>8}')
+    for size, results in cur.get('results', {}).items():
+        for name, res in results.items():
+            old = base.get('results', {}).get(size, {}).get(name)
+            if not old:
+                continue
+            old_ms, new_ms = old['median'] * 1000, res['median'] * 1000
+            change = (new_ms - old_ms) / old_ms if old_ms else 0.0
+            flag = ''
+            if change > threshold and new_ms - old_ms > min_delta_ms:
+                flag = 'REGRESSION'
+                regressions += 1
+            elif change < -threshold and old_ms - new_ms > min_delta_ms:
+                flag = 'faster'
+            click.echo(f'{size:<6} {name:<16} {old_ms:12.1f} {new_ms:12.1f} {change:+8.1%} {flag}')
+    if regressions:
+        click.echo(f'{regressions} regression(s) vượt ngưỡng {threshold:.0%}')
+        sys.exit(1)
+
+if __name__ == '__main__':
+    cli()
@@ -0,0 +1,338 @@
+"""
+Engine lưu trữ dạng cột cho một sheet (`ColumnarSheet`), dùng khi `DATA_STORE_ENGINE=columnar`.
+
+Mỗi cột là một mảng kiểu cố định (`array`) đánh theo slot, cột văn bản lưu mã số nguyên trỏ vào
+bảng chuỗi chung của sheet (owner, đơn vị, trạng thái, pool... chỉ lưu một lần), các cột số
+(`numeric_columns`) lưu float64 và cột thứ tự (`int_columns`, mặc định STT) lưu int64. Giá trị không
+biểu diễn được chính xác bằng kiểu của cột (ví dụ '12.50' ở cột số) được giữ nguyên trong `overflow`.
+
+`ColumnarSheet` hành xử như list các dict hàng (`RowView`), nên template Jinja, các endpoint
+và định dạng cache JSON không thay đổi.
+"""
+
+from array import array
+from collections.abc import MutableMapping, MutableSequence
+
+import numpy as np
+import pandas as pd
+
+_INT_BLANK = -(2 ** 63)  # giá trị '' trong cột int64
+_NO_POSITION = 2 ** 62   # slot trống / chưa có vị trí trong `ColumnarSheet._slot_pos`
+
+def _format_float_cell(f):
+    # Cùng quy tắc với `_clean_numeric_string`: số nguyên bỏ '.0'
+    return str(int(f)) if f.is_integer() else str(f)
+
+class RowView(MutableMapping):
+    """Một hàng của `ColumnarSheet`, dùng như dict {tên cột: giá trị, 'row_id': ...}."""
+    __slots__ = ('_sheet', '_slot')
+
+    def __init__(self, sheet, slot):
+        self._sheet = sheet
+        self._slot = slot
+
+    def __getitem__(self, key):
+        if key == 'row_id':
+            return self._sheet._ids[self._slot]
+        return self._sheet._get(self._slot, key)
+
+    def __setitem__(self, key, value):
+        if key == 'row_id':
+            self._sheet._set_row_id(self._slot, value)
+        else:
+            self._sheet._set(self._slot, key, value)
+
+    def __delitem__(self, key):
+        if key != 'row_id':
+            self._sheet._set(self._slot, key, '')
+
+    def __iter__(self):
+        yield from self._sheet._columns
+        yield 'row_id'
+
+    def __len__(self):
+        return len(self._sheet._columns) + 1
+
+    def clear(self):
+        for key in self._sheet._columns:
+            self._sheet._set(self._slot, key, '')
+
+    def __repr__(self):
+        return f"RowView({dict(self)!r})"
+
+class ColumnarSheet(MutableSequence):
+    """Danh sách hàng của một sheet lưu theo cột; thứ tự hiển thị giữ trong `_order` (mảng slot)."""
+
+    def __init__(self, columns, rows=(), numeric_columns=(), int_columns=('STT',)):
+        self._numeric_columns = frozenset(numeric_columns)  # cột lưu float64
+        self._int_columns = frozenset(int_columns)          # cột lưu int64
+        self._columns = {}          # tên cột -> (kiểu, mảng)
+        self._overflow = {}         # tên cột -> {slot: giá trị gốc}
+        self._strings = ['']        # bảng chuỗi của sheet
+        self._codes = {'': 0}
+        self._ids = []              # slot -> row_id (None nếu slot trống)
+        self._slot_of = {}          # row_id -> slot
+        self._free = []             # slot đã xoá, dùng lại khi thêm hàng
+        self._order = array('I')    # vị trí hiển thị -> slot
+        # slot -> vị trí hiển thị; chỉ đúng với vị trí < `_pos_valid` (thêm/xoá ở vị trí p chỉ làm lệch từ p trở đi)
+        self._slot_pos = array('q')
+        self._pos_valid = 0
+        for col in columns:
+            self.add_column(col)
+        for row in rows:
+            self.append(row)
+
+    # --- cột ---
+    def _kind_of(self, col):
+        if col in self._int_columns:
+            return 'int'
+        if col in self._numeric_columns:
+            return 'num'
+        return 'str'
+
+    def has_column(self, col):
+        return col in self._columns
+
+    def add_column(self, col):
+        if col in self._columns:
+            return
+        kind = self._kind_of(col)
+        size = len(self._ids)
+        if kind == 'int':
+            arr = array('q', [_INT_BLANK]) * size
+        elif kind == 'num':
+            arr = array('d', [float('nan')]) * size
+        else:
+            arr = array('I', [0]) * size
+        self._columns[col] = (kind, arr)
+        self._overflow[col] = {}
+
+    def drop_column(self, col):
+        self._columns.pop(col, None)
+        self._overflow.pop(col, None)
+
+    # --- ô ---
+    def _intern(self, s):
+        code = self._codes.get(s)
+        if code is None:
+            code = len(self._strings)
+            self._strings.append(s)
+            self._codes[s] = code
+        return code
+
+    def _get(self, slot, col):
+        entry = self._columns.get(col)
+        if entry is None:
+            raise KeyError(col)
+        overflow = self._overflow[col]
+        if overflow and slot in overflow:
+            return overflow[slot]
+        kind, arr = entry
+        v = arr[slot]
+        if kind == 'str':
+            return self._strings[v]
+        if kind == 'num':
+            return '' if v != v else _format_float_cell(v)
+        return '' if v == _INT_BLANK else v
+
+    def _set(self, slot, col, value):
+        entry = self._columns.get(col)
+        if entry is None:
+            self.add_column(col)
+            entry = self._columns[col]
+        kind, arr = entry
+        overflow = self._overflow[col]
+        stored = None
+        if kind == 'str':
+            if isinstance(value, str):
+                stored = self._intern(value)
+        elif kind == 'num':
+            if value == '':
+                stored = float('nan')
+            elif isinstance(value, str):
+                try:
+                    f = float(value)
+                    if f == f and _format_float_cell(f) == value:
+                        stored = f
+                except (ValueError, OverflowError):
+                    pass
+        else:
+            if value == '':
+                stored = _INT_BLANK
+            elif type(value) is int and value != _INT_BLANK and -(2 ** 63) < value < 2 ** 63:
+                stored = value
+        if stored is None:
+            # Không biểu diễn chính xác được -> giữ giá trị gốc
+            overflow[slot] = value
+            arr[slot] = 0 if kind != 'num' else float('nan')
+        else:
+            arr[slot] = stored
+            if overflow:
+                overflow.pop(slot, None)
+
+    def _alloc(self):
+        if self._free:
+            return self._free.pop()
+        slot = len(self._ids)
+        self._ids.append(None)
+        self._slot_pos.append(_NO_POSITION)
+        for kind, arr in self._columns.values():
+            arr.append(_INT_BLANK if kind == 'int' else (float('nan') if kind == 'num' else 0))
+        return slot
+
+    def _write_row(self, slot, row):
+        for col in self._columns:
+            self._set(slot, col, '')
+        for key, value in row.items():
+            if key == 'row_id':
+                self._set_row_id(slot, value)
+            else:
+                self._set(slot, key, value)
+
+    def _set_row_id(self, slot, row_id):
+        old = self._ids[slot]
+        if old is not None and self._slot_of.get(old) == slot:
+            del self._slot_of[old]
+        self._ids[slot] = row_id
+        if row_id is not None:
+            self._slot_of[row_id] = slot
+
+    # --- giao diện list ---
+    def __len__(self):
+        return len(self._order)
+
+    def __iter__(self):
+        for slot in self._order:
+            yield RowView(self, slot)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [RowView(self, slot) for slot in self._order[index]]
+        return RowView(self, self._order[index])
+
+    def __setitem__(self, index, row):
+        if isinstance(index, slice):
+            raise TypeError('ColumnarSheet không hỗ trợ gán theo slice')
+        self._write_row(self._order[index], row)
+
+    def __delitem__(self, index):
+        if isinstance(index, slice):
+            slots = self._order[index]
+            first = min(range(*index.indices(len(self._order))), default=len(self._order))
+        else:
+            slots = [self._order[index]]
+            first = index + len(self._order) if index < 0 else index
+        del self._order[index]
+        self._pos_valid = min(self._pos_valid, first)
+        for slot in slots:
+            self._set_row_id(slot, None)
+            self._slot_pos[slot] = _NO_POSITION
+            for overflow in self._overflow.values():
+                overflow.pop(slot, None)
+            self._free.append(slot)
+
+    def insert(self, index, row):
+        slot = self._alloc()
+        self._write_row(slot, row)
+        if index < 0:
+            index = max(len(self._order) + index, 0)
+        index = min(index, len(self._order))
+        self._order.insert(index, slot)
+        self._pos_valid = min(self._pos_valid, index)
+
+    def pop(self, index=-1):
+        # Trả về bản sao dict vì slot sẽ được tái sử dụng
+        row = dict(self[index])
+        del self[index]
+        return row
+
+    def position_of(self, row_id):
+        slot = self._slot_of.get(row_id)
+        if slot is None:
+            return -1
+        if self._slot_pos[slot] >= self._pos_valid:
+            self._refresh_positions()
+        return self._slot_pos[slot]
+
+    def _refresh_positions(self):
+        # Chỉ tính lại phần đuôi từ vị trí đầu tiên bị lệch (thêm/xoá gần cuối sheet gần như miễn phí)
+        start = self._pos_valid
+        if start < len(self._order):
+            order = np.frombuffer(self._order, dtype=np.uint32)[start:]
+            slot_pos = np.frombuffer(self._slot_pos, dtype=np.int64)
+            slot_pos[order] = np.arange(start, start + len(order), dtype=np.int64)
+            del order, slot_pos  # nhả buffer để mảng có thể append lại
+        self._pos_valid = len(self._order)
+
+    def renumber(self, col='STT'):
+        """Đánh lại số thứ tự 1..n theo vị trí hiện tại (nhanh hơn gán từng ô)."""
+        self.add_column(col)
+        kind, arr = self._columns[col]
+        if kind != 'int':
+            for idx, row in enumerate(self, start=1):
+                row[col] = idx
+            return
+        self._overflow[col].clear()
+        for idx, slot in enumerate(self._order, start=1):
+            arr[slot] = idx
+
+    def fill_column(self, col, labels, codes):
+        """Ghi cả cột theo thứ tự hiển thị: hàng thứ i nhận `labels[codes[i]]`."""
+        self.add_column(col)
+        kind, arr = self._columns[col]
+        if kind == 'str' and len(self._order) and all(isinstance(v, str) for v in labels):
+            lookup = np.array([self._intern(v) for v in labels], dtype=np.uint32)
+            order = np.frombuffer(self._order, dtype=np.uint32)
+            np.frombuffer(arr, dtype=np.uint32)[order] = lookup[np.asarray(codes)]
+            del order  # nhả buffer để mảng có thể append lại
+            self._overflow[col].clear()
+            return
+        for slot, code in zip(self._order, codes):
+            self._set(slot, col, labels[code])
+
+    # --- truy xuất theo cột ---
+    def column_values(self, col):
+        """Danh sách giá trị của cột theo thứ tự hiển thị."""
+        if col == 'row_id':
+            return [self._ids[slot] for slot in self._order]
+        kind, arr = self._columns[col]
+        overflow = self._overflow[col]
+        if kind == 'str' and not overflow:
+            strings = self._strings
+            return [strings[arr[slot]] for slot in self._order]
+        return [self._get(slot, col) for slot in self._order]
+
+    def numeric_column(self, col):
+        """Mảng float64 theo thứ tự hiển thị; ô rỗng hoặc không phải số -> NaN."""
+        order = np.frombuffer(self._order, dtype=np.uint32) if len(self._order) else np.empty(0, dtype=np.uint32)
+        kind, arr = self._columns[col]
+        if kind == 'num':
+            values = np.frombuffer(arr, dtype=np.float64)[order] if len(arr) else np.empty(0)
+        elif kind == 'str':
+            lookup = pd.to_numeric(pd.Series(self._strings, dtype=object), errors='coerce').to_numpy(dtype=np.float64)
+            codes = np.frombuffer(arr, dtype=np.uint32)[order] if len(arr) else np.empty(0, dtype=np.uint32)
+            values = lookup[codes]
+        else:
+            raw = np.frombuffer(arr, dtype=np.int64)[order] if len(arr) else np.empty(0, dtype=np.int64)
+            values = np.where(raw == _INT_BLANK, np.nan, raw.astype(np.float64))
+        overflow = self._overflow[col]
+        if overflow:
+            values = values.copy()
+            pos_of_slot = {slot: pos for pos, slot in enumerate(self._order)}
+            for slot, v in overflow.items():
+                pos = pos_of_slot.get(slot)
+                if pos is not None:
+                    num = pd.to_numeric(v, errors='coerce')
+                    values[pos] = float(num) if not pd.isna(num) else np.nan
+        return values
+
+    def to_columns(self):
+        """Dict {cột: list giá trị} (kèm 'row_id') dùng dựng DataFrame khi export."""
+        data = {col: self.column_values(col) for col in self._columns}
+        data['row_id'] = self.column_values('row_id')
+        return data
+
+    def to_records(self):
+        """List dict hàng (dùng khi ghi cache JSON)."""
+        keys = list(self._columns) + ['row_id']
+        return [dict(zip(keys, vals)) for vals in zip(*self.to_columns().values())]
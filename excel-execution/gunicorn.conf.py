@@ -0,0 +1,23 @@
+"""
+Cấu hình gunicorn cho chế độ nhiều worker: `gunicorn -c gunicorn.conf.py app:app`
+
+- Số worker: `WEB_CONCURRENCY` (mặc định 2), số luồng mỗi worker: `GUNICORN_THREADS` (mặc định 4)
+- Bật `MULTI_WORKER=1` để các worker đồng bộ dữ liệu qua cache trên đĩa (xem `sync_from_store` trong app.py)
+- Mỗi worker khởi động scheduler WhatsApp, nhưng chỉ worker giữ khoá scheduler mới gửi cảnh báo
+Không dùng `preload_app`: mỗi worker tự nạp cache sau khi fork.
+"""
+import os
+
+bind = os.environ.get('GUNICORN_BIND', '0.0.0.0:8000')
+workers = int(os.environ.get('WEB_CONCURRENCY', '2') or 2)
+threads = int(os.environ.get('GUNICORN_THREADS', '4') or 4)
+worker_class = 'gthread'
+timeout = 120
+
+if workers > 1:
+    os.environ.setdefault('MULTI_WORKER', '1')
+
+def post_worker_init(worker):
+    import app as app_module
+    if app_module.TWILIO_WHATSAPP_FROM:
+        app_module._start_whatsapp_daily_scheduler()
@@ -0,0 +1,87 @@
+"""
+Công cụ profile theo yêu cầu: bộ lấy mẫu stack (`StackSampler`) và lưu/liệt kê kết quả profile trên đĩa.
+
+Mỗi profile gồm ba file cùng id trong thư mục profile: bảng top-N hàm theo thời gian cộng dồn (cProfile),
+collapsed stacks (dùng với flamegraph.pl/speedscope) và metadata JSON. Module không đọc cấu hình của app:
+thư mục, số bản giữ lại và số dòng top-N được truyền vào; việc khoá khi ghi đồng thời do nơi gọi đảm nhận.
+"""
+
+import io
+import json
+import os
+import pstats
+import sys
+import threading
+import uuid
+from datetime import datetime
+
+PROFILE_FILES = {'top': '.top.txt', 'collapsed': '.collapsed'}
+
+class StackSampler:
+    """Lấy mẫu stack của một luồng theo chu kỳ (`sys._current_frames`) và gộp thành collapsed stacks.
+
+    Mỗi khung là `hàm (file:dòng đầu hàm)`, gốc ở trái; chạy trên luồng riêng nên lấy mẫu được cả luồng đang ngủ/chờ I/O.
+    """
+    def __init__(self, thread_id, interval=0.005):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = {}
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='profile-sampler', daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                break
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f'{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})')
+                frame = frame.f_back
+            key = ';'.join(reversed(stack))
+            self.stacks[key] = self.stacks.get(key, 0) + 1
+            self.samples += 1
+
+    def collapsed(self):
+        return ''.join(f'{stack} {count}\n' for stack, count in sorted(self.stacks.items()))
+
+"""Id các profile đã lưu trong `directory`, mới nhất trước (id bắt đầu bằng thời điểm tạo)."""
+def list_profile_ids(directory):
+    try:
+        names = os.listdir(directory)
+    except OSError:
+        return []
+    return sorted((n[:-5] for n in names if n.endswith('.json')), reverse=True)
+
+"""Ghi một profile (bảng `top_n` hàm + collapsed stacks + metadata) vào `directory`, xoá bản cũ vượt `keep`; trả về id."""
+def save_profile(directory, kind, label, profiler, sampler, duration, extra=None, keep=20, top_n=40):
+    stream = io.StringIO()
+    pstats.Stats(profiler, stream=stream).sort_stats('cumulative').print_stats(top_n)
+    profile_id = f"{datetime.now().strftime('%Y%m%d-%H%M%S-%f')}-{uuid.uuid4().hex[:4]}"
+    meta = {'id': profile_id, 'kind': kind, 'label': label, 'created_at': datetime.now().isoformat(timespec='seconds'),
+            'duration_ms': round(duration * 1000, 1), 'samples': sampler.samples, **(extra or {})}
+    os.makedirs(directory, exist_ok=True)
+    base = os.path.join(directory, profile_id)
+    with open(base + PROFILE_FILES['top'], 'w', encoding='utf-8') as f:
+        f.write(stream.getvalue())
+    with open(base + PROFILE_FILES['collapsed'], 'w', encoding='utf-8') as f:
+        f.write(sampler.collapsed())
+    with open(base + '.json', 'w', encoding='utf-8') as f:
+        json.dump(meta, f, ensure_ascii=False)
+    for old in list_profile_ids(directory)[keep:]:
+        for suffix in ('.json', *PROFILE_FILES.values()):
+            try:
+                os.remove(os.path.join(directory, old + suffix))
+            except OSError:
+                pass
+    return profile_id
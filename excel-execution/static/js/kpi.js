@@ -3,7 +3,7 @@
 // - Khi người dùng điền "Thời điểm đẩy yêu cầu", tự cộng 3 ngày làm việc
 //   để ra "Thời gian hoàn thành theo KPI"
 // - Tính trạng thái tiến độ (Quá hạn/Đến hạn/Còn x ngày) và gán class
-// - Gửi cập nhật ô KPI lên server
+// - Gửi cập nhật ô KPI lên server (qua hàng đợi sửa ô theo lô của main.js)
 //
 document.addEventListener('DOMContentLoaded', () => {
     const sizingSheet = document.getElementById('sizing-sheet');
@@ -60,17 +60,14 @@ document.addEventListener('DOMContentLoaded', () => {
         if (row) {
             const sheetName = 'Sizing';
             const kpiCol = 'Thời gian hoàn thành theo KPI';
-            const rowIndex = parseInt(row.dataset.row, 10);
-            fetch('/update-cell', {
-                method: 'POST',
-                headers: { 'Content-Type': 'application/json' },
-                body: JSON.stringify({
-                    sheet: sheetName,
-                    row:   rowIndex,
-                    col:   kpiCol,
-                    value: kpiCell.textContent.trim()
-                })
-            }).catch(() => console.warn('Không thể lưu KPI lên server'));
+            // Đưa vào hàng đợi chung (main.js): trùng ô với bản main.js tự tính sẽ được gộp làm một
+            queueCellEdit({
+                sheet: sheetName,
+                row:   parseInt(row.dataset.row, 10),
+                rowId: row.dataset.rowId,
+                col:   kpiCol,
+                value: kpiCell.textContent.trim()
+            });
         }
 
         kpiCell.dispatchEvent(new Event('input', {bubbles:true}));
@@ -92,13 +89,12 @@ document.addEventListener('DOMContentLoaded', () => {
         return '';
     }
 
-    // Đếm số ngày làm việc giữa hai mốc (bỏ cuối tuần)
+    // Đếm số ngày làm việc giữa hai mốc (bỏ cuối tuần và ngày lễ, xem isWorkingDay trong main.js)
     function businessDaysBetween(start, end){
         let cnt = 0;
         const d = new Date(start);
         while(d < end){
-            const dw = d.getDay();
-            if(dw !== 0 && dw !== 6){ cnt++; }
+            if(isWorkingDay(d)){ cnt++; }
             d.setDate(d.getDate() + 1);
         }
         return cnt;
@@ -117,14 +113,13 @@ document.addEventListener('DOMContentLoaded', () => {
         return isNaN(dt) ? null : dt;
     }
 
-    // Cộng thêm số ngày làm việc (bỏ thứ 7, chủ nhật)
+    // Cộng thêm số ngày làm việc (bỏ thứ 7, chủ nhật và ngày lễ)
     function addWorkingDays(date, days) {
         const result = new Date(date);
         let added = 0;
         while (added < days) {
             result.setDate(result.getDate() + 1);
-            const dw = result.getDay();
-            if (dw !== 0 && dw !== 6) {
+            if (isWorkingDay(result)) {
                 added++;
             }
         }
@@ -1,10 +1,13 @@
 //
 // Giao diện JS tổng hợp cho tương tác bảng:
 // - Chuyển tab giữa các sheet
-// - Lưu ô khi blur (debounce nhẹ)
+// - Lưu ô khi blur: gom các ô sửa vào hàng đợi và gửi theo lô qua /update-cells
+// - Gửi kèm phiên bản hàng (data-version) khi sửa/xoá; server báo xung đột (409) thì tải lại sheet
+// - Dán một khối ô từ Excel (tab/xuống dòng) vào bảng
 // - Tự tính KPI + cập nhật ô liên quan từ "Thời điểm đẩy yêu cầu"
 // - Điều hướng/mapping dự án giữa các sheet và highlight dòng mục tiêu
 // - Đổi tên cột ngay trên header
+// - Đánh lại STT/chỉ số dòng sau khi HTMX chèn/gỡ/tải thêm nhóm hàng
 //
 
 document.addEventListener('click', function(e){
@@ -18,27 +21,128 @@ document.addEventListener('click', function(e){
   }
 });
 
+// Hàng đợi sửa ô: gộp theo (sheet, hàng, cột) — giá trị sau ghi đè giá trị trước — rồi gửi
+// một lô qua /update-cells sau 200ms không có thao tác mới (hoặc ngay khi đủ CELL_BATCH_MAX ô)
+const CELL_BATCH_MAX = 500;
+const cellEditQueue = new Map();
+let cellFlushTimer = null;
+
+function queueCellEdit(edit){
+  const key = `${edit.sheet}:${edit.rowId || edit.row}:${edit.col}`;
+  cellEditQueue.delete(key);
+  cellEditQueue.set(key, edit);
+  if(cellFlushTimer){ clearTimeout(cellFlushTimer); }
+  if(cellEditQueue.size >= CELL_BATCH_MAX){
+    flushCellEdits();
+  } else {
+    cellFlushTimer = setTimeout(flushCellEdits, 200);
+  }
+}
+
+// Phiên bản hàng đang hiển thị (server dùng để phát hiện hàng đã bị người khác sửa/xoá)
+function rowVersion(rowId){
+  const group = rowId && document.querySelector(`tbody.row-group[data-row-id="${rowId}"]`);
+  return group ? group.dataset.version : undefined;
+}
+
+const SHEET_CONTAINER_IDS = { Sizing: 'sizing-sheet', CapPhat: 'cap-phat-sheet', ChiTiet: 'chi-tiet-sheet' };
+
+// Tải lại sheet sau xung đột để người dùng thấy dữ liệu mới nhất trước khi sửa tiếp
+function reloadSheet(sheet){
+  const id = SHEET_CONTAINER_IDS[sheet];
+  if(id && document.getElementById(id) && window.htmx){
+    htmx.ajax('GET', `/sheet/${sheet}`, { target: `#${id}`, swap: 'outerHTML' });
+  } else {
+    window.location.reload();
+  }
+}
+
+function takeQueuedEdits(){
+  const edits = Array.from(cellEditQueue.values()).map(edit => Object.assign({}, edit, { version: rowVersion(edit.rowId) }));
+  cellEditQueue.clear();
+  return edits;
+}
+
+// Các lô được gửi lần lượt: lô sau đọc data-version đã được cập nhật từ kết quả của lô trước
+let cellFlushChain = Promise.resolve();
+
+function flushCellEdits(){
+  if(cellFlushTimer){ clearTimeout(cellFlushTimer); cellFlushTimer = null; }
+  if(!cellEditQueue.size) return;
+  cellFlushChain = cellFlushChain.then(() => {
+    const edits = takeQueuedEdits();
+    if(!edits.length) return;
+    return fetch('/update-cells', {
+      method: 'POST',
+      headers: { 'Content-Type': 'application/json' },
+      body: JSON.stringify({ edits })
+    })
+    .then(response => {
+      if(response.status === 409){
+        return response.json().then(conflict => {
+          alert('Dữ liệu hàng này vừa được người khác thay đổi. Bảng sẽ được tải lại, vui lòng nhập lại.');
+          reloadSheet(conflict.sheet);
+          return null;
+        });
+      }
+      return response.ok ? response.json() : null;
+    })
+    .then(result => {
+      Object.entries((result && result.versions) || {}).forEach(([rowId, version]) => {
+        const group = document.querySelector(`tbody.row-group[data-row-id="${rowId}"]`);
+        if(group){ group.dataset.version = version; }
+      });
+      // Đồng bộ ô 'Tiến độ' theo kết quả server (lịch ngày làm việc phía server là chuẩn)
+      Object.entries((result && result.progress) || {}).forEach(([rowId, status]) => {
+        const cell = document.querySelector(`.data-row[data-row-id="${rowId}"] td[data-col="Tiến độ"]`);
+        if(cell){ cell.textContent = status; }
+      });
+    })
+    .catch(() => {});
+  });
+}
+
+// Gửi nốt các ô còn trong hàng đợi khi rời trang
+window.addEventListener('pagehide', function(){
+  if(!cellEditQueue.size) return;
+  const edits = takeQueuedEdits();
+  navigator.sendBeacon('/update-cells', new Blob([JSON.stringify({ edits })], { type: 'application/json' }));
+});
+
+// Nút xoá hàng gửi kèm phiên bản hiện tại của hàng (đọc lúc bấm, đã cập nhật sau các lần sửa ô)
+document.addEventListener('htmx:configRequest', function(e){
+  const elt = e.detail.elt;
+  if(elt && elt.classList && elt.classList.contains('delete-row-btn')){
+    const version = rowVersion(e.detail.parameters.row_id);
+    if(version){ e.detail.parameters.version = version; }
+  }
+});
+
+// Xung đột khi thêm/xoá hàng (hàng neo đã bị xoá hoặc đã đổi) -> tải lại sheet
+document.addEventListener('htmx:responseError', function(e){
+  if(e.detail.xhr && e.detail.xhr.status === 409){
+    let sheet = null;
+    try { sheet = JSON.parse(e.detail.xhr.responseText).sheet; } catch(err) {}
+    alert('Hàng này vừa được người khác thay đổi. Bảng sẽ được tải lại.');
+    reloadSheet(sheet);
+  }
+});
+
+function cellEditFor(td, value){
+  return {
+    sheet: td.dataset.sheet,
+    row: parseInt(td.dataset.row, 10),
+    rowId: td.dataset.rowId || (td.closest('tr[data-row-id]')?.dataset.rowId),
+    col: td.dataset.col,
+    value
+  };
+}
+
 // Lưu ô khi blur, và xử lý lan truyền KPI cho Sizing
 document.addEventListener('blur', function(e){
   if(e.target.classList && e.target.classList.contains('cell')){
-    const sheet = e.target.dataset.sheet;
-    const row = parseInt(e.target.dataset.row, 10);
-    const rowId = e.target.dataset.rowId || (e.target.closest('tr[data-row-id]')?.dataset.rowId);
-    const col = e.target.dataset.col;
-    const value = e.target.textContent.trim();
-
-    if(!window.__cellUpdateTimers){ window.__cellUpdateTimers = new Map(); }
-    const key = `${sheet}:${rowId || row}:${col}`;
-    const prev = window.__cellUpdateTimers.get(key);
-    if(prev){ clearTimeout(prev); }
-    window.__cellUpdateTimers.set(key, setTimeout(() => {
-      fetch('/update-cell', {
-        method: 'POST',
-        headers: { 'Content-Type': 'application/json' },
-        body: JSON.stringify({ sheet, row, rowId, col, value })
-      }).catch(() => {});
-      window.__cellUpdateTimers.delete(key);
-    }, 200));
+    const { sheet, row, rowId, col, value } = cellEditFor(e.target, e.target.textContent.trim());
+    queueCellEdit({ sheet, row, rowId, col, value });
 
     if(sheet === 'Sizing' && col === 'Thời điểm đẩy yêu cầu'){
       const kpiCol = 'Thời gian hoàn thành theo KPI';
@@ -47,17 +151,12 @@ document.addEventListener('blur', function(e){
         let daysAdded = 0;
         while(daysAdded < 2){
           date.setDate(date.getDate() + 1);
-          const day = date.getDay();
-          if(day !== 0 && day !== 6){
+          if(isWorkingDay(date)){
             daysAdded++;
           }
         }
         const kpiDate = formatDateVN(date);
-        fetch('/update-cell', {
-          method: 'POST',
-          headers: { 'Content-Type': 'application/json' },
-          body: JSON.stringify({ sheet, row, rowId, col: kpiCol, value: kpiDate })
-        }).catch(() => {});
+        queueCellEdit({ sheet, row, rowId, col: kpiCol, value: kpiDate });
         const table = document.getElementById('sizing-sheet');
         if(table){
           const selector = rowId ? `.data-row[data-row-id="${rowId}"] td[data-col="${kpiCol}"]` : `.data-row[data-row="${row}"] td[data-col="${kpiCol}"]`;
@@ -71,6 +170,31 @@ document.addEventListener('blur', function(e){
   }
 }, true);
 
+// Dán khối ô từ Excel (dòng phân tách bởi xuống dòng, cột bởi tab): rải vào các ô editable
+// bắt đầu từ ô đang dán, theo thứ tự hàng/cột đang hiển thị, và gửi chung một lô
+document.addEventListener('paste', function(e){
+  const start = e.target.closest && e.target.closest('td.cell[contenteditable="true"]');
+  if(!start) return;
+  const text = (e.clipboardData || window.clipboardData)?.getData('text') || '';
+  if(text.indexOf('\t') === -1 && text.indexOf('\n') === -1) return;
+  e.preventDefault();
+  const lines = text.replace(/\r/g, '').replace(/\n$/, '').split('\n');
+  const table = start.closest('table');
+  const rows = Array.from(table.querySelectorAll('tr.data-row'));
+  const startRow = rows.indexOf(start.closest('tr.data-row'));
+  const colOffset = Array.from(start.parentElement.children).indexOf(start);
+  lines.forEach((line, i) => {
+    const tr = rows[startRow + i];
+    if(!tr) return;
+    line.split('\t').forEach((value, j) => {
+      const td = tr.children[colOffset + j];
+      if(!td || td.getAttribute('contenteditable') !== 'true') return;
+      td.textContent = value.trim();
+      queueCellEdit(cellEditFor(td, value.trim()));
+    });
+  });
+});
+
 // Tiện ích parse/format ngày theo dạng Việt Nam (dd/mm/yyyy)
 function parseDateVN(str){
   if(!str) return null;
@@ -81,6 +205,15 @@ function parseDateVN(str){
   return new Date(y,m,d);
 }
 
+// Ngày làm việc: bỏ thứ 7, chủ nhật và ngày lễ do server cấp (window.BUSINESS_HOLIDAYS, YYYY-MM-DD)
+function isWorkingDay(date){
+  const day = date.getDay();
+  if(day === 0 || day === 6) return false;
+  if(!window.__holidaySet){ window.__holidaySet = new Set(window.BUSINESS_HOLIDAYS || []); }
+  const iso = `${date.getFullYear()}-${String(date.getMonth()+1).padStart(2,'0')}-${String(date.getDate()).padStart(2,'0')}`;
+  return !window.__holidaySet.has(iso);
+}
+
 function formatDateVN(date){
   if(!(date instanceof Date)) return '';
   let d = date.getDate().toString().padStart(2,'0');
@@ -95,6 +228,7 @@ function formatDateVN(date){
 document.addEventListener('blur', function(e){
   if(e.target.classList && e.target.classList.contains('col-header-name')){
     const sheet = e.target.dataset.sheet;
+    const colId = e.target.dataset.colId;
     const oldCol = e.target.dataset.oldColName;
     const newCol = e.target.textContent.trim();
 
@@ -106,13 +240,15 @@ document.addEventListener('blur', function(e){
     fetch('/update-col-name', {
       method: 'POST',
       headers: { 'Content-Type': 'application/json' },
-      body: JSON.stringify({ sheet, oldCol, newCol })
+      body: JSON.stringify({ sheet, colId, oldCol, newCol })
     })
     .then(response => {
         if(response.ok) {
             e.target.dataset.oldColName = newCol;
         } else {
-            alert('Lỗi cập nhật tên cột!');
+            response.json().catch(() => ({})).then(data => {
+                alert(data.error || 'Lỗi cập nhật tên cột!');
+            });
             e.target.textContent = oldCol;
         }
     })
@@ -121,4 +257,35 @@ document.addEventListener('blur', function(e){
         e.target.textContent = oldCol;
     });
   }
-}, true);
\ No newline at end of file
+}, true);
+
+// Server chỉ trả về phần hàng bị ảnh hưởng khi thêm/xoá/tải thêm, nên chỉ số dòng (data-row)
+// và cột STT của các hàng đã hiển thị được đánh lại phía client cho khớp với thứ tự trên server
+function renumberRows(table){
+  table.querySelectorAll('tr.data-row').forEach((tr, idx) => {
+    tr.dataset.row = idx;
+    tr.querySelectorAll('td[data-row]').forEach(td => { td.dataset.row = idx; });
+    const stt = tr.querySelector('td[data-col="STT"]');
+    if(stt){ stt.textContent = idx + 1; }
+    const trigger = tr.nextElementSibling;
+    if(trigger && trigger.classList.contains('add-row-trigger')){ trigger.dataset.after = idx; }
+  });
+}
+
+document.addEventListener('htmx:afterSettle', function(){
+  document.querySelectorAll('.sheet table.excel-table').forEach(table => {
+    if(table.querySelector('tbody.row-group')){ renumberRows(table); }
+  });
+});
+
+// Tóm tắt import "Gộp theo mã" (server gửi qua header HX-Trigger: importMerged)
+document.addEventListener('importMerged', function(e){
+  const box = document.getElementById('import-summary');
+  if(!box) return;
+  const parts = [];
+  Object.entries(e.detail || {}).forEach(([sheet, s]) => {
+    if(sheet === 'elt' || !s || typeof s !== 'object') return;
+    parts.push(`${sheet}: ${s.updated} hàng sửa (${s.cells} ô), ${s.inserted} thêm, ${s.deleted} xoá`);
+  });
+  box.textContent = parts.length ? parts.join(' · ') : 'Không có thay đổi';
+});
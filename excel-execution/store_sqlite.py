@@ -0,0 +1,246 @@
+"""
+Kho SQLite cho backend `STORAGE_BACKEND=sqlite`: mỗi sheet là một bảng (khoá chính `row_id`, cột `pos`
+giữ thứ tự hàng, mỗi id cột của sheet là một cột cùng tên, giá trị không ép kiểu), bảng `meta` giữ lược đồ
+cột/bộ đếm phiên bản và bảng `row_versions` giữ phiên bản từng hàng.
+
+Module không đọc cấu hình của app: đường dẫn file, tên bảng và cột đánh chỉ mục được truyền vào `SqliteStore`.
+"""
+
+import json
+import os
+import sqlite3
+import uuid
+from datetime import datetime
+
+def _sql_ident(name):
+    return '"' + str(name).replace('"', '""') + '"'
+
+def _sql_value(val):
+    if val is None or isinstance(val, (str, int, float)):
+        return val
+    return str(val)
+
+class SqliteStore:
+    """Kho SQLite của các sheet: `tables` = {sheet: tên bảng}, `indexed_columns` = cột được đánh chỉ mục,
+    `default_columns` = {sheet: id cột mặc định} (dùng khi áp dụng lược đồ mới)."""
+
+    def __init__(self, path, tables, indexed_columns=(), default_columns=None):
+        self.path = path
+        self.tables = dict(tables)
+        self.indexed_columns = frozenset(indexed_columns)
+        self.default_columns = dict(default_columns or {})
+        self._conn = None
+        self._columns = {}  # bảng -> tập cột (không gồm row_id/pos)
+
+    def connect(self):
+        if self._conn is None:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            conn = sqlite3.connect(self.path, isolation_level=None, check_same_thread=False, timeout=30)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.execute('CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)')
+            conn.execute('CREATE TABLE IF NOT EXISTS row_versions (sheet TEXT, row_id TEXT, seq INTEGER, PRIMARY KEY (sheet, row_id))')
+            # Mã kho dùng chung cho mọi worker: worker tạo trước thắng, các worker sau đọc lại
+            conn.execute("INSERT OR IGNORE INTO meta (key, value) VALUES ('version_store', ?)", (uuid.uuid4().hex[:8],))
+            self._conn = conn
+        return self._conn
+
+    def data_version(self):
+        """Đổi mỗi khi một kết nối khác (worker khác) commit; commit của chính kết nối này không làm đổi."""
+        return self.connect().execute('PRAGMA data_version').fetchone()[0]
+
+    def version_store(self):
+        """Mã kho dùng trong phiên bản hàng (tạo một lần khi mở file lần đầu)."""
+        return self._meta_value(self.connect(), 'version_store')
+
+    def exists(self):
+        """Đã có dữ liệu được ghi đầy đủ ít nhất một lần chưa."""
+        if not os.path.exists(self.path):
+            return False
+        return self.connect().execute("SELECT 1 FROM meta WHERE key = 'saved_at'").fetchone() is not None
+
+    def _table_columns(self, table):
+        cols = self._columns.get(table)
+        if cols is None:
+            info = self.connect().execute(f'PRAGMA table_info({_sql_ident(table)})').fetchall()
+            cols = self._columns[table] = {r[1] for r in info} - {'row_id', 'pos'}
+        return cols
+
+    def _ensure_table(self, conn, table, columns):
+        """Tạo bảng nếu chưa có và thêm cột/chỉ mục còn thiếu; cột thừa (id cột đã xoá) được giữ, không đọc tới."""
+        t = _sql_ident(table)
+        conn.execute(f'CREATE TABLE IF NOT EXISTS {t} (row_id TEXT PRIMARY KEY, pos REAL NOT NULL)')
+        conn.execute(f'CREATE INDEX IF NOT EXISTS {_sql_ident(table + "_pos")} ON {t} (pos)')
+        existing = self._table_columns(table)
+        for c in columns:
+            if c not in existing:
+                conn.execute(f'ALTER TABLE {t} ADD COLUMN {_sql_ident(c)}')
+                existing.add(c)
+        indexed = set()
+        for _, index_name, *_ in conn.execute(f'PRAGMA index_list({t})').fetchall():
+            indexed.update(r[2] for r in conn.execute(f'PRAGMA index_info({_sql_ident(index_name)})'))
+        for c in columns:
+            if c in self.indexed_columns and c not in indexed:
+                conn.execute(f'CREATE INDEX {_sql_ident(f"{table}_{c}")} ON {t} ({_sql_ident(c)})')
+
+    def _transaction(self, work):
+        conn = self.connect()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            work(conn)
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            self._columns = {}
+            raise
+
+    def save_all(self, sheets, schemas=None, versions=None):
+        """Ghi lại toàn bộ (chỉ dùng khi import thay toàn bộ dữ liệu): `sheets` = {sheet: (danh sách id cột,
+        danh sách hàng dict)}, `schemas` = lược đồ cột, `versions` = trạng thái phiên bản hàng (`_versions_payload`)."""
+        def work(conn):
+            for sheet, (columns, records) in sheets.items():
+                table = self.tables.get(sheet)
+                if table is None:
+                    continue
+                self._ensure_table(conn, table, columns)
+                conn.execute(f'DELETE FROM {_sql_ident(table)}')
+                names = ['row_id', 'pos'] + list(columns)
+                conn.executemany(
+                    f'INSERT INTO {_sql_ident(table)} ({", ".join(map(_sql_ident, names))}) VALUES ({", ".join("?" * len(names))})',
+                    ([r.get('row_id'), float(i)] + [_sql_value(r.get(c, '')) for c in columns] for i, r in enumerate(records))
+                )
+            if schemas is not None:
+                conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('schemas', ?)",
+                             (json.dumps(schemas, ensure_ascii=False),))
+            if versions is not None:
+                self._save_versions(conn, versions)
+            conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('saved_at', ?)",
+                         (datetime.now().isoformat(timespec='seconds'),))
+        self._transaction(work)
+
+    def _meta_value(self, conn, key, default=None):
+        found = conn.execute('SELECT value FROM meta WHERE key = ?', (key,)).fetchone()
+        return found[0] if found else default
+
+    def _save_versions(self, conn, versions):
+        # Bộ đếm không bao giờ lùi (worker ghi lại toàn bộ có thể chưa thấy số mới nhất của worker khác)
+        seq = max(int(versions.get('seq') or 0), int(self._meta_value(conn, 'version_seq', 0)))
+        conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('version_seq', ?)", (str(seq),))
+        if versions.get('store'):
+            conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('version_store', ?)", (versions['store'],))
+        conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('version_floor', ?)",
+                     (json.dumps(versions.get('floor') or {}),))
+        conn.execute('DELETE FROM row_versions')
+        conn.executemany('INSERT INTO row_versions (sheet, row_id, seq) VALUES (?, ?, ?)',
+                         ((sheet, rid, v) for sheet, rows in (versions.get('rows') or {}).items() for rid, v in rows.items()))
+
+    def _versions(self, conn):
+        rows = {}
+        for sheet, rid, seq in conn.execute('SELECT sheet, row_id, seq FROM row_versions'):
+            rows.setdefault(sheet, {})[rid] = seq
+        try:
+            floor = json.loads(self._meta_value(conn, 'version_floor', '{}'))
+        except ValueError:
+            floor = {}
+        return {'store': self._meta_value(conn, 'version_store'), 'seq': int(self._meta_value(conn, 'version_seq', 0)),
+                'floor': floor, 'rows': rows}
+
+    def _schemas(self, conn):
+        found = conn.execute("SELECT value FROM meta WHERE key = 'schemas'").fetchone()
+        try:
+            return json.loads(found[0]) if found else {}
+        except ValueError:
+            return {}
+
+    def _apply_schema(self, conn, table, sheet, schema):
+        """Lưu lược đồ mới của sheet; id cột mới -> ADD COLUMN, cột mặc định bị xoá -> xoá trắng giá trị."""
+        schemas = self._schemas(conn)
+        defaults = self.default_columns.get(sheet, [])
+        saved = schemas.get(sheet)
+        old_ids = saved['ids'] if isinstance(saved, dict) and isinstance(saved.get('ids'), list) else defaults
+        ids = (schema or {}).get('ids') or []
+        existing = self._table_columns(table)
+        for col in ids:
+            if col not in existing:
+                conn.execute(f'ALTER TABLE {_sql_ident(table)} ADD COLUMN {_sql_ident(col)}')
+                existing.add(col)
+        for col in old_ids:
+            if col in defaults and col not in ids and col in existing:
+                conn.execute(f"UPDATE {_sql_ident(table)} SET {_sql_ident(col)} = ''")
+        schemas[sheet] = schema
+        conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('schemas', ?)",
+                     (json.dumps(schemas, ensure_ascii=False),))
+
+    def apply(self, records):
+        """Áp dụng các bản ghi {op: set/insert/delete, ...} (cùng định dạng nhật ký) trong một giao dịch.
+
+        Mỗi bản ghi được gán `seq` từ bộ đếm phiên bản trong meta (giao dịch ghi độc quyền nên không trùng giữa worker).
+        """
+        def work(conn):
+            seq = int(self._meta_value(conn, 'version_seq', 0))
+            for rec in records:
+                seq += 1
+                rec['seq'] = seq
+                table = self.tables.get(rec.get('sheet'))
+                if table is None:
+                    continue
+                op = rec.get('op')
+                if op == 'schema':
+                    self._apply_schema(conn, table, rec.get('sheet'), rec.get('schema'))
+                elif op == 'set':
+                    if rec.get('col') in self._table_columns(table):
+                        conn.execute(f'UPDATE {_sql_ident(table)} SET {_sql_ident(rec["col"])} = ? WHERE row_id = ?',
+                                     (_sql_value(rec.get('value', '')), rec.get('row_id')))
+                    conn.execute('INSERT OR REPLACE INTO row_versions (sheet, row_id, seq) VALUES (?, ?, ?)',
+                                 (rec.get('sheet'), rec.get('row_id'), seq))
+                elif op == 'insert':
+                    self._insert(conn, table, rec.get('after'), rec.get('row') or {})
+                elif op == 'delete':
+                    conn.execute(f'DELETE FROM {_sql_ident(table)} WHERE row_id = ?', (rec.get('row_id'),))
+                    conn.execute('DELETE FROM row_versions WHERE sheet = ? AND row_id = ?', (rec.get('sheet'), rec.get('row_id')))
+            conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('version_seq', ?)", (str(seq),))
+        self._transaction(work)
+
+    def _neighbours(self, conn, table, after):
+        """(pos hàng neo, pos hàng kế tiếp) cho vị trí chèn; None = không có."""
+        t = _sql_ident(table)
+        if after is None:
+            return None, conn.execute(f'SELECT MIN(pos) FROM {t}').fetchone()[0]
+        found = conn.execute(f'SELECT pos FROM {t} WHERE row_id = ?', (after,)).fetchone()
+        if found is None:
+            # Không thấy hàng neo -> thêm vào cuối (giống khi phát lại nhật ký)
+            return conn.execute(f'SELECT MAX(pos) FROM {t}').fetchone()[0], None
+        return found[0], conn.execute(f'SELECT MIN(pos) FROM {t} WHERE pos > ?', (found[0],)).fetchone()[0]
+
+    def _insert(self, conn, table, after, row):
+        lo, hi = self._neighbours(conn, table, after)
+        if lo is not None and hi is not None and not lo < (lo + hi) / 2.0 < hi:
+            # Hết độ chính xác khi chèn liên tục vào cùng một chỗ -> đánh số lại thứ tự rồi tính lại
+            ids = [r[0] for r in conn.execute(f'SELECT row_id FROM {_sql_ident(table)} ORDER BY pos')]
+            conn.executemany(f'UPDATE {_sql_ident(table)} SET pos = ? WHERE row_id = ?',
+                             ((float(i), rid) for i, rid in enumerate(ids)))
+            lo, hi = self._neighbours(conn, table, after)
+        if lo is None:
+            pos = 0.0 if hi is None else hi - 1.0
+        else:
+            pos = lo + 1.0 if hi is None else (lo + hi) / 2.0
+        columns = [c for c in row if c in self._table_columns(table)]
+        names = ['row_id', 'pos'] + columns
+        conn.execute(
+            f'INSERT OR REPLACE INTO {_sql_ident(table)} ({", ".join(map(_sql_ident, names))}) VALUES ({", ".join("?" * len(names))})',
+            [row.get('row_id'), pos] + [_sql_value(row.get(c, '')) for c in columns]
+        )
+
+    def load_all(self):
+        """Đọc toàn bộ: {sheet: [hàng dict theo thứ tự], '_meta': {'schemas': lược đồ cột, 'versions': phiên bản hàng}}."""
+        conn = self.connect()
+        tables = {r[0] for r in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+        loaded = {}
+        for sheet, table in self.tables.items():
+            if table not in tables:
+                continue
+            cur = conn.execute(f'SELECT * FROM {_sql_ident(table)} ORDER BY pos')
+            names = [d[0] for d in cur.description]
+            loaded[sheet] = [{n: v for n, v in zip(names, r) if n != 'pos'} for r in cur]
+        loaded['_meta'] = {'schemas': self._schemas(conn), 'versions': self._versions(conn)}
+        return loaded
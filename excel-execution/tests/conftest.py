@@ -0,0 +1,72 @@
+"""Cấu hình chung cho test.
+
+Mỗi lần nạp `app.py` dùng thư mục cache/upload tạm và thông tin Twilio giả. Biến môi trường được đặt
+trước khi nạp, và `.env` được nạp không ghi đè, nên thông tin thật trong `.env` không bao giờ lọt vào test.
+Mỗi lần gọi `load_app` tạo một bản module mới từ `app.py` (tương đương khởi động lại tiến trình).
+Thư mục app được thêm vào `sys.path` để `app.py` và test import được các module cạnh nó (`whatsapp`, `store_sqlite`...).
+"""
+import importlib.util
+import itertools
+import os
+import sys
+
+import pytest
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+APP_PATH = os.path.join(APP_DIR, 'app.py')
+if APP_DIR not in sys.path:
+    sys.path.insert(0, APP_DIR)
+
+TEST_ENV = {
+    'TWILIO_ACCOUNT_SID': 'ACtest',
+    'TWILIO_AUTH_TOKEN': 'test-token',
+    'TWILIO_WHATSAPP_FROM': 'whatsapp:+10000000000',
+    'TWILIO_CONTENT_SID': '',
+    'WHATSAPP_DEFAULT_TO': '',
+    # Không bao giờ gọi API Twilio thật; test dispatcher tự trỏ sang stub
+    'TWILIO_API_BASE': 'http://127.0.0.1:9',
+    'ADMIN_TOKEN': '',
+    'PUBLIC_HOLIDAYS': '',
+    'MULTI_WORKER': '0',
+    'STORAGE_BACKEND': 'json',
+    'DATA_STORE_ENGINE': 'rows',
+    'CACHE_PERSIST_MODE': 'journal',
+}
+os.environ.update(TEST_ENV)
+
+_module_seq = itertools.count(1)
+
+def _load(monkeypatch, base_dir, env):
+    for key, value in {**TEST_ENV, **env}.items():
+        monkeypatch.setenv(key, value)
+    monkeypatch.setenv('CACHE_DIR', os.path.join(base_dir, 'cache'))
+    monkeypatch.setenv('UPLOAD_FOLDER', os.path.join(base_dir, 'uploads'))
+    name = f'excel_app_{next(_module_seq)}'
+    spec = importlib.util.spec_from_file_location(name, APP_PATH)
+    module = importlib.util.module_from_spec(spec)
+    # Flask tìm thư mục templates/static theo module trong sys.modules
+    sys.modules[name] = module
+    spec.loader.exec_module(module)
+    return module
+
+"""Nạp một bản app mới; các lần gọi trong cùng test dùng chung thư mục cache (mô phỏng khởi động lại)."""
+@pytest.fixture
+def load_app(tmp_path, monkeypatch):
+    names = []
+
+    def load(**env):
+        module = _load(monkeypatch, str(tmp_path), env)
+        names.append(module.__name__)
+        return module
+
+    yield load
+    for name in names:
+        sys.modules.pop(name, None)
+
+"""Một bản app dùng chung cho các test không ghi dữ liệu (dispatcher, ghép hàng khi import)."""
+@pytest.fixture(scope='module')
+def app_module(tmp_path_factory):
+    with pytest.MonkeyPatch.context() as monkeypatch:
+        module = _load(monkeypatch, str(tmp_path_factory.mktemp('app')), {})
+        yield module
+    sys.modules.pop(module.__name__, None)
@@ -0,0 +1,18 @@
+"""Hàm dùng chung cho các test (dữ liệu sheet, gửi sửa ô qua `/update-cells`)."""
+
+def sheet_snapshot(module):
+    """Nội dung mọi sheet dưới dạng list dict (so sánh được giữa hai engine/hai lần khởi động)."""
+    return {name: [{col: row.get(col) for col in ['row_id'] + list(module._sheet_columns(name))}
+                   for row in module.data_store[name]]
+            for name in module.SHEET_NAMES}
+
+def row_versions(module):
+    return {(name, row.get('row_id')): module.row_version(name, row.get('row_id'))
+            for name in module.SHEET_NAMES for row in module.data_store[name]}
+
+def post_edits(client, *edits, status=200):
+    """Gửi các thao tác (sheet, row_id, cột, giá trị) trong một request `/update-cells`."""
+    response = client.post('/update-cells', json={'edits': [
+        {'sheet': sheet, 'rowId': row_id, 'col': col, 'value': value} for sheet, row_id, col, value in edits]})
+    assert response.status_code == status, response.get_data(as_text=True)
+    return response.get_json()
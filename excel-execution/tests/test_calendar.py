@@ -0,0 +1,67 @@
+"""Test lịch ngày làm việc (`BusinessCalendar`): cuối tuần, ngày lễ cố định/cấu hình, mã tiến độ và cảnh báo ngày lễ âm lịch."""
+import logging
+from datetime import date
+
+import pytest
+
+def _ord(day, month, year=2025):
+    return date(year, month, day).toordinal()
+
+def test_weekends_and_fixed_holidays_are_not_working_days(app_module):
+    calendar = app_module.BusinessCalendar(date(2025, 4, 28))
+    assert calendar.is_working_day(_ord(28, 4))
+    assert not calendar.is_working_day(_ord(30, 4))   # Thống nhất
+    assert not calendar.is_working_day(_ord(1, 5))    # Quốc tế lao động
+    assert not calendar.is_working_day(_ord(3, 5))    # thứ Bảy
+    # Thứ Hai 28/04 -> thứ Hai 05/05: chỉ 28/04, 29/04 và 02/05 là ngày làm việc
+    assert calendar.working_days_between(_ord(28, 4), _ord(5, 5)) == 3
+    assert calendar.prev_working_day(_ord(5, 5)) == _ord(2, 5)
+
+def test_configured_holidays_are_closed(app_module):
+    calendar = app_module.BusinessCalendar(date(2025, 1, 20), holidays=['29/01/2025', '10/03', 'sai'])
+    assert not calendar.is_working_day(_ord(29, 1))
+    assert calendar.is_working_day(_ord(29, 1, 2026))  # ngày cụ thể không lặp sang năm sau
+    assert not calendar.is_working_day(_ord(10, 3)) and not calendar.is_working_day(_ord(10, 3, 2026))
+    assert '2025-01-29' in calendar.holidays and '2025-03-10' in calendar.holidays
+
+def test_progress_codes_match_scalar_and_labels(app_module):
+    today = date(2025, 4, 28)
+    calendar = app_module.BusinessCalendar(today)
+    kpis = [0, _ord(25, 4), _ord(28, 4), _ord(29, 4), _ord(2, 5), _ord(5, 5), _ord(6, 5), _ord(1, 6)]
+    codes = list(calendar.progress_codes(kpis))
+    assert codes == [calendar.progress_code(k) for k in kpis]
+    labels = [app_module.PROGRESS_LABELS[c] for c in codes]
+    assert labels == ['', 'Quá hạn', 'Đến hạn', 'Còn 1 ngày', 'Còn 2 ngày', 'Còn 3 ngày', '', '']
+
+def test_calendar_is_rebuilt_when_holidays_change(app_module, monkeypatch):
+    first = app_module._business_calendar()
+    assert app_module._business_calendar() is first
+    monkeypatch.setenv('PUBLIC_HOLIDAYS', date.today().strftime('%d/%m/%Y'))
+    changed = app_module._business_calendar()
+    assert changed is not first and changed.signature != first.signature
+    assert not changed.is_working_day(date.today().toordinal())
+
+@pytest.mark.parametrize('holidays, missing', [
+    ('', ['Tết Nguyên đán', 'Giỗ Tổ Hùng Vương']),
+    ('{y}-skip', ['Tết Nguyên đán', 'Giỗ Tổ Hùng Vương']),
+    ('10/02/{y},17/02/{y}', ['Giỗ Tổ Hùng Vương']),
+    ('05/02/{y},18/04/{y}', []),
+    ('05/02/{prev},18/04/{prev}', ['Tết Nguyên đán', 'Giỗ Tổ Hùng Vương']),
+    ('05/02,18/04', ['Tết Nguyên đán', 'Giỗ Tổ Hùng Vương']),  # lặp hằng năm không đúng với lịch âm
+])
+def test_missing_lunar_holidays(app_module, holidays, missing):
+    year = date.today().year
+    entries = [e for e in holidays.format(y=year, prev=year - 1).split(',') if e]
+    assert app_module._missing_lunar_holidays(entries, year) == missing
+
+def test_startup_warns_when_lunar_holidays_are_missing(load_app, caplog):
+    with caplog.at_level(logging.WARNING):
+        load_app()
+    warnings = [r.getMessage() for r in caplog.records if r.levelno == logging.WARNING]
+    assert any('Tết Nguyên đán' in m and 'Giỗ Tổ Hùng Vương' in m for m in warnings)
+
+    caplog.clear()
+    year = date.today().year
+    with caplog.at_level(logging.WARNING):
+        load_app(PUBLIC_HOLIDAYS=f'29/01/{year},14/04/{year}')
+    assert not [r for r in caplog.records if 'âm lịch' in r.getMessage()]
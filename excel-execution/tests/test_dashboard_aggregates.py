@@ -0,0 +1,58 @@
+"""Test tổng hợp dashboard duy trì theo delta: sau chuỗi thêm/sửa/xoá hàng phải khớp bản dựng lại từ đầu."""
+import pytest
+
+from helpers import post_edits
+
+def _summary_after_rebuild(module):
+    for name in module._aggregates:
+        module._invalidate_aggregates(name)
+    return module.dashboard_summary()
+
+@pytest.mark.parametrize('engine', ['rows', 'columnar'])
+def test_incremental_aggregates_match_rebuild(load_app, engine):
+    module = load_app(DATA_STORE_ENGINE=engine)
+    client = module.app.test_client()
+    for _ in range(3):
+        assert client.post('/add-row/Sizing/0').status_code == 200
+        assert client.post('/add-row/ChiTiet/0').status_code == 200
+    module.dashboard_summary()  # dựng tổng hợp, các thao tác sau cập nhật theo delta
+    sizing = [row['row_id'] for row in module.data_store['Sizing']]
+    chi_tiet = [row['row_id'] for row in module.data_store['ChiTiet']]
+    post_edits(client,
+               ('Sizing', sizing[0], 'Đầu mối xử lý', 'ductn8'),
+               ('Sizing', sizing[0], 'Thời điểm đẩy yêu cầu', '15/05/2025'),
+               ('Sizing', sizing[1], 'Đầu mối xử lý', 'khanhnd23'),
+               ('Sizing', sizing[1], 'Thời điểm đẩy yêu cầu', '02/11/2024'),
+               ('Sizing', sizing[1], 'Trạng thái', 'Từ chối'),
+               ('Sizing', sizing[2], 'Đầu mối xử lý', 'người khác'),
+               ('Sizing', sizing[2], 'Thời điểm đẩy yêu cầu', '01/01/2023'),
+               ('ChiTiet', chi_tiet[0], 'Nhóm tài nguyên', 'A'),
+               ('ChiTiet', chi_tiet[0], 'vCPU', '8'),
+               ('ChiTiet', chi_tiet[0], 'RAM(GB)', '0.1'),
+               ('ChiTiet', chi_tiet[1], 'Nhóm tài nguyên', 'A'),
+               ('ChiTiet', chi_tiet[1], 'RAM(GB)', '0.2'),
+               ('ChiTiet', chi_tiet[2], 'Nhóm tài nguyên', 'B'),
+               ('ChiTiet', chi_tiet[2], 'vCPU', 'không phải số'))
+    # Đổi nhóm, đổi owner/ngày và xoá hàng: phần đóng góp cũ phải được trừ đúng
+    post_edits(client,
+               ('ChiTiet', chi_tiet[1], 'Nhóm tài nguyên', 'B'),
+               ('Sizing', sizing[0], 'Thời điểm đẩy yêu cầu', '15/08/2025'),
+               ('Sizing', sizing[1], 'Trạng thái', ''))
+    assert client.post('/delete-row/ChiTiet/0', data={'row_id': chi_tiet[0]}).status_code == 200
+    assert client.post('/delete-row/Sizing/0', data={'row_id': sizing[2]}).status_code == 200
+
+    incremental = module.dashboard_summary()
+    assert incremental == _summary_after_rebuild(module)
+    assert set(incremental['chitiet_group_totals']) == {'B'}
+    assert incremental['chitiet_group_totals']['B']['RAM(GB)'] == 0.2
+    assert incremental['sizing_summary_years'] == [2024, 2025]
+    ductn = next(r for r in incremental['sizing_summary_rows'] if r['owner'] == 'ductn8')
+    assert ductn['quarters'][2025] == {1: 0, 2: 0, 3: 1, 4: 0}
+
+def test_dashboard_summary_endpoint(load_app):
+    module = load_app()
+    row_id = module.data_store['ChiTiet'][0]['row_id']
+    post_edits(module.app.test_client(), ('ChiTiet', row_id, 'Nhóm tài nguyên', 'G'), ('ChiTiet', row_id, 'vCPU', '4'))
+    body = module.app.test_client().get('/dashboard-summary').get_json()
+    assert body['chi_tiet']['groups']['G']['vCPU'] == 4.0
+    assert body['chi_tiet']['total']['vCPU'] == 4.0
@@ -0,0 +1,55 @@
+"""Test parse ngày có cache (`parse_date_value`): khớp kết quả pandas, LRU giới hạn và endpoint `/debug-date-cache`."""
+from datetime import datetime
+
+import pandas as pd
+import pytest
+
+VALUES = ['05/03/2025', ' 5/3/2025 ', '31/12/2024', '2025-03-05', '05/03/2025 10:30', '13/25/2025', '30/02/2025',
+          '', 'không phải ngày', 45000, 45000.0, float('nan'), None, datetime(2025, 3, 5, 8), pd.Timestamp('2025-03-05'),
+          True, '1/1/0999', '01/01/3000']
+
+def _baseline(val):
+    if val is None or val == '':
+        return None
+    try:
+        dt = pd.to_datetime(val, dayfirst=True, errors='coerce')
+    except Exception:
+        return None
+    return None if pd.isna(dt) else dt
+
+@pytest.mark.parametrize('val', VALUES, ids=repr)
+def test_matches_pandas(app_module, val):
+    # Lần đầu (miss) và lần hai (hit) đều cho cùng kết quả như pandas
+    expected = _baseline(val)
+    for _ in range(2):
+        assert app_module._parse_date(val) == expected
+
+def test_cache_is_bounded_lru(load_app):
+    module = load_app(DATE_PARSE_CACHE_SIZE='3')
+    module._date_cache.clear()
+    for day in (1, 2, 3):
+        module.parse_date_value(f'0{day}/01/2025')
+    module.parse_date_value('01/01/2025')  # dùng lại -> thành mới nhất
+    module.parse_date_value('04/01/2025')  # đẩy ra mục ít dùng nhất: 02/01
+    assert [key[1] for key in module._date_cache] == ['03/01/2025', '01/01/2025', '04/01/2025']
+    info = module.date_cache_info()
+    assert (info['size'], info['max_size']) == (3, 3)
+
+def test_hits_and_fast_path_are_counted(load_app):
+    module = load_app()
+    before = module.date_cache_info()
+    module.parse_date_value('07/07/2031')
+    module.parse_date_value('07/07/2031')
+    module.parse_date_value('2031-07-08')
+    after = module.date_cache_info()
+    assert after['hits'] - before['hits'] == 1
+    assert after['misses'] - before['misses'] == 2
+    assert after['fast_path'] - before['fast_path'] == 1
+    assert after['fallback'] - before['fallback'] == 1
+
+def test_debug_date_cache_requires_admin(load_app):
+    assert load_app().app.test_client().get('/debug-date-cache').status_code == 404
+    client = load_app(ADMIN_TOKEN='admin').app.test_client()
+    assert client.get('/debug-date-cache').status_code == 403
+    response = client.get('/debug-date-cache', headers={'X-Admin-Token': 'admin'})
+    assert response.status_code == 200 and {'hits', 'misses', 'hit_rate', 'size'} <= set(response.get_json())
@@ -0,0 +1,68 @@
+"""Test chỉ mục mốc cảnh báo (`DeadlineIndex`) và lượt thu thập cảnh báo WhatsApp."""
+from datetime import date, timedelta
+
+def _sizing_row(module, kpi, **values):
+    row = module.blank_row(module._sheet_columns('Sizing'))
+    row.update({'Thời gian hoàn thành theo KPI': kpi, **values})
+    return row
+
+def _ddmmyyyy(day):
+    return day.strftime('%d/%m/%Y')
+
+def _due(module, today=None):
+    return sorted(module._due_deadline_events(today))
+
+def test_deadline_index_pops_events_inside_their_window(app_module):
+    index = app_module.DeadlineIndex()
+    index.set_row('Sizing', 'r1', [(10, 12, 'kpi_due', 'x'), (15, 15, 'kpi_late_1', 'y')])
+    assert index.pop_due(9) == []
+    assert index.pop_due(11) == [('Sizing', 'r1', 'kpi_due', 'x')]
+    assert index.pop_due(13) == []
+    assert index.pop_due(15) == [('Sizing', 'r1', 'kpi_late_1', 'y')]
+
+def test_deadline_index_drops_replaced_and_forgotten_rows(app_module):
+    index = app_module.DeadlineIndex()
+    index.set_row('Sizing', 'r1', [(10, 10, 'kpi_due', 'old')])
+    index.set_row('Sizing', 'r1', [(10, 10, 'kpi_due', 'new')])
+    index.set_row('CapPhat', 'r2', [(10, 10, 'sr_due', 'z')])
+    index.forget_row('CapPhat', 'r2')
+    assert index.pop_due(10) == [('Sizing', 'r1', 'kpi_due', 'new')]
+
+def test_incremental_updates_match_a_full_rebuild(load_app):
+    module = load_app()
+    today = date.today()
+    rows = [_sizing_row(module, _ddmmyyyy(today + timedelta(days=offset))) for offset in range(-3, 6)]
+    module._set_sheet_rows('Sizing', rows)
+    before = _due(module)
+    assert before, 'KPI hôm nay/trong vài ngày tới phải sinh cảnh báo'
+
+    client = module.app.test_client()
+    ids = [row['row_id'] for row in module.data_store['Sizing']]
+    response = client.post('/update-cells', json={'edits': [
+        {'sheet': 'Sizing', 'rowId': ids[0], 'col': 'Thời gian hoàn thành theo KPI', 'value': _ddmmyyyy(today)},
+        {'sheet': 'Sizing', 'rowId': ids[4], 'col': 'Thời gian hoàn thành theo KPI', 'value': ''},
+    ]})
+    assert response.status_code == 200
+    assert client.post('/delete-row/Sizing/0', data={'row_id': ids[3]}).status_code == 200
+    incremental = _due(module)
+
+    module._deadline_index.signature = None  # buộc dựng lại từ toàn bộ sheet
+    assert incremental == _due(module)
+    assert all(rid != ids[3] for _, rid, _, _ in incremental)
+    assert ('Sizing', ids[0], 'kpi_due', _ddmmyyyy(today)) in incremental
+
+def test_alert_collection_refreshes_progress_under_sizing_write_lock(load_app, monkeypatch):
+    module = load_app()
+    module._set_sheet_rows('Sizing', [_sizing_row(module, _ddmmyyyy(date.today()), **{'Tiến độ': 'cũ'})])
+    held = []
+    refresh = module._refresh_sizing_progress
+
+    def spy(rows=None, today=None):
+        held.append((len(rows), module._held_sheet_writes().get('Sizing', 0)))
+        return refresh(rows, today)
+
+    monkeypatch.setattr(module, '_refresh_sizing_progress', spy)
+    messages = module._collect_whatsapp_alerts()
+    assert messages and {m['kind'] for m in messages} == {'kpi_due'}
+    assert held == [(1, 1)]
+    assert module.data_store['Sizing'][0]['Tiến độ'] != 'cũ'
@@ -0,0 +1,64 @@
+"""Test ETag/304 và nén response cho trang chính, partial sheet và `/dashboard-summary`."""
+import gzip
+
+import pytest
+
+from helpers import post_edits
+
+def _get(client, url, etag=None, encoding=None):
+    headers = {}
+    if etag:
+        headers['If-None-Match'] = etag
+    if encoding:
+        headers['Accept-Encoding'] = encoding
+    return client.get(url, headers=headers)
+
+@pytest.fixture
+def module(load_app):
+    return load_app()
+
+@pytest.mark.parametrize('url', ['/', '/sheet/CapPhat', '/sheet/CapPhat/rows?offset=0', '/dashboard-summary'])
+def test_unchanged_data_is_304(module, url):
+    client = module.app.test_client()
+    first = _get(client, url)
+    etag = first.headers['ETag']
+    assert first.status_code == 200 and first.headers['Cache-Control'] == 'no-cache'
+    second = _get(client, url, etag)
+    assert second.status_code == 304 and second.get_data() == b'' and second.headers['ETag'] == etag
+
+def test_edit_changes_only_affected_sheet_etags(module):
+    client = module.app.test_client()
+    etags = {url: _get(client, url).headers['ETag'] for url in ('/', '/sheet/CapPhat', '/sheet/Cloud', '/dashboard-summary')}
+    post_edits(client, ('CapPhat', module.data_store['CapPhat'][0]['row_id'], 'Mã SR', 'SR-9'))
+    status = {url: _get(client, url, etag).status_code for url, etag in etags.items()}
+    assert status == {'/': 200, '/sheet/CapPhat': 200, '/sheet/Cloud': 304, '/dashboard-summary': 304}
+
+def test_row_and_column_changes_change_etag(module):
+    client = module.app.test_client()
+    etag = _get(client, '/sheet/Cloud').headers['ETag']
+    assert client.post('/add-row/Cloud/0').status_code == 200
+    assert _get(client, '/sheet/Cloud', etag).status_code == 200
+    etag = _get(client, '/sheet/Cloud').headers['ETag']
+    assert client.post('/handle-col/Cloud/insert/1', data={'new_col_name': 'Mới'}).status_code == 200
+    assert _get(client, '/sheet/Cloud', etag).status_code == 200
+
+def test_holiday_config_changes_etag(module, monkeypatch):
+    client = module.app.test_client()
+    etag = _get(client, '/sheet/Sizing').headers['ETag']
+    monkeypatch.setenv('PUBLIC_HOLIDAYS', '15/08')
+    assert _get(client, '/sheet/Sizing', etag).status_code == 200
+
+def test_new_process_does_not_match_old_etag(load_app):
+    # Phiên bản dữ liệu đếm lại từ đầu ở tiến trình mới: ETag cũ không được khớp nhầm
+    etag = _get(load_app().app.test_client(), '/').headers['ETag']
+    assert _get(load_app().app.test_client(), '/', etag).status_code == 200
+
+def test_compressed_response_has_its_own_etag(load_app):
+    client = load_app(COMPRESS_MIN_SIZE='10').app.test_client()
+    plain = _get(client, '/sheet/CapPhat')
+    zipped = _get(client, '/sheet/CapPhat', encoding='gzip')
+    assert zipped.headers['Content-Encoding'] == 'gzip' and 'Accept-Encoding' in zipped.headers['Vary']
+    assert gzip.decompress(zipped.get_data()) == plain.get_data()
+    assert zipped.headers['ETag'] == plain.headers['ETag'][:-1] + '-gzip"'
+    not_modified = _get(client, '/sheet/CapPhat', zipped.headers['ETag'], encoding='gzip')
+    assert not_modified.status_code == 304 and not_modified.headers['ETag'] == zipped.headers['ETag']
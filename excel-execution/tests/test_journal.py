@@ -0,0 +1,118 @@
+"""Test lưu dữ liệu: nhật ký chỉnh sửa, compaction và khôi phục sau khi dừng đột ngột hoặc khởi động lại."""
+import json
+import os
+import shutil
+
+import pytest
+
+from helpers import post_edits, row_versions, sheet_snapshot
+
+@pytest.mark.parametrize('backend', ['json', 'sqlite'])
+@pytest.mark.parametrize('engine', ['rows', 'columnar'])
+def test_edits_survive_restart(load_app, engine, backend):
+    first = load_app(DATA_STORE_ENGINE=engine, STORAGE_BACKEND=backend)
+    client = first.app.test_client()
+    for sheet in ('Sizing', 'CapPhat', 'ChiTiet'):
+        assert client.post(f'/add-row/{sheet}/-1').status_code == 200
+    sizing = [row['row_id'] for row in first.data_store['Sizing']]
+    cap_phat = [row['row_id'] for row in first.data_store['CapPhat']]
+    post_edits(client,
+               ('Sizing', sizing[0], 'Mã PYC', 'PYC-001'),
+               ('Sizing', sizing[0], 'Thời gian hoàn thành theo KPI', '15/01/2030'),
+               ('CapPhat', cap_phat[1], 'Mã SR', 'SR-42'))
+    # Compaction giữa chừng: phần sau nằm trong nhật ký (hoặc SQLite) sau snapshot mới
+    first.save_cache()
+    post_edits(client, ('Sizing', sizing[2], 'Ghi chú', 'sau compaction'), ('CapPhat', cap_phat[1], 'Dự án', 'Dự án A'))
+    assert client.post('/delete-row/Sizing/0', data={'row_id': sizing[1]}).status_code == 200
+    assert client.post('/add-row/ChiTiet/0').status_code == 200
+    expected, versions = sheet_snapshot(first), row_versions(first)
+
+    restarted = load_app(DATA_STORE_ENGINE=engine, STORAGE_BACKEND=backend)
+    assert sheet_snapshot(restarted) == expected
+    assert row_versions(restarted) == versions
+    assert restarted.get_row_by_id('Sizing', sizing[0])['Tiến độ'] == first.get_row_by_id('Sizing', sizing[0])['Tiến độ']
+
+    # Phiên bản hàng client giữ từ trước khi khởi động lại vẫn được chấp nhận; phiên bản lạ -> 409
+    client = restarted.app.test_client()
+    edit = {'sheet': 'Sizing', 'rowId': sizing[2], 'col': 'Ghi chú', 'value': 'x'}
+    assert client.post('/update-cells', json={'edits': [dict(edit, version=versions[('Sizing', sizing[2])])]}).status_code == 200
+    store, seq = versions[('Sizing', sizing[2])].split('.')
+    stale = client.post('/update-cells', json={'edits': [dict(edit, value='y', version=f'{store}0.{seq}')]})
+    assert stale.status_code == 409
+
+def _journal_ops(module):
+    with open(module.CACHE_JOURNAL_FILE, encoding='utf-8') as f:
+        return [json.loads(line)['op'] for line in f]
+
+def _make_edits(module):
+    client = module.app.test_client()
+    rows = [row['row_id'] for row in module.data_store['Sizing']]
+    post_edits(client, ('Sizing', rows[0], 'Ghi chú', 'một'), ('Sizing', rows[1], 'Mã PYC', 'P-2'))
+    assert client.post('/add-row/Sizing/0').status_code == 200
+    assert client.post('/delete-row/Sizing/0', data={'row_id': rows[2]}).status_code == 200
+    return client, rows
+
+def test_edits_are_appended_and_compacted(load_app):
+    module = load_app(CACHE_COMPACT_EVERY='6')
+    module.save_cache()
+    snapshot_mtime = os.stat(module.CACHE_FILE).st_mtime_ns
+    client, rows = _make_edits(module)
+    # 2 ô + 1 thêm + 1 xoá: chỉ nối vào nhật ký, snapshot không bị ghi lại
+    assert _journal_ops(module) == ['header', 'set', 'set', 'insert', 'delete']
+    assert os.stat(module.CACHE_FILE).st_mtime_ns == snapshot_mtime
+    post_edits(client, ('Sizing', rows[0], 'Ghi chú', 'hai'), ('Sizing', rows[1], 'Ghi chú', 'ba'))
+    # Đủ CACHE_COMPACT_EVERY bản ghi -> snapshot mới, nhật ký chỉ còn header của generation mới
+    assert _journal_ops(module) == ['header']
+    with open(module.CACHE_FILE, encoding='utf-8') as f:
+        saved = json.load(f)
+    assert saved['_meta']['generation'] == module._journal_state['generation']
+    assert {r['row_id']: r['Ghi chú'] for r in saved['Sizing']}[rows[1]] == 'ba'
+
+def test_crash_before_compaction_replays_journal(load_app):
+    module = load_app()
+    module.save_cache()
+    _make_edits(module)
+    expected = sheet_snapshot(module)
+    # Dừng đột ngột: chưa có compaction, thay đổi chỉ nằm trong nhật ký
+    assert sheet_snapshot(load_app()) == expected
+
+def test_crash_after_snapshot_before_journal_reset_is_not_replayed_twice(load_app):
+    module = load_app()
+    module.save_cache()
+    _make_edits(module)
+    expected = sheet_snapshot(module)
+    journal = module.CACHE_JOURNAL_FILE
+    shutil.copy(journal, journal + '.old')
+    module.save_cache()
+    # Snapshot mới đã ghi xong nhưng tiến trình dừng trước khi đặt lại nhật ký: nhật ký vẫn mang generation cũ
+    os.replace(journal + '.old', journal)
+    restarted = load_app()
+    assert sheet_snapshot(restarted) == expected
+    # Ghi tiếp sau khởi động: nhật ký cũ được thay bằng snapshot mới trước khi nối bản ghi mới
+    row_id = restarted.data_store['Sizing'][0]['row_id']
+    post_edits(restarted.app.test_client(), ('Sizing', row_id, 'Ghi chú', 'sau khởi động'))
+    assert restarted.get_row_by_id('Sizing', row_id)['Ghi chú'] == 'sau khởi động'
+    assert load_app().get_row_by_id('Sizing', row_id)['Ghi chú'] == 'sau khởi động'
+
+def test_crash_while_writing_snapshot_keeps_previous_state(load_app):
+    module = load_app()
+    module.save_cache()
+    _make_edits(module)
+    expected = sheet_snapshot(module)
+    # Dừng giữa lúc ghi snapshot: chỉ có file tạm ghi dở, file chính và nhật ký còn nguyên
+    with open(module.CACHE_FILE + '.tmp', 'w', encoding='utf-8') as f:
+        f.write('{"Sizing": [')
+    assert sheet_snapshot(load_app()) == expected
+
+def test_torn_last_journal_line_is_dropped(load_app):
+    module = load_app()
+    module.save_cache()
+    client, rows = _make_edits(module)
+    expected = sheet_snapshot(module)
+    with open(module.CACHE_JOURNAL_FILE, 'a', encoding='utf-8') as f:
+        f.write('{"op":"set","sheet":"Sizing","row_id":"')
+    restarted = load_app()
+    assert sheet_snapshot(restarted) == expected
+    # Bản ghi sau khởi động không bị dính vào dòng ghi dở và được phát lại ở lần khởi động kế tiếp
+    post_edits(restarted.app.test_client(), ('Sizing', rows[0], 'Ghi chú', 'sau dòng hỏng'))
+    assert load_app().get_row_by_id('Sizing', rows[0])['Ghi chú'] == 'sau dòng hỏng'
@@ -0,0 +1,63 @@
+"""Test import ở chế độ merge: ghép hàng cũ/mới (`_merge_match`) và gộp vào sheet (`_merge_import`)."""
+
+import pytest
+
+def _rows(column, *values):
+    return [{column: v} for v in values]
+
+def _chi_tiet(*pairs):
+    return [{'Mã SR': sr, 'Dự án': project} for sr, project in pairs]
+
+def test_merge_match_pairs_duplicate_keys_in_order(app_module):
+    existing = _rows('Mã PYC', 'A', 'B', 'A')
+    incoming = _rows('Mã PYC', 'A', 'A', 'C', 'B')
+    assert app_module._merge_match('Sizing', existing, incoming) == [0, 2, None, 1]
+
+def test_merge_match_without_keys_is_positional(app_module):
+    assert app_module._merge_match('Cloud', [{}] * 3, [{}] * 2) == [0, 1]
+    assert app_module._merge_match('Cloud', [{}], [{}] * 3) == [0, None, None]
+
+def test_merge_match_falls_back_to_next_key(app_module):
+    # Hàng vừa được cấp Mã SR trong file vẫn khớp hàng cũ theo Dự án
+    assert app_module._merge_match('ChiTiet', _chi_tiet(('', 'X')), _chi_tiet(('SR1', 'X'))) == [0]
+
+def test_merge_match_keeps_different_first_keys_apart(app_module):
+    # Hai Mã SR khác nhau không bị ghép với nhau chỉ vì trùng Dự án
+    assert app_module._merge_match('ChiTiet', _chi_tiet(('S1', 'X')), _chi_tiet(('S2', 'X'))) == [None]
+
+def test_merge_match_pairs_empty_key_rows_by_position(app_module):
+    existing = _chi_tiet(('A', 'p'), ('', ''), ('B', ''), ('', ''))
+    incoming = _chi_tiet(('', ''), ('B', ''), ('A', 'p'), ('', ''), ('', ''))
+    assert app_module._merge_match('ChiTiet', existing, incoming) == [1, 2, 0, 3, None]
+
+def test_merge_match_empty_key_rows_only_pair_with_each_other(app_module):
+    existing = _chi_tiet(('', 'q'), ('', ''))
+    incoming = _chi_tiet(('N', 'q'), ('Z', ''))
+    assert app_module._merge_match('ChiTiet', existing, incoming) == [0, None]
+
+def _sizing(module, *pairs):
+    rows = []
+    for pyc, note in pairs:
+        row = module.blank_row(module._sheet_columns('Sizing'))
+        row.update({'Mã PYC': pyc, 'Ghi chú': note})
+        rows.append(row)
+    return rows
+
+def _pycs(module):
+    return [(row['Mã PYC'], row['Ghi chú']) for row in module.data_store['Sizing']]
+
+@pytest.mark.parametrize('keep_missing', [False, True])
+def test_merge_import_updates_inserts_and_deletes(load_app, keep_missing):
+    module = load_app()
+    module._set_sheet_rows('Sizing', _sizing(module, ('A', 'a'), ('B', 'b'), ('C', 'c')))
+    module.save_cache()
+    ids = {row['Mã PYC']: row['row_id'] for row in module.data_store['Sizing']}
+    with module.write_sheets():
+        summary = module._merge_import({'Sizing': _sizing(module, ('A', 'a'), ('N', 'mới'), ('C', 'đổi'))}, keep_missing)
+    assert summary['Sizing'] == {'matched': 2, 'updated': 1, 'cells': 1, 'unchanged': 1, 'inserted': 1,
+                                 'deleted': 0 if keep_missing else 1, 'kept': 1 if keep_missing else 0}
+    expected = [('A', 'a'), ('N', 'mới')] + ([('B', 'b')] if keep_missing else []) + [('C', 'đổi')]
+    assert _pycs(module) == expected
+    # Hàng khớp giữ row_id; thay đổi nằm trong nhật ký nên còn sau khi khởi động lại
+    assert module.get_row_by_id('Sizing', ids['C'])['Ghi chú'] == 'đổi'
+    assert _pycs(load_app()) == expected
@@ -0,0 +1,66 @@
+"""Test `/metrics` (định dạng Prometheus, giới hạn bằng token/IP) và endpoint debug `/debug-row-cache`."""
+import pytest
+
+def _scrape(module, headers=None, remote_addr='127.0.0.1'):
+    return module.app.test_client().get('/metrics', headers=headers or {},
+                                        environ_base={'REMOTE_ADDR': remote_addr})
+
+def _samples(text):
+    return {line.rsplit(' ', 1)[0]: float(line.rsplit(' ', 1)[1])
+            for line in text.splitlines() if line and not line.startswith('#')}
+
+def test_metrics_exposes_requests_and_state(load_app):
+    module = load_app()
+    client = module.app.test_client()
+    assert client.get('/').status_code == 200
+    response = _scrape(module)
+    assert response.status_code == 200
+    assert response.content_type.startswith('text/plain; version=0.0.4')
+    text = response.get_data(as_text=True)
+    assert '# TYPE excel_http_request_duration_seconds histogram' in text
+    samples = _samples(text)
+    assert samples['excel_http_requests_total{method="GET",route="index",status="200"}'] == 1
+    assert samples['excel_http_request_duration_seconds_count{route="index"}'] == 1
+    assert samples['excel_sheet_rows{sheet="Sizing"}'] == len(module.data_store['Sizing'])
+
+def test_metrics_counts_follow_calls(app_module):
+    app_module.metrics.describe('test_total', 'counter', 'Đếm thử.')
+    app_module.metrics.inc('test_total', 2, kind='a')
+    app_module.metrics.inc('test_total', kind='a')
+    app_module.metrics.observe('excel_alert_run_duration_seconds', 0.02)
+    samples = _samples(app_module.metrics.render())
+    assert samples['test_total{kind="a"}'] == 3
+    assert samples['excel_alert_run_duration_seconds_bucket{le="0.025"}'] >= 1
+
+def test_metrics_token(load_app):
+    module = load_app(METRICS_TOKEN='s3cret')
+    assert _scrape(module).status_code == 401
+    assert _scrape(module).headers['WWW-Authenticate'] == 'Bearer'
+    assert _scrape(module, {'Authorization': 'Bearer sai'}).status_code == 401
+    assert _scrape(module, {'Authorization': 'Basic s3cret'}).status_code == 401
+    assert _scrape(module, {'Authorization': 'Bearer s3cret'}).status_code == 200
+
+@pytest.mark.parametrize('allowed, addr, status', [
+    ('127.0.0.1', '127.0.0.1', 200),
+    ('127.0.0.1', '10.1.2.3', 403),
+    ('10.0.0.0/8, 192.168.1.5', '10.1.2.3', 200),
+    ('10.0.0.0/8', '::1', 403),
+    ('không-hợp-lệ', '127.0.0.1', 403),
+])
+def test_metrics_allowed_ips(load_app, allowed, addr, status):
+    assert _scrape(load_app(METRICS_ALLOWED_IPS=allowed), remote_addr=addr).status_code == status
+
+def test_metrics_token_and_ips_must_both_match(load_app):
+    module = load_app(METRICS_TOKEN='t', METRICS_ALLOWED_IPS='127.0.0.1')
+    assert _scrape(module, {'Authorization': 'Bearer t'}, remote_addr='10.0.0.1').status_code == 403
+    assert _scrape(module, remote_addr='127.0.0.1').status_code == 401
+    assert _scrape(module, {'Authorization': 'Bearer t'}).status_code == 200
+
+def test_debug_row_cache_requires_admin(load_app):
+    client = load_app().app.test_client()
+    assert client.get('/debug-row-cache').status_code == 404
+    client = load_app(ADMIN_TOKEN='admin').app.test_client()
+    assert client.get('/debug-row-cache').status_code == 403
+    assert client.get('/debug-row-cache', headers={'X-Admin-Token': 'sai'}).status_code == 403
+    response = client.get('/debug-row-cache', headers={'X-Admin-Token': 'admin'})
+    assert response.status_code == 200 and {'hits', 'misses', 'size'} <= set(response.get_json())
@@ -0,0 +1,35 @@
+"""Test chế độ nhiều worker: hai bản app dùng chung kho dữ liệu, mỗi bản thấy thay đổi của bản kia ở request kế tiếp."""
+import pytest
+
+from helpers import post_edits, sheet_snapshot
+
+@pytest.mark.parametrize('backend', ['json', 'sqlite'])
+def test_workers_see_each_others_changes(load_app, backend):
+    a = load_app(MULTI_WORKER='1', STORAGE_BACKEND=backend)
+    b = load_app(MULTI_WORKER='1', STORAGE_BACKEND=backend)
+    client_a, client_b = a.app.test_client(), b.app.test_client()
+    row_id = a.data_store['CapPhat'][0]['row_id']
+
+    version = post_edits(client_a, ('CapPhat', row_id, 'Mã SR', 'SR-A'))['versions'][row_id]
+    assert client_b.get('/sheet/CapPhat').status_code == 200  # request bất kỳ đồng bộ trước khi xử lý
+    assert b.get_row_by_id('CapPhat', row_id)['Mã SR'] == 'SR-A'
+    assert b.row_version('CapPhat', row_id) == version
+
+    assert client_b.post('/add-row/CapPhat/0').status_code == 200
+    post_edits(client_b, ('CapPhat', row_id, 'Dự án', 'từ B'))
+    # Phiên bản A đang giữ đã cũ sau khi B sửa hàng -> 409 ở A
+    stale = client_a.post('/update-cells', json={'edits': [
+        {'sheet': 'CapPhat', 'rowId': row_id, 'col': 'Mã SR', 'value': 'x', 'version': version}]})
+    assert stale.status_code == 409
+    assert sheet_snapshot(a) == sheet_snapshot(b)
+
+def test_compaction_by_one_worker_is_picked_up(load_app):
+    a = load_app(MULTI_WORKER='1', CACHE_COMPACT_EVERY='2')
+    b = load_app(MULTI_WORKER='1', CACHE_COMPACT_EVERY='2')
+    ids = [row['row_id'] for row in a.data_store['Sizing']]
+    client_a = a.app.test_client()
+    for i, row_id in enumerate(ids[:3]):
+        post_edits(client_a, ('Sizing', row_id, 'Ghi chú', f'lần {i}'))
+    assert b.sync_from_store()
+    assert sheet_snapshot(b) == sheet_snapshot(a)
+    assert not b.sync_from_store()
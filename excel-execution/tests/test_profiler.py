@@ -0,0 +1,62 @@
+"""Test profiler theo yêu cầu: chỉ admin (header `X-Admin-Token`) mới bật được, kết quả lưu vòng và tải về được."""
+import pytest
+
+ADMIN = {'X-Admin-Token': 'admin'}
+
+@pytest.fixture
+def client(load_app):
+    return load_app(ADMIN_TOKEN='admin', PROFILE_KEEP='2').app.test_client()
+
+def test_profile_flag_is_ignored_without_admin_token_configured(load_app):
+    client = load_app().app.test_client()
+    response = client.get('/sheet/Cloud', headers={'X-Profile': '1'})
+    assert response.status_code == 200 and 'X-Profile-Id' not in response.headers
+    assert client.get('/admin/profiles').status_code == 404
+    assert client.post('/admin/profile-scheduler').status_code == 404
+
+@pytest.mark.parametrize('headers, query', [
+    ({'X-Profile': '1'}, ''),
+    ({}, '?_profile=1'),
+    ({'X-Profile': '1', 'X-Admin-Token': 'sai'}, ''),
+    ({}, '?_profile=1&admin_token=admin'),  # token không được nhận qua query string
+])
+def test_profiling_requires_admin_header(client, headers, query):
+    response = client.get('/sheet/Cloud' + query, headers=headers)
+    assert response.status_code == 403 and 'X-Profile-Id' not in response.headers
+    assert client.get('/admin/profiles', headers=ADMIN).get_json()['profiles'] == []
+
+def test_admin_endpoints_reject_wrong_token(client):
+    for method, url in (('get', '/admin/profiles'), ('get', '/admin/profiles/x/top'), ('post', '/admin/profile-scheduler')):
+        assert getattr(client, method)(url).status_code == 403
+        assert getattr(client, method)(url, headers={'X-Admin-Token': 'sai'}).status_code == 403
+
+def test_profiled_request_is_saved_and_downloadable(client):
+    response = client.get('/sheet/Cloud', headers=dict(ADMIN, **{'X-Profile': '1'}))
+    assert response.status_code == 200 and b'<table' in response.get_data()
+    profile_id = response.headers['X-Profile-Id']
+    [meta] = client.get('/admin/profiles', headers=ADMIN).get_json()['profiles']
+    assert (meta['id'], meta['kind'], meta['label'], meta['status']) == (profile_id, 'request', 'sheet', 200)
+    top = client.get(f'/admin/profiles/{profile_id}/top', headers=ADMIN)
+    assert top.status_code == 200 and 'cumulative' in top.get_data(as_text=True)
+    collapsed = client.get(f'/admin/profiles/{profile_id}/collapsed', headers=ADMIN)
+    assert collapsed.status_code == 200 and 'attachment' in collapsed.headers['Content-Disposition']
+    assert client.get(f'/admin/profiles/{profile_id}/other', headers=ADMIN).status_code == 404
+    assert client.get('/admin/profiles/../top', headers=ADMIN).status_code == 404
+
+def test_inline_result_and_rotation(client):
+    ids = []
+    for _ in range(3):
+        response = client.get('/sheet/Cloud?_profile=top', headers=ADMIN)
+        assert response.mimetype == 'text/plain' and 'function calls' in response.get_data(as_text=True)
+        ids.append(response.headers['X-Profile-Id'])
+    listed = [p['id'] for p in client.get('/admin/profiles', headers=ADMIN).get_json()['profiles']]
+    assert listed == sorted(ids[1:], reverse=True)
+
+def test_scheduler_runs_can_be_armed(load_app):
+    module = load_app(ADMIN_TOKEN='admin')
+    client = module.app.test_client()
+    assert client.post('/admin/profile-scheduler?runs=1', headers=ADMIN).get_json()['runs'] == 1
+    assert module._run_scheduler_job(lambda: 42) == 42
+    assert module._run_scheduler_job(lambda: 43) == 43
+    profiles = client.get('/admin/profiles', headers=ADMIN).get_json()
+    assert [p['kind'] for p in profiles['profiles']] == ['scheduler'] and profiles['scheduler']['runs'] == 0
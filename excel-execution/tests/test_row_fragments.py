@@ -0,0 +1,92 @@
+"""Test cache fragment hàng (`row_fragment`): HTML ghép từ cache phải giống hệt render lại từ đầu sau mỗi thao tác."""
+from datetime import date
+
+import pytest
+
+from helpers import post_edits
+
+def _render(module, sheet):
+    response = module.app.test_client().get(f'/sheet/{sheet}?limit=50')
+    assert response.status_code == 200
+    return response.get_data(as_text=True)
+
+def _fresh(module, sheet):
+    with module._fragment_cache_lock:
+        module._fragment_cache.clear()
+    return _render(module, sheet)
+
+def _check(module, sheet):
+    """Render lần hai dùng cache; kết quả phải khớp bản render không dùng cache."""
+    _render(module, sheet)
+    hits = module.fragment_cache_info()['hits']
+    cached = _render(module, sheet)
+    assert module.fragment_cache_info()['hits'] > hits
+    assert cached == _fresh(module, sheet)
+    return cached
+
+@pytest.fixture
+def module(load_app):
+    return load_app()
+
+def _ids(module, sheet):
+    return [row['row_id'] for row in module.data_store[sheet]]
+
+def test_cell_edit_invalidates_only_that_row(module):
+    _check(module, 'CapPhat')
+    ids = _ids(module, 'CapPhat')
+    misses = module.fragment_cache_info()['misses']
+    post_edits(module.app.test_client(), ('CapPhat', ids[2], 'Mã SR', 'SR-<b>&'))
+    html = _render(module, 'CapPhat')
+    assert module.fragment_cache_info()['misses'] == misses + 1
+    assert 'SR-&lt;b&gt;&amp;' in html
+    assert html == _fresh(module, 'CapPhat')
+
+def test_added_and_deleted_rows_renumber_cached_rows(module):
+    _check(module, 'ChiTiet')
+    client = module.app.test_client()
+    assert client.post('/add-row/ChiTiet/-1').status_code == 200
+    html = _check(module, 'ChiTiet')
+    assert html.count('<tr') >= len(module.data_store['ChiTiet'])
+    assert client.post('/delete-row/ChiTiet/0', data={'row_id': _ids(module, 'ChiTiet')[1]}).status_code == 200
+    _check(module, 'ChiTiet')
+
+def test_column_changes_invalidate_all_rows(module):
+    before = _check(module, 'Cloud')
+    client = module.app.test_client()
+    column = module._sheet_columns('Cloud')[1]
+    response = client.post('/update-col-name', json={'sheet': 'Cloud', 'colId': column, 'newCol': 'Tên mới'})
+    assert response.status_code == 204
+    after = _check(module, 'Cloud')
+    assert client.post('/handle-col/Cloud/insert/2', data={'new_col_name': 'Cột thêm'}).status_code == 200
+    inserted = _check(module, 'Cloud')
+    assert len({before, after, inserted}) == 3
+
+def test_sizing_progress_change_is_rendered(module):
+    _check(module, 'Sizing')
+    row_id = _ids(module, 'Sizing')[0]
+    post_edits(module.app.test_client(),
+               ('Sizing', row_id, 'Thời gian hoàn thành theo KPI', date.today().strftime('%d/%m/%Y')))
+    html = _check(module, 'Sizing')
+    assert 'Đến hạn' in html
+
+def test_progress_recomputed_without_version_change_is_rendered(module):
+    row = module.data_store['Sizing'][0]
+    _check(module, 'Sizing')
+    # 'Tiến độ' đổi khi sang ngày mới mà phiên bản hàng giữ nguyên: mô phỏng bằng cách đổi ngày KPI ngay trong bộ nhớ
+    version = module.row_version('Sizing', row['row_id'])
+    row['Thời gian hoàn thành theo KPI'] = date.today().strftime('%d/%m/%Y')
+    html = _render(module, 'Sizing')
+    assert module.row_version('Sizing', row['row_id']) == version
+    assert 'Đến hạn' in html and html == _fresh(module, 'Sizing')
+
+def test_cache_can_be_disabled(load_app):
+    module = load_app(ROW_FRAGMENT_CACHE_SIZE='0')
+    _render(module, 'Cloud')
+    _render(module, 'Cloud')
+    assert module.fragment_cache_info()['size'] == 0 and module.fragment_cache_info()['hits'] == 0
+
+def test_cache_is_bounded(load_app):
+    module = load_app(ROW_FRAGMENT_CACHE_SIZE='3')
+    html = _render(module, 'ChiTiet')
+    assert module.fragment_cache_info()['size'] == 3
+    assert _fresh(module, 'ChiTiet') == html
@@ -0,0 +1,80 @@
+"""Test backend SQLite: ghi từng bản ghi, thử lại khi lỗi và ghi lại toàn bộ chỉ khi import."""
+import sqlite3
+
+import pytest
+
+from store_sqlite import _sql_ident
+
+@pytest.fixture
+def sqlite_app(load_app):
+    return load_app(STORAGE_BACKEND='sqlite', SQLITE_APPLY_RETRIES='2')
+
+def _stored(module, sheet, row_id, col):
+    conn = sqlite3.connect(module.SQLITE_FILE)
+    try:
+        found = conn.execute(f'SELECT {_sql_ident(col)} FROM {module.SQLITE_TABLES[sheet]} WHERE row_id = ?',
+                             (row_id,)).fetchone()
+    finally:
+        conn.close()
+    return found[0] if found else None
+
+def _edit(client, row_id, value):
+    return client.post('/update-cells', json={'edits': [
+        {'sheet': 'Sizing', 'rowId': row_id, 'col': 'Ghi chú', 'value': value}]})
+
+def test_new_store_is_initialised_and_edits_are_incremental(sqlite_app, monkeypatch):
+    row_id = sqlite_app.data_store['Sizing'][0]['row_id']
+    full_writes = []
+    monkeypatch.setattr(sqlite_app._sqlite_store, 'save_all', lambda *a, **k: full_writes.append(a))
+    response = _edit(sqlite_app.app.test_client(), row_id, 'đã lưu')
+    assert response.status_code == 200
+    assert _stored(sqlite_app, 'Sizing', row_id, 'Ghi chú') == 'đã lưu'
+    assert full_writes == []
+
+def test_locked_store_is_retried(sqlite_app, monkeypatch):
+    row_id = sqlite_app.data_store['Sizing'][0]['row_id']
+    apply, calls = sqlite_app._sqlite_store.apply, []
+
+    def flaky(records):
+        calls.append(len(records))
+        if len(calls) < 3:
+            raise sqlite3.OperationalError('database is locked')
+        return apply(records)
+
+    monkeypatch.setattr(sqlite_app._sqlite_store, 'apply', flaky)
+    assert _edit(sqlite_app.app.test_client(), row_id, 'lần 3').status_code == 200
+    assert len(calls) == 3
+    assert _stored(sqlite_app, 'Sizing', row_id, 'Ghi chú') == 'lần 3'
+
+def test_failed_write_is_reported_without_full_rewrite(sqlite_app, monkeypatch):
+    row_id = sqlite_app.data_store['Sizing'][0]['row_id']
+    client = sqlite_app.app.test_client()
+    assert _edit(client, row_id, 'trước').status_code == 200
+
+    def broken(records):
+        raise sqlite3.OperationalError('disk I/O error')
+
+    full_writes = []
+    monkeypatch.setattr(sqlite_app._sqlite_store, 'apply', broken)
+    monkeypatch.setattr(sqlite_app._sqlite_store, 'save_all', lambda *a, **k: full_writes.append(a))
+    response = _edit(client, row_id, 'sau')
+    assert response.status_code == 503
+    assert full_writes == []
+    # Bộ nhớ được nạp lại theo SQLite: không giữ thay đổi chưa lưu được
+    assert sqlite_app.get_row_by_id('Sizing', row_id)['Ghi chú'] == 'trước'
+    assert _stored(sqlite_app, 'Sizing', row_id, 'Ghi chú') == 'trước'
+
+def test_save_all_replaces_rows_without_recreating_tables(sqlite_app):
+    store = sqlite_app._sqlite_store
+    columns = list(sqlite_app._sheet_columns('Sizing'))
+    store.save_all({'Sizing': (columns, [{'row_id': 'a', 'Mã PYC': '1'}, {'row_id': 'b', 'Mã PYC': '2'}])})
+    conn = store.connect()
+    indexes = {r[0] for r in conn.execute("SELECT name FROM sqlite_master WHERE type = 'index' AND tbl_name = 'sizing'")}
+    store.save_all({'Sizing': (columns + ['col_new'], [{'row_id': 'c', 'Mã PYC': '3', 'col_new': 'x'}])})
+    assert [r['row_id'] for r in store.load_all()['Sizing']] == ['c']
+    assert store.load_all()['Sizing'][0]['col_new'] == 'x'
+    after = {r[0] for r in conn.execute("SELECT name FROM sqlite_master WHERE type = 'index' AND tbl_name = 'sizing'")}
+    assert indexes <= after
+    indexed = {r[2] for name in after for r in conn.execute(f'PRAGMA index_info({_sql_ident(name)})')}
+    assert {'pos', 'Thời gian hoàn thành theo KPI'} <= indexed
+    assert 'Mã PYC' not in indexed  # không nằm trong SQLITE_INDEXED_COLUMNS
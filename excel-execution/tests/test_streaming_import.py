@@ -0,0 +1,74 @@
+"""Test import streaming (openpyxl read-only, theo khối) so với đọc cả workbook bằng pandas."""
+import io
+from datetime import datetime
+
+import pytest
+from openpyxl import Workbook
+
+def _strip_ids(imported, skip=('row_id',)):
+    return {name: [{k: v for k, v in row.items() if k not in skip} for row in rows] for name, rows in imported.items()}
+
+def _workbook(module, path):
+    wb = Workbook()
+    wb.remove(wb.active)
+    for name in ('Sizing', 'ChiTiet', 'Cloud'):  # thiếu sheet Cấp phát -> sheet rỗng
+        ws = wb.create_sheet(module.EXCEL_SHEET_NAMES[name])
+        columns = [module.column_name(name, c) for c in module._sheet_columns(name)]
+        header = columns[:-1] + ['Cột lạ', columns[1]]  # cột không có trong lược đồ, tên cột trùng
+        ws.append(header)
+        for i in range(23):
+            if i in (5, 6):
+                ws.append([None] * len(header))  # hàng trống ở giữa được giữ
+                continue
+            row = []
+            for j, col in enumerate(header):
+                if module._is_date_col_by_name(col):
+                    row.append(datetime(2025, 1 + i % 12, 1 + j % 28) if i % 3 else f'{1 + i % 28:02d}/03/2025')
+                elif col in module.CHI_TIET_NUMERIC_COLS:
+                    row.append([1, 2.5, '3', None, 'NA'][i % 5])
+                else:
+                    row.append(['ductn', f'giá trị {i}', 'N/A', 'x y', 'nan'][(i + j) % 5])
+            ws.append(row)
+        for _ in range(4):
+            ws.append([None] * len(header))  # hàng trống cuối sheet bị bỏ
+    wb.save(path)
+
+@pytest.mark.parametrize('chunk_rows', [1, 4, 1000])
+def test_streaming_matches_pandas(app_module, tmp_path, chunk_rows):
+    path = str(tmp_path / 'book.xlsx')
+    _workbook(app_module, path)
+    streamed = app_module._read_workbook_streaming(path, chunk_rows=chunk_rows)
+    assert _strip_ids(streamed) == _strip_ids(app_module._read_workbook_pandas(path))
+    assert [len(streamed[name]) for name in app_module.SHEET_NAMES] == [23, 0, 23, 23]
+    assert streamed['Sizing'][5] == dict(app_module.blank_row(app_module._sheet_columns('Sizing')),
+                                         row_id=streamed['Sizing'][5]['row_id'])
+
+def test_import_endpoint_streams_on_request(load_app, tmp_path, monkeypatch):
+    module = load_app()
+    path = str(tmp_path / 'book.xlsx')
+    _workbook(module, path)
+    calls = []
+    stream = module._read_workbook_streaming
+    monkeypatch.setattr(module, '_read_workbook_streaming', lambda p: calls.append(p) or stream(p, chunk_rows=3))
+    with open(path, 'rb') as f:
+        data = {'excel_file': (io.BytesIO(f.read()), 'book.xlsx'), 'stream': '1'}
+    response = module.app.test_client().post('/import', data=data, content_type='multipart/form-data')
+    assert response.status_code == 200
+    assert len(calls) == 1
+    # STT được đánh lại sau import
+    skip = ('row_id', 'STT')
+    assert _strip_ids({'ChiTiet': module.data_store['ChiTiet']}, skip) == _strip_ids(
+        {'ChiTiet': module._read_workbook_pandas(path)['ChiTiet']}, skip)
+
+def test_small_or_legacy_files_use_pandas(load_app, tmp_path):
+    module = load_app(IMPORT_STREAM_THRESHOLD_MB='1')
+    path = tmp_path / 'book.xlsx'
+    path.write_bytes(b'x' * 10)
+    with module.app.test_request_context('/import', method='POST'):
+        assert not module._use_streaming_import(str(path), 'book.xlsx')
+        assert not module._use_streaming_import(str(path), 'book.xls')
+    path.write_bytes(b'x' * (1024 * 1024))
+    with module.app.test_request_context('/import', method='POST'):
+        assert module._use_streaming_import(str(path), 'book.xlsx')
+    with module.app.test_request_context('/import', method='POST', data={'stream': '0'}):
+        assert not module._use_streaming_import(str(path), 'book.xlsx')
@@ -0,0 +1,73 @@
+"""Test sửa nhiều ô trong một request (`/update-cells`): kiểm tra trước rồi mới áp dụng, 400/409 kèm `index`."""
+import pytest
+
+from helpers import post_edits, sheet_snapshot
+
+@pytest.fixture
+def module(load_app):
+    return load_app(UPDATE_CELLS_MAX='3')
+
+def _ids(module, sheet='Sizing'):
+    return [row['row_id'] for row in module.data_store[sheet]]
+
+def test_edits_are_applied_together_and_return_versions(module):
+    client = module.app.test_client()
+    sizing, cap_phat = _ids(module), _ids(module, 'CapPhat')
+    result = post_edits(client, ('Sizing', sizing[0], 'Ghi chú', 'a'), ('CapPhat', cap_phat[0], 'Mã SR', 'SR-1'))
+    assert result['applied'] == 2
+    assert module.get_row_by_id('Sizing', sizing[0])['Ghi chú'] == 'a'
+    assert module.get_row_by_id('CapPhat', cap_phat[0])['Mã SR'] == 'SR-1'
+    assert result['versions'] == {sizing[0]: module.row_version('Sizing', sizing[0]),
+                                  cap_phat[0]: module.row_version('CapPhat', cap_phat[0])}
+
+@pytest.mark.parametrize('bad, error', [
+    ({'sheet': ['Sizing'], 'col': 'Ghi chú'}, 'Invalid sheet'),
+    ({'sheet': 'Không có', 'col': 'Ghi chú'}, 'Invalid sheet'),
+    ({'sheet': 'Sizing', 'col': 'Không có'}, 'Invalid column'),
+    ({'sheet': 'Sizing', 'col': ['Ghi chú']}, 'Invalid column'),
+    ({'sheet': 'Sizing', 'rowId': ['x'], 'col': 'Ghi chú'}, 'Invalid row id'),
+    ('không phải object', 'Invalid sheet'),
+])
+def test_invalid_edit_rejects_whole_batch(module, bad, error):
+    client = module.app.test_client()
+    row_id = _ids(module)[0]
+    before = sheet_snapshot(module)
+    if isinstance(bad, dict) and 'rowId' not in bad:
+        bad = dict(bad, rowId=row_id)
+    edits = [{'sheet': 'Sizing', 'rowId': row_id, 'col': 'Ghi chú', 'value': 'không được ghi'}, bad]
+    response = client.post('/update-cells', json={'edits': edits})
+    assert response.status_code == 400
+    assert response.get_json() == {'error': error, 'index': 1}
+    assert sheet_snapshot(module) == before
+
+def test_stale_version_is_409_with_index_and_nothing_applied(module):
+    client = module.app.test_client()
+    ids = _ids(module)
+    version = post_edits(client, ('Sizing', ids[1], 'Ghi chú', 'v1'))['versions'][ids[1]]
+    post_edits(client, ('Sizing', ids[1], 'Ghi chú', 'v2'))  # request khác sửa hàng sau khi client đọc
+    before = sheet_snapshot(module)
+    response = client.post('/update-cells', json={'edits': [
+        {'sheet': 'Sizing', 'rowId': ids[0], 'col': 'Ghi chú', 'value': 'x'},
+        {'sheet': 'Sizing', 'rowId': ids[1], 'col': 'Ghi chú', 'value': 'x', 'version': version},
+    ]})
+    assert response.status_code == 409
+    body = response.get_json()
+    assert (body['index'], body['row_id'], body['version']) == (1, ids[1], module.row_version('Sizing', ids[1]))
+    assert sheet_snapshot(module) == before
+
+def test_deleted_row_is_409(module):
+    client = module.app.test_client()
+    row_id = _ids(module)[0]
+    assert client.post('/delete-row/Sizing/0', data={'row_id': row_id}).status_code == 200
+    response = client.post('/update-cells', json={'edits': [
+        {'sheet': 'Sizing', 'rowId': row_id, 'col': 'Ghi chú', 'value': 'x'}]})
+    assert response.status_code == 409 and response.get_json()['version'] is None
+
+def test_too_many_edits_is_400(module):
+    row_id = _ids(module)[0]
+    edits = [{'sheet': 'Sizing', 'rowId': row_id, 'col': 'Ghi chú', 'value': str(i)} for i in range(4)]
+    assert module.app.test_client().post('/update-cells', json={'edits': edits}).status_code == 400
+
+def test_single_cell_endpoint_rejects_non_string_sheet(module):
+    response = module.app.test_client().post('/update-cell', json={'sheet': ['Sizing'], 'row': 0, 'col': 'Ghi chú'})
+    assert response.status_code == 400
@@ -0,0 +1,127 @@
+"""Test lượt chạy cảnh báo WhatsApp: gom tin tổng hợp (digest) và outbox chống gửi trùng."""
+import pytest
+
+def _alert(row_id, to='whatsapp:+1', body=None, kind='kpi_due', due='01/01/2030'):
+    return {'sheet': 'Sizing', 'row_id': row_id, 'kind': kind, 'due': due, 'to': to,
+            'body': body if body is not None else f'Cảnh báo {row_id}'}
+
+def _lines(messages):
+    return [line.removeprefix('(tiếp) ') for m in messages for line in m['body'].split('\n')]
+
+def test_single_alert_is_sent_unchanged(app_module):
+    alert = _alert('r1')
+    assert app_module._build_digest_messages([alert], max_chars=100) == [alert]
+
+def test_digest_groups_by_recipient_and_respects_limit(app_module):
+    alerts = [_alert(f'r{i}', to=f'whatsapp:+{i % 2}', body=f'Dòng {i} ' + 'x' * 30) for i in range(10)]
+    digests = app_module._build_digest_messages(alerts, max_chars=120)
+    assert {m['to'] for m in digests} == {'whatsapp:+0', 'whatsapp:+1'}
+    assert all(len(m['body']) <= 120 for m in digests)
+    for to in ('whatsapp:+0', 'whatsapp:+1'):
+        parts = [m for m in digests if m['to'] == to]
+        assert [m['body'].split('\n')[0] for m in parts] == [
+            f'TỔNG HỢP CẢNH BÁO (5 mục - phần {i}/{len(parts)})' for i in range(1, len(parts) + 1)]
+        assert sorted(item['row_id'] for m in parts for item in m['items']) == sorted(
+            a['row_id'] for a in alerts if a['to'] == to)
+    assert all(a['body'] in _lines(digests) for a in alerts)
+
+def test_oversized_alert_is_split_not_truncated(app_module):
+    long_body = '\n'.join(f'Dòng {i}: ' + ' '.join(['nội dung'] * 4) for i in range(12))
+    alerts = [_alert('ngắn', body='Tin ngắn'), _alert('dài', body=long_body)]
+    digests = app_module._build_digest_messages(alerts, max_chars=150)
+    assert len(digests) > 2
+    assert all(len(m['body']) <= 150 for m in digests)
+    # Mọi dòng của tin dài đều có mặt, đúng thứ tự; các đoạn sau được đánh dấu "(tiếp)"
+    lines = _lines(digests)
+    assert [line for line in lines if line.startswith('Dòng ')] == long_body.split('\n')
+    assert sum(m['body'].count('(tiếp) ') for m in digests) == len(digests) - 1
+    assert all('dài' in {item['row_id'] for item in m['items']} for m in digests[1:])
+
+def test_alert_without_line_breaks_is_split_by_words(app_module):
+    body = ' '.join(f'từ{i}' for i in range(200))
+    digests = app_module._build_digest_messages([_alert('r1', body=body)], max_chars=200)
+    assert len(digests) > 1 and all(len(m['body']) <= 200 for m in digests)
+    words = [w for m in digests for w in m['body'].split('\n\n', 1)[1].removeprefix('(tiếp) ').split()]
+    assert words == body.split()
+
+class FakeDispatcher:
+    def __init__(self, fail=()):
+        self.fail = set(fail)
+        self.sent = []
+
+    def dispatch(self, messages):
+        self.sent.append(messages)
+        results = []
+        for i, m in enumerate(messages):
+            ok = (len(self.sent), i) not in self.fail and m.get('row_id') not in self.fail
+            results.append({'ok': ok, 'to': m['to'], 'row_id': m.get('row_id'), 'kind': m.get('kind'),
+                            'due': m.get('due'), 'items': m.get('items'), 'sid': 'SM' if ok else None,
+                            'status_code': 201 if ok else 500, 'error': None if ok else 'lỗi'})
+        return results
+
+@pytest.fixture
+def alerts_app(load_app, monkeypatch):
+    module = load_app(WHATSAPP_OUTBOX_MAX_ATTEMPTS='2')
+    alerts = [_alert('r1'), _alert('r2', to='whatsapp:+2')]
+    monkeypatch.setattr(module, '_collect_whatsapp_alerts', lambda: [dict(a) for a in alerts])
+    return module, alerts
+
+def _use(module, monkeypatch, dispatcher):
+    monkeypatch.setattr(module, '_get_dispatcher', lambda: dispatcher)
+    return dispatcher
+
+def test_outbox_sends_each_alert_once(alerts_app, monkeypatch):
+    module, _ = alerts_app
+    dispatcher = _use(module, monkeypatch, FakeDispatcher())
+    first = module.run_whatsapp_alerts(digest=False)
+    assert (first['sent'], first['skipped']) == (2, 0)
+    second = module.run_whatsapp_alerts(digest=False)
+    assert (second['total'], second['skipped']) == (0, 2)
+    assert len(dispatcher.sent) == 1
+    assert {e['status'] for e in module._load_outbox().values()} == {'sent'}
+
+def test_failed_alerts_are_retried_up_to_max_attempts(alerts_app, monkeypatch):
+    module, _ = alerts_app
+    dispatcher = _use(module, monkeypatch, FakeDispatcher(fail={'r2'}))
+    for _ in range(3):
+        module.run_whatsapp_alerts(digest=False)
+    assert [[m['row_id'] for m in batch] for batch in dispatcher.sent] == [['r1', 'r2'], ['r2']]
+    entry = module._load_outbox()[module._outbox_key(_alert('r2', to='whatsapp:+2'))]
+    assert (entry['status'], entry['attempts']) == ('failed', 2)
+
+def test_split_alert_is_sent_only_when_every_part_succeeds(load_app, monkeypatch):
+    module = load_app(WHATSAPP_DIGEST_MAX_CHARS='120')
+    alerts = [_alert('dài', body='\n'.join('Dòng ' + 'y' * 40 for _ in range(6))), _alert('ngắn')]
+    monkeypatch.setattr(module, '_collect_whatsapp_alerts', lambda: [dict(a) for a in alerts])
+    dispatcher = _use(module, monkeypatch, FakeDispatcher(fail={(1, 0)}))  # lần chạy 1: phần đầu lỗi, các phần sau gửi được
+    module.run_whatsapp_alerts(digest=True)
+    outbox = module._load_outbox()
+    assert outbox[module._outbox_key(alerts[0])]['status'] == 'failed'
+    module.run_whatsapp_alerts(digest=True)
+    assert len(dispatcher.sent) == 2
+    assert {e['status'] for e in module._load_outbox().values()} == {'sent'}
+
+def test_outbox_survives_restart_and_resends_pending(load_app, monkeypatch):
+    alerts = [_alert('r1'), _alert('r2')]
+    first = load_app()
+    monkeypatch.setattr(first, '_collect_whatsapp_alerts', lambda: [dict(a) for a in alerts])
+    _use(first, monkeypatch, FakeDispatcher())
+    first.run_whatsapp_alerts(digest=False)
+    # Tiến trình dừng sau khi ghi 'pending' nhưng trước khi gửi xong: lượt sau gửi lại đúng mục đó
+    outbox = first._load_outbox()
+    outbox[first._outbox_key(alerts[1])]['status'] = 'pending'
+    first._save_outbox(outbox)
+
+    restarted = load_app()
+    monkeypatch.setattr(restarted, '_collect_whatsapp_alerts', lambda: [dict(a) for a in alerts])
+    dispatcher = _use(restarted, monkeypatch, FakeDispatcher())
+    report = restarted.run_whatsapp_alerts(digest=False)
+    assert [m['row_id'] for m in dispatcher.sent[0]] == ['r2']
+    assert (report['sent'], report['skipped']) == (1, 1)
+
+def test_outbox_drops_entries_past_retention(alerts_app):
+    module, alerts = alerts_app
+    key = module._outbox_key(alerts[0])
+    module._save_outbox({key: {'status': 'sent', 'created_at': '2000-01-01T00:00:00'},
+                         'moi': {'status': 'sent', 'created_at': '2999-01-01T00:00:00'}})
+    assert list(module._load_outbox()) == ['moi']
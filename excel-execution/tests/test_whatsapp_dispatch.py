@@ -0,0 +1,150 @@
+"""Test engine gửi WhatsApp (`WhatsAppDispatcher`) qua stub Twilio: thử lại, Retry-After, giới hạn tốc độ."""
+import json
+import socket
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs
+
+import pytest
+
+from whatsapp import WhatsAppDispatcher
+
+# --- Stub Twilio ---
+
+class TwilioStub:
+    """Server HTTP giả lập API Messages của Twilio.
+
+    Trả lần lượt các response trong `script` (status, headers, body JSON); hết script thì lặp lại phần tử cuối.
+    `requests` ghi lại (thời điểm, path, header Authorization, form) của từng request nhận được.
+    """
+
+    def __init__(self, script):
+        self.script = list(script)
+        self.requests = []
+        self._lock = threading.Lock()
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                length = int(self.headers.get('Content-Length') or 0)
+                form = {k: v[0] for k, v in parse_qs(self.rfile.read(length).decode('utf-8')).items()}
+                with stub._lock:
+                    stub.requests.append((time.monotonic(), self.path, self.headers.get('Authorization'), form))
+                    status, headers, body = stub.script.pop(0) if len(stub.script) > 1 else stub.script[0]
+                payload = json.dumps(body).encode('utf-8')
+                self.send_response(status)
+                for key, value in headers.items():
+                    self.send_header(key, value)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.url = f'http://127.0.0.1:{self.server.server_port}'
+        self._thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self._thread.start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+@pytest.fixture
+def twilio_stub():
+    stubs = []
+
+    def start(*script):
+        stubs.append(TwilioStub(script))
+        return stubs[-1]
+
+    yield start
+    for stub in stubs:
+        stub.close()
+
+CREDENTIALS = {'account_sid': 'ACtest', 'auth_token': 'test-token', 'from_number': 'whatsapp:+10000000000'}
+
+"""Dispatcher không giới hạn tốc độ, backoff nhanh (0.01s) để test thử lại không phải chờ."""
+def _dispatcher(api_base, **kwargs):
+    options = {**CREDENTIALS, 'rate': 0, 'max_retries': 3, 'backoff_base': 0.01, **kwargs}
+    return WhatsAppDispatcher(api_base=api_base, **options)
+
+def _ok(sid):
+    return 201, {}, {'sid': sid}
+
+def test_send_posts_message_form(twilio_stub):
+    stub = twilio_stub(_ok('SM1'))
+    result = _dispatcher(stub.url).send({'to': 'whatsapp:+84900000001', 'body': 'xin chào', 'row_id': 'r1'})
+    assert result['ok'] and result['sid'] == 'SM1'
+    assert result['attempts'] == 1 and result['status_code'] == 201
+    assert result['row_id'] == 'r1' and 'body' not in result
+    _, path, auth, form = stub.requests[0]
+    assert path == '/2010-04-01/Accounts/ACtest/Messages.json'
+    assert auth.startswith('Basic ')
+    assert form == {'From': 'whatsapp:+10000000000', 'To': 'whatsapp:+84900000001', 'Body': 'xin chào'}
+
+def test_server_errors_are_retried(twilio_stub):
+    stub = twilio_stub((500, {}, {'message': 'lỗi'}), (503, {}, {'message': 'bận'}), _ok('SM2'))
+    result = _dispatcher(stub.url).send({'to': 'whatsapp:+1', 'body': 'x'})
+    assert result['ok'] and result['sid'] == 'SM2'
+    assert result['attempts'] == 3 and len(stub.requests) == 3
+
+def test_429_honours_retry_after(twilio_stub):
+    stub = twilio_stub((429, {'Retry-After': '1'}, {'message': 'Too Many Requests'}), _ok('SM3'))
+    result = _dispatcher(stub.url).send({'to': 'whatsapp:+1', 'body': 'x'})
+    assert result['ok'] and result['attempts'] == 2
+    # Backoff nhanh (0.01s) nhưng Retry-After của server được ưu tiên
+    assert stub.requests[1][0] - stub.requests[0][0] >= 0.9
+
+def test_client_error_is_not_retried(twilio_stub):
+    stub = twilio_stub((400, {}, {'message': 'Invalid To number'}))
+    result = _dispatcher(stub.url).send({'to': 'whatsapp:+1', 'body': 'x'})
+    assert not result['ok']
+    assert (result['attempts'], result['status_code'], result['error']) == (1, 400, 'Invalid To number')
+    assert len(stub.requests) == 1
+
+def test_retries_stop_after_max_retries(twilio_stub):
+    stub = twilio_stub((503, {}, {'message': 'down'}))
+    result = _dispatcher(stub.url, max_retries=2).send({'to': 'whatsapp:+1', 'body': 'x'})
+    assert not result['ok']
+    assert (result['attempts'], result['status_code'], result['error']) == (3, 503, 'down')
+    assert len(stub.requests) == 3
+
+def test_network_errors_are_retried():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        port = sock.getsockname()[1]
+    dispatcher = _dispatcher(f'http://127.0.0.1:{port}', max_retries=1)
+    result = dispatcher.send({'to': 'whatsapp:+1', 'body': 'x'})
+    assert not result['ok'] and result['attempts'] == 2
+    assert result['status_code'] is None and result['error'].startswith('ConnectionError')
+
+def test_missing_config_skips_request(twilio_stub):
+    stub = twilio_stub(_ok('SM4'))
+    result = _dispatcher(stub.url, auth_token='').send({'to': 'whatsapp:+1', 'body': 'x'})
+    assert not result['ok'] and result['attempts'] == 0 and result['error']
+    assert stub.requests == []
+
+def test_dispatch_is_rate_limited(twilio_stub):
+    rate, burst, count = 20.0, 2, 10
+    stub = twilio_stub(_ok('SM'))
+    dispatcher = _dispatcher(stub.url, workers=4, rate=rate, burst=burst)
+    started = time.monotonic()
+    results = dispatcher.dispatch([{'to': f'whatsapp:+{i}', 'body': str(i)} for i in range(count)])
+    assert [r['to'] for r in results] == [f'whatsapp:+{i}' for i in range(count)]
+    assert all(r['ok'] for r in results)
+    # Token bucket: `burst` tin đầu đi ngay, tin thứ k (k >= burst) không sớm hơn (k - burst + 1) / rate giây
+    stamps = sorted(entry[0] for entry in stub.requests)
+    for k in range(burst, count):
+        assert stamps[k] - started >= (k - burst + 1) / rate - 0.02
+
+def test_app_dispatcher_uses_app_config(app_module):
+    dispatcher = app_module._get_dispatcher()
+    assert dispatcher is app_module._get_dispatcher()
+    assert (dispatcher.account_sid, dispatcher.auth_token, dispatcher.from_number) == (
+        'ACtest', 'test-token', 'whatsapp:+10000000000')
+    assert dispatcher.url == 'http://127.0.0.1:9/2010-04-01/Accounts/ACtest/Messages.json'
+    assert (dispatcher.max_retries, dispatcher.backoff_base) == (app_module.WHATSAPP_MAX_RETRIES, app_module.WHATSAPP_BACKOFF_BASE)
@@ -0,0 +1,148 @@
+"""
+Engine gửi WhatsApp qua Twilio dùng chung cho mọi lần chạy cảnh báo.
+
+- Một `requests.Session` giữ kết nối keep-alive (pool `workers` kết nối)
+- Gửi song song bằng thread pool giới hạn `workers` luồng
+- Giới hạn tốc độ kiểu token bucket `rate` tin/giây (burst `burst`)
+- Thử lại khi lỗi mạng, HTTP 429 hoặc 5xx: tối đa `max_retries` lần, backoff luỹ thừa có jitter,
+  tôn trọng header `Retry-After`
+
+Module không đọc biến môi trường: thông tin Twilio và tham số gửi được truyền vào `WhatsAppDispatcher`
+(app.py dựng dispatcher từ cấu hình của mình).
+"""
+
+import json
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from email.utils import parsedate_to_datetime
+
+import requests
+import requests.adapters
+
+class _TokenBucket:
+    """Token bucket an toàn luồng: `acquire()` chờ tới khi được phép gửi thêm một tin."""
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self._tokens = float(burst)
+        self._stamp = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        if self.rate <= 0:
+            return
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._stamp) * self.rate)
+            self._stamp = now
+            # Cho phép âm: mỗi luồng "đặt chỗ" một token rồi ngủ tới lượt của mình ngoài khoá
+            self._tokens -= 1
+            wait = -self._tokens / self.rate if self._tokens < 0 else 0
+        if wait > 0:
+            time.sleep(wait)
+
+class WhatsAppDispatcher:
+    """Gửi một loạt tin WhatsApp qua Twilio và trả về kết quả cho từng tin (cùng thứ tự đầu vào).
+
+    Mỗi tin là dict có `to`, `body`, `variables` (tuỳ chọn); các khoá khác (sheet, row_id, kind...)
+    được chép sang kết quả để tiện đối chiếu. Thiếu `account_sid`/`auth_token`/`from_number` thì
+    không gọi API, kết quả báo lỗi cấu hình. `api_base` cho phép trỏ sang server giả lập khi kiểm thử.
+    """
+
+    def __init__(self, account_sid, auth_token, from_number, content_sid='', workers=4, rate=5.0, burst=5,
+                 max_retries=3, backoff_base=1.0, backoff_max=30.0, timeout=(5, 15),
+                 api_base='https://api.twilio.com'):
+        self.account_sid = account_sid
+        self.auth_token = auth_token
+        self.from_number = from_number
+        self.content_sid = content_sid
+        self.workers = workers
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.timeout = timeout  # (connect, read) giây
+        self.url = f"{api_base.rstrip('/')}/2010-04-01/Accounts/{account_sid}/Messages.json"
+        self.limiter = _TokenBucket(rate, burst)
+        self.session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=workers)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self.session.auth = (account_sid, auth_token)
+
+    def _payload(self, to_number, body, variables):
+        data = {
+            'From': self.from_number,
+            'To': to_number
+        }
+        if self.content_sid:
+            # Gửi bằng Content Template SID (tránh lỗi 63016 ngoài 24h window)
+            data['ContentSid'] = self.content_sid
+            if variables:
+                try:
+                    data['ContentVariables'] = json.dumps(variables, ensure_ascii=False)
+                except Exception:
+                    pass
+        else:
+            # Gửi freeform body (chỉ hoạt động trong 24h session)
+            data['Body'] = body
+        return data
+
+    def _retry_delay(self, attempt, resp):
+        retry_after = resp.headers.get('Retry-After') if resp is not None else None
+        if retry_after:
+            try:
+                return min(self.backoff_max, max(0.0, float(retry_after)))
+            except ValueError:
+                try:
+                    when = parsedate_to_datetime(retry_after)
+                    return min(self.backoff_max, max(0.0, when.timestamp() - time.time()))
+                except Exception:
+                    pass
+        delay = min(self.backoff_max, self.backoff_base * (2 ** (attempt - 1)))
+        return delay * (0.5 + random.random() / 2)
+
+    def send(self, message):
+        result = {k: v for k, v in message.items() if k not in ('body', 'variables')}
+        result.update({'ok': False, 'status_code': None, 'attempts': 0, 'error': None, 'sid': None})
+        to_number = message.get('to')
+        if not (self.account_sid and self.auth_token and self.from_number and to_number):
+            result['error'] = 'WhatsApp chưa được cấu hình hoặc thiếu số nhận'
+            return result
+        data = self._payload(to_number, message.get('body', ''), message.get('variables'))
+        for attempt in range(1, self.max_retries + 2):
+            self.limiter.acquire()
+            result['attempts'] = attempt
+            resp = None
+            try:
+                resp = self.session.post(self.url, data=data, timeout=self.timeout)
+            except requests.RequestException as e:
+                result['status_code'], result['error'] = None, f'{type(e).__name__}: {e}'
+                retryable = True
+            else:
+                result['status_code'] = resp.status_code
+                if resp.status_code in (200, 201):
+                    result['ok'], result['error'] = True, None
+                    try:
+                        result['sid'] = resp.json().get('sid')
+                    except Exception:
+                        pass
+                    return result
+                try:
+                    result['error'] = resp.json().get('message') or resp.text[:200]
+                except Exception:
+                    result['error'] = resp.text[:200]
+                retryable = resp.status_code == 429 or resp.status_code >= 500
+            if not retryable or attempt > self.max_retries:
+                break
+            time.sleep(self._retry_delay(attempt, resp))
+        return result
+
+    def dispatch(self, messages):
+        messages = list(messages)
+        if len(messages) <= 1 or self.workers <= 1:
+            return [self.send(m) for m in messages]
+        with ThreadPoolExecutor(max_workers=min(self.workers, len(messages)), thread_name_prefix='whatsapp') as pool:
+            return list(pool.map(self.send, messages))